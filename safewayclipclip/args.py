@@ -1,8 +1,35 @@
+import argparse
 import os
 
 BASE_PATH = os.path.join(os.path.expanduser("~"), "SafewayClipClip")
 
 
+def parse_min_discount(value):
+    """Parses --min-discount into ("dollars" or "percent", minimum)."""
+    text = value.strip()
+    field = "percent" if text.endswith("%") else "dollars"
+    try:
+        minimum = float(text.rstrip("%").lstrip("$"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            'expected dollars like "1.50" or a percent like "20%", got {!r}'.format(
+                value
+            )
+        )
+    return field, minimum
+
+
+def parse_positive_int(value):
+    """Parses a count which must be at least 1."""
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected an integer, got {!r}".format(value))
+    if number < 1:
+        raise argparse.ArgumentTypeError("must be at least 1, got {}".format(number))
+    return number
+
+
 def get_name_to_help_dict(parser):
     return dict([(a.dest, a.help) for a in parser._actions])
 
@@ -41,12 +68,328 @@ def define_common_args(parser):
             "home dir. Set to None to use a temporary profile."
         ),
     )
+    parser.add_argument(
+        "--session-store",
+        choices=["profile", "cookies"],
+        default="profile",
+        help=(
+            "How the login is saved between runs: profile keeps a full Chrome "
+            "profile in --session-path; cookies keeps only the cookies and "
+            "local storage login needs in --session-file, and starts Chrome "
+            "with a throwaway profile."
+        ),
+    )
+    parser.add_argument(
+        "--session-file",
+        default=None,
+        help=(
+            "Session file used with --session-store=cookies. Defaults to one "
+            "per --safeway_username in your home dir."
+        ),
+    )
+    parser.add_argument(
+        "--session-check-ttl-s",
+        type=float,
+        default=600,
+        help=(
+            "How long to trust the last check of whether the saved session is "
+            "logged in before checking again. 0 always checks."
+        ),
+    )
+    parser.add_argument(
+        "--safeway-url",
+        default=None,
+        help=(
+            "Base URL of the Safeway site. Defaults to the real site; override "
+            "to point at a local test server."
+        ),
+    )
     parser.add_argument(
         "--headless",
         action="store_true",
         default=False,
         help="Whether to execute chromedriver with no visible window.",
     )
+    parser.add_argument(
+        "--browser-profile",
+        choices=["normal", "lean"],
+        default=None,
+        help=(
+            "Browser resource profile. Lean blocks images, fonts, video, ads "
+            "and analytics, and disables extensions and background "
+            "networking. Defaults to lean when --headless, otherwise normal."
+        ),
+    )
+
+    parser.add_argument(
+        "--batch-clip",
+        action="store_true",
+        default=False,
+        help=(
+            "Clip all visible coupons with one in-page script call per page "
+            "instead of clicking each coupon individually."
+        ),
+    )
+    parser.add_argument(
+        "--batch-pacing-ms",
+        type=int,
+        default=250,
+        help="Delay between clicks, in milliseconds, when using --batch-clip.",
+    )
+    parser.add_argument(
+        "--tabs",
+        type=int,
+        default=1,
+        help=(
+            "Clip in this many tabs of the one browser at once, each taking a "
+            "share of the offers, so waits in one tab overlap clicks in the "
+            "others. Ignored with --batch-clip."
+        ),
+    )
+
+    parser.add_argument(
+        "--http-clip",
+        action="store_true",
+        default=False,
+        help=(
+            "After logging in, clip coupons directly against the Safeway "
+            "offer API using the browser's session. Any coupons which fail "
+            "are then clipped through the browser. Ignored when any offer "
+            "rule, such as --include-brand, is given."
+        ),
+    )
+    parser.add_argument(
+        "--http-base-url",
+        default=None,
+        help=(
+            "Base URL for the offer API when using --http-clip. Defaults to "
+            "the Safeway site; override to point at a local test server."
+        ),
+    )
+    parser.add_argument(
+        "--http-workers",
+        type=parse_positive_int,
+        default=4,
+        help="Max concurrent requests when using --http-clip.",
+    )
+
+    parser.add_argument(
+        "--wait-floor-s",
+        type=float,
+        default=0.0,
+        help=(
+            "Minimum seconds to wait after page loads and Load more clicks, "
+            "even if the page is ready sooner."
+        ),
+    )
+    parser.add_argument(
+        "--wait-ceiling-s",
+        type=float,
+        default=10.0,
+        help="Maximum seconds to wait for the page to become ready.",
+    )
+    parser.add_argument(
+        "--pacing",
+        choices=["human", "fixed", "none"],
+        default="human",
+        help=(
+            "Delay policy between clicks: human (random between the min and "
+            "max), fixed (always the min) or none."
+        ),
+    )
+    parser.add_argument(
+        "--pacing-min-ms",
+        type=int,
+        default=250,
+        help="Minimum delay between clicks, in milliseconds.",
+    )
+    parser.add_argument(
+        "--pacing-max-ms",
+        type=int,
+        default=1250,
+        help="Maximum delay between clicks, in milliseconds.",
+    )
+
+    parser.add_argument(
+        "--ledger-path",
+        default=os.path.join(BASE_PATH, "ledger.sqlite3"),
+        help=(
+            "SQLite file recording which offers were clipped or keep failing, "
+            "so later runs can skip them."
+        ),
+    )
+    parser.add_argument(
+        "--no-ledger",
+        action="store_true",
+        default=False,
+        help="Ignore the ledger and attempt every offer.",
+    )
+    parser.add_argument(
+        "--ledger-max-failures",
+        type=int,
+        default=3,
+        help="Runs an offer may fail to clip in before later runs skip it.",
+    )
+
+    parser.add_argument(
+        "--max-clip-attempts",
+        type=int,
+        default=3,
+        help="Clicks on a coupon which fails to clip before skipping it this run.",
+    )
+    parser.add_argument(
+        "--retry-backoff-s",
+        type=float,
+        default=0.5,
+        help=(
+            "Delay before retrying a coupon which failed to clip, doubling "
+            "with each failure."
+        ),
+    )
+    parser.add_argument(
+        "--max-failure-rate",
+        type=float,
+        default=0.5,
+        help=(
+            "Reload the page when at least this fraction of recent clips "
+            "fail, and give up after --max-page-reloads such reloads."
+        ),
+    )
+    parser.add_argument(
+        "--max-page-reloads",
+        type=int,
+        default=2,
+        help="Reloads after clips start failing before the run gives up.",
+    )
+
+    parser.add_argument(
+        "--include-brand",
+        action="append",
+        default=None,
+        help=(
+            "Only clip offers whose brand contains this (case-insensitive). "
+            "May be given more than once."
+        ),
+    )
+    parser.add_argument(
+        "--exclude-brand",
+        action="append",
+        default=None,
+        help="Skip offers whose brand contains this. May be given more than once.",
+    )
+    parser.add_argument(
+        "--include-category",
+        action="append",
+        default=None,
+        help=(
+            "Only clip offers whose category contains this (case-insensitive). "
+            "May be given more than once."
+        ),
+    )
+    parser.add_argument(
+        "--exclude-category",
+        action="append",
+        default=None,
+        help=(
+            "Skip offers whose category contains this. May be given more than "
+            "once."
+        ),
+    )
+    parser.add_argument(
+        "--min-discount",
+        type=parse_min_discount,
+        default=None,
+        help=(
+            'Skip offers worth less than this, in dollars (e.g. "1.50") or '
+            'percent (e.g. "20%%"). Offers with no comparable discount are '
+            "kept."
+        ),
+    )
+    parser.add_argument(
+        "--expires-within-days",
+        type=float,
+        default=None,
+        help="Only clip offers expiring within this many days.",
+    )
+    parser.add_argument(
+        "--priority",
+        choices=["page", "expiry", "discount"],
+        default="page",
+        help=(
+            "Order to clip offers in: page order, soonest expiry first, or "
+            "biggest discount first. Other than page, every page of offers is "
+            "loaded before clipping starts. Ignored with --batch-clip, and "
+            "with --tabs only orders each tab's next few offers."
+        ),
+    )
+
+    parser.add_argument(
+        "--catalog-path",
+        default=os.path.join(BASE_PATH, "catalog.sqlite3"),
+        help=(
+            "SQLite file cataloging every offer seen, with its brand, title, "
+            "category, discount, expiry and clipped state. Query it with "
+            "python -m safewayclipclip.catalog."
+        ),
+    )
+    parser.add_argument(
+        "--no-catalog",
+        action="store_true",
+        default=False,
+        help="Don't catalog offers.",
+    )
+
+    parser.add_argument(
+        "--max-browser-rss-mb",
+        type=float,
+        default=2048,
+        help=(
+            "Restart the browser and resume clipping when its total memory "
+            "use exceeds this many MB."
+        ),
+    )
+
+    parser.add_argument(
+        "--trace-output",
+        default=None,
+        help=(
+            "If set, write a Chrome trace-event JSON of every traced call to "
+            "this file (open it in chrome://tracing)."
+        ),
+    )
+    parser.add_argument(
+        "--metrics-output",
+        default=None,
+        help=(
+            "If set, write per-phase latency histograms to this file in the "
+            "Prometheus text format."
+        ),
+    )
+
+    parser.add_argument(
+        "--events-output",
+        default=None,
+        help=(
+            "If set, append every progress event (clips, failures, pages "
+            "loaded) to this file as JSON lines."
+        ),
+    )
+    parser.add_argument(
+        "--progress-bar",
+        action="store_true",
+        default=False,
+        help="Show a progress bar in the terminal while clipping.",
+    )
+
+    parser.add_argument(
+        "--record-trace",
+        default=None,
+        help=(
+            "If set, record every WebDriver command and its response to this "
+            "file, for replaying offline with python -m safewayclipclip.replay. "
+            "Implies --no-ledger."
+        ),
+    )
 
     parser.add_argument(
         "-V", "--version", action="store_true", help="Shows the app version and quits."
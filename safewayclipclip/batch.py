@@ -0,0 +1,163 @@
+import logging
+import time
+
+from safewayclipclip.snapshot import (
+    OFFER_EXPIRY_ATTRIBUTE,
+    OFFER_ID_ATTRIBUTE,
+    SKIP_ATTRIBUTE,
+)
+
+logger = logging.getLogger(__name__)
+
+# Finds every Activate/Clip Coupon button and clicks them in order, waiting
+# `pacingMs` between clicks. Runs entirely inside the page so the whole batch
+# costs a single WebDriver round trip. Resolves with one result per button.
+BATCH_CLIP_SCRIPT = """
+const xpath = arguments[0];
+const pacingMs = arguments[1];
+const offerIdAttribute = arguments[2];
+const expiryAttribute = arguments[3];
+const skipAttribute = arguments[4];
+const done = arguments[arguments.length - 1];
+
+const snapshot = document.evaluate(
+    xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+const buttons = [];
+for (let i = 0; i < snapshot.snapshotLength; i++) {
+    const button = snapshot.snapshotItem(i);
+    if (!button.hasAttribute(skipAttribute)) {
+        buttons.push(button);
+    }
+}
+
+const results = [];
+const started = performance.now();
+
+function isIntercepted(button) {
+    const rect = button.getBoundingClientRect();
+    const x = rect.left + rect.width / 2;
+    const y = rect.top + rect.height / 2;
+    const topElement = document.elementFromPoint(x, y);
+    return topElement !== null && !button.contains(topElement);
+}
+
+function isPending(button) {
+    const text = button.textContent;
+    return button.isConnected &&
+        (text.includes('Activate') || text.includes('Clip Coupon'));
+}
+
+function clipNext(i) {
+    if (i >= buttons.length) {
+        // Clicks which never flipped the button to clipped didn't take.
+        for (const result of results) {
+            if (result.status === 'success' && isPending(buttons[result.index])) {
+                result.status = 'unconfirmed';
+            }
+        }
+        done({results: results, elapsedMs: performance.now() - started});
+        return;
+    }
+    const button = buttons[i];
+    let status = 'success';
+    try {
+        if (!button.isConnected) {
+            status = 'stale';
+        } else {
+            button.scrollIntoView({block: 'center'});
+            if (isIntercepted(button)) {
+                status = 'intercepted';
+            } else {
+                button.click();
+            }
+        }
+    } catch (e) {
+        status = 'error';
+    }
+    const card = button.closest('[' + offerIdAttribute + ']');
+    results.push({
+        index: i,
+        status: status,
+        offerId: card ? card.getAttribute(offerIdAttribute) : null,
+        expiry: card ? card.getAttribute(expiryAttribute) : null,
+    });
+    setTimeout(function() { clipNext(i + 1); }, pacingMs);
+}
+
+clipNext(0);
+"""
+
+STATUS_SUCCESS = "success"
+STATUS_INTERCEPTED = "intercepted"
+STATUS_STALE = "stale"
+STATUS_ERROR = "error"
+STATUS_UNCONFIRMED = "unconfirmed"
+
+
+class ClipThroughput:
+    """Tracks clip counts and elapsed time so clip modes can be compared."""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.clicks = 0
+        self.clipped = 0
+        self.skipped = 0
+        self.start_time = time.monotonic()
+
+    def add(self, clicks, clipped):
+        self.clicks += clicks
+        self.clipped += clipped
+
+    def skip(self, count):
+        self.skipped += count
+
+    def elapsed_s(self):
+        return time.monotonic() - self.start_time
+
+    def clips_per_s(self):
+        elapsed = self.elapsed_s()
+        return self.clipped / elapsed if elapsed > 0 else 0.0
+
+    def log_summary(self):
+        logger.info(
+            "[{}] Clipped {} of {} attempted coupons ({} skipped) in {:.1f}s "
+            "({:.2f} clips/s)".format(
+                self.mode,
+                self.clipped,
+                self.clicks,
+                self.skipped,
+                self.elapsed_s(),
+                self.clips_per_s(),
+            )
+        )
+
+
+def batch_clip(webdriver, button_xpath, pacing_ms, num_buttons):
+    """Clips all buttons matching button_xpath with one in-page script call.
+
+    Buttons marked as skipped are left alone. Returns a list of dicts, one per
+    button, with an "index", the "offerId" and "expiry" if known, and a
+    "status" of success, intercepted, stale, error or unconfirmed (clicked
+    but still offering to clip).
+    """
+    # Leave plenty of headroom over the pacing the script itself will spend.
+    timeout_s = 30 + num_buttons * (pacing_ms / 1000.0) * 2
+    webdriver.set_script_timeout(timeout_s)
+    response = webdriver.execute_async_script(
+        BATCH_CLIP_SCRIPT,
+        button_xpath,
+        pacing_ms,
+        OFFER_ID_ATTRIBUTE,
+        OFFER_EXPIRY_ATTRIBUTE,
+        SKIP_ATTRIBUTE,
+    )
+    results = response["results"]
+    counts = {}
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info(
+        "Batch of {} buttons finished in {:.1f}s: {}".format(
+            len(results), response["elapsedMs"] / 1000.0, counts
+        )
+    )
+    return results
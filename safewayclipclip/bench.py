@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Benchmarks the clip loop against a local fake Safeway site.
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import time
+
+from safewayclipclip import VERSION
+from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.cli import clip_clip
+from safewayclipclip.fake_site import FakeSafewaySite
+from safewayclipclip.tracing import phase, tracer, write_trace_outputs
+from safewayclipclip.watchdog import BrowserWatchdog
+from safewayclipclip.webdriver import (
+    get_transferred_bytes,
+    get_webdriver,
+    use_lean_profile,
+)
+
+logger = logging.getLogger(__name__)
+
+MIN_COUPONS = 10
+MAX_COUPONS = 10000
+
+
+class CommandCounter:
+    """Counts WebDriver commands (chromedriver round trips) sent by a driver."""
+
+    def __init__(self, driver):
+        self.count = 0
+        self._execute = driver.execute
+        driver.execute = self.execute
+
+    def execute(self, driver_command, params=None):
+        self.count += 1
+        return self._execute(driver_command, params)
+
+
+def run_benchmark(args):
+    site = FakeSafewaySite(
+        args.coupons, args.page_size, args.error_rate, args.load_delay_ms, args.seed
+    )
+    site.start()
+    args.safeway_url = site.url
+    args.safeway_username = "bench"
+    args.safeway_password = "bench"
+    # Offer ids repeat between fake sites, so a ledger would skip them all.
+    args.no_ledger = True
+    args.no_catalog = True
+
+    # Always use a fresh profile so the login flow is part of the measurement.
+    lean = use_lean_profile(args)
+    tracer.record_events = bool(args.trace_output)
+    with phase("launch"):
+        webdriver = get_webdriver(args.headless, None, lean, log_network=True)
+    commands = CommandCounter(webdriver)
+    watchdog = BrowserWatchdog(webdriver, interval_s=0.5).start()
+    start_time = time.monotonic()
+    try:
+        throughput = clip_clip(webdriver, args)
+    finally:
+        wall_time_s = time.monotonic() - start_time
+        watchdog.stop()
+        num_commands = commands.count
+        transferred_bytes = get_transferred_bytes(webdriver)
+        webdriver.quit()
+        site.stop()
+        write_trace_outputs(args)
+
+    clips = site.num_clipped()
+    return {
+        "version": VERSION,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "coupons": args.coupons,
+        "page_size": args.page_size,
+        "error_rate": args.error_rate,
+        "mode": {
+            "batch_clip": args.batch_clip,
+            "http_clip": args.http_clip,
+            "tabs": args.tabs,
+            "priority": args.priority,
+            "pacing": args.pacing,
+            "headless": args.headless,
+            "browser_profile": "lean" if lean else "normal",
+        },
+        "logged_in": throughput is not None,
+        "clips": clips,
+        "wall_time_s": round(wall_time_s, 3),
+        "clips_per_s": round(clips / wall_time_s, 3) if wall_time_s else 0,
+        "webdriver_commands": num_commands,
+        "commands_per_clip": round(num_commands / clips, 2) if clips else None,
+        "peak_rss_mb": round(watchdog.peak_rss_bytes / 2**20, 1),
+        "transferred_mb": round(transferred_bytes / 2**20, 2),
+    }
+
+
+def append_result(filename, result):
+    results = []
+    if os.path.exists(filename):
+        with open(filename) as f:
+            results = json.load(f)
+    results.append(result)
+    with open(filename, "w") as f:
+        json.dump(results, f, indent=2)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Benchmark the clip loop against a local fake Safeway site."
+    )
+    define_common_args(parser)
+    parser.add_argument(
+        "--coupons",
+        type=int,
+        default=500,
+        help="Number of coupons on the fake site ({}-{}).".format(
+            MIN_COUPONS, MAX_COUPONS
+        ),
+    )
+    parser.add_argument(
+        "--page-size",
+        type=int,
+        default=30,
+        help="Coupons shown per page before clicking Load more.",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.02,
+        help="Fraction of clips which fail and show the error modal.",
+    )
+    parser.add_argument(
+        "--load-delay-ms",
+        type=int,
+        default=300,
+        help="Simulated latency of each Load more.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default=os.path.join(BASE_PATH, "bench.json"),
+        help="JSON file which results are appended to.",
+    )
+    args = parser.parse_args()
+    if not MIN_COUPONS <= args.coupons <= MAX_COUPONS:
+        parser.error(
+            "--coupons must be between {} and {}".format(MIN_COUPONS, MAX_COUPONS)
+        )
+
+    result = run_benchmark(args)
+    print(json.dumps(result, indent=2))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    append_result(args.output, result)
+
+
+if __name__ == "__main__":
+    main()
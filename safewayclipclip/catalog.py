@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+
+# Keeps a catalog of every offer seen on the coupon grid, and queries or
+# exports it.
+#
+#   python -m safewayclipclip.catalog query --category Produce
+#   python -m safewayclipclip.catalog export --format csv --output offers.csv
+
+import argparse
+import csv
+from datetime import date, datetime, timedelta
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from safewayclipclip.args import BASE_PATH
+from safewayclipclip.ledger import get_account_key, parse_expiry
+from safewayclipclip.snapshot import (
+    COUPON_GRID_SELECTOR,
+    OFFER_EXPIRY_ATTRIBUTE,
+    OFFER_ID_ATTRIBUTE,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG_PATH = os.path.join(BASE_PATH, "catalog.sqlite3")
+
+# Set on cards to the clipped state last extracted, so each card is only
+# returned again once its state changes.
+CATALOGED_ATTRIBUTE = "data-clipclip-cataloged"
+BATCH_SIZE = 200
+
+# Extracts up to `maxOffers` new or changed cards per call. Cards differ
+# between site versions, so fields come from data attributes where present,
+# falling back to the text of child elements named for the field.
+CATALOG_SCRIPT = """
+const gridSelector = arguments[0];
+const offerIdAttribute = arguments[1];
+const expiryAttribute = arguments[2];
+const catalogedAttribute = arguments[3];
+const maxOffers = arguments[4];
+const grid = document.querySelector(gridSelector) || document;
+
+function text(card, names) {
+    for (const name of names) {
+        const el = card.querySelector('[class*="' + name + '"]');
+        if (el) {
+            return el.textContent.trim();
+        }
+    }
+    return null;
+}
+
+const offers = [];
+for (const card of grid.querySelectorAll('[' + offerIdAttribute + ']')) {
+    let clipped = false;
+    for (const b of card.querySelectorAll('button')) {
+        if (b.textContent.includes('Clipped')) {
+            clipped = true;
+        }
+    }
+    const state = clipped ? 'clipped' : 'unclipped';
+    if (card.getAttribute(catalogedAttribute) === state) {
+        continue;
+    }
+    card.setAttribute(catalogedAttribute, state);
+    offers.push({
+        offerId: card.getAttribute(offerIdAttribute),
+        brand: text(card, ['brand']),
+        title: text(card, ['title', 'description']),
+        category: card.dataset.category || text(card, ['category']),
+        discount: card.dataset.discount || text(card, ['discount', 'savings']),
+        expiry: card.getAttribute(expiryAttribute),
+        clipped: clipped,
+    });
+    if (offers.length >= maxOffers) {
+        break;
+    }
+}
+return offers;
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS offers (
+    account TEXT NOT NULL,
+    offer_id TEXT NOT NULL,
+    brand TEXT,
+    title TEXT,
+    category TEXT,
+    discount TEXT,
+    expires_at REAL,
+    clipped INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (account, offer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS offers_category ON offers (account, category);
+CREATE INDEX IF NOT EXISTS offers_expires_at ON offers (account, expires_at);
+"""
+
+UPSERT_SQL = """
+INSERT INTO offers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (account, offer_id) DO UPDATE SET
+    brand = coalesce(excluded.brand, brand),
+    title = coalesce(excluded.title, title),
+    category = coalesce(excluded.category, category),
+    discount = coalesce(excluded.discount, discount),
+    expires_at = coalesce(excluded.expires_at, expires_at),
+    clipped = excluded.clipped,
+    last_seen = excluded.last_seen
+"""
+
+COLUMNS = [
+    "account",
+    "offer_id",
+    "brand",
+    "title",
+    "category",
+    "discount",
+    "expires_at",
+    "clipped",
+    "first_seen",
+    "last_seen",
+]
+
+
+def stream_offers(webdriver, batch_size=BATCH_SIZE):
+    """Yields offers from the coupon grid not seen, or changed, since last call.
+
+    Cards are extracted in page-side batches, one round trip per batch.
+    """
+    while True:
+        offers = webdriver.execute_script(
+            CATALOG_SCRIPT,
+            COUPON_GRID_SELECTOR,
+            OFFER_ID_ATTRIBUTE,
+            OFFER_EXPIRY_ATTRIBUTE,
+            CATALOGED_ATTRIBUTE,
+            batch_size,
+        )
+        yield from offers
+        if len(offers) < batch_size:
+            return
+
+
+class CouponCatalog:
+    """On-disk catalog of offers, indexed by account, category and expiry."""
+
+    def __init__(self, path, account):
+        self.account = account
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def add_offers(self, offers, batch_size=BATCH_SIZE):
+        """Stores offers from an iterable, one transaction per batch.
+
+        Returns the number stored.
+        """
+        num_offers = 0
+        batch = []
+        for offer in offers:
+            if not offer["offerId"]:
+                continue
+            now = time.time()
+            batch.append(
+                (
+                    self.account,
+                    offer["offerId"],
+                    offer["brand"],
+                    offer["title"],
+                    offer["category"],
+                    offer["discount"],
+                    parse_expiry(offer["expiry"]),
+                    int(offer["clipped"]),
+                    now,
+                    now,
+                )
+            )
+            if len(batch) >= batch_size:
+                num_offers += self._write(batch)
+                batch = []
+        if batch:
+            num_offers += self._write(batch)
+        return num_offers
+
+    def _write(self, batch):
+        self.conn.execute("BEGIN")
+        try:
+            self.conn.executemany(UPSERT_SQL, batch)
+            self.conn.execute("COMMIT")
+        except sqlite3.Error:
+            self.conn.execute("ROLLBACK")
+            raise
+        return len(batch)
+
+    def query(
+        self,
+        account=None,
+        category=None,
+        clipped=None,
+        expires_before=None,
+        expires_after=None,
+    ):
+        """Yields matching rows as dicts, streaming from the database."""
+        clauses = []
+        params = []
+        for column, value in (("account", account), ("category", category)):
+            if value is not None:
+                clauses.append("{} = ?".format(column))
+                params.append(value)
+        if clipped is not None:
+            clauses.append("clipped = ?")
+            params.append(int(clipped))
+        if expires_before is not None:
+            clauses.append("expires_at < ?")
+            params.append(expires_before)
+        if expires_after is not None:
+            clauses.append("expires_at >= ?")
+            params.append(expires_after)
+        sql = "SELECT {} FROM offers".format(", ".join(COLUMNS))
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY account, expires_at"
+        for row in self.conn.execute(sql, params):
+            yield dict(zip(COLUMNS, row))
+
+    def close(self):
+        self.conn.close()
+
+
+def open_catalog(args):
+    """Returns the CouponCatalog for the run's account, or None if disabled."""
+    if args.no_catalog:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(args.catalog_path)), exist_ok=True)
+    return CouponCatalog(args.catalog_path, get_account_key(args.safeway_username))
+
+
+def _start_of_day(day):
+    return datetime.combine(day, datetime.min.time()).timestamp()
+
+
+def _format_timestamp(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp).isoformat(timespec="seconds")
+
+
+def _for_output(row):
+    row = dict(row)
+    for column in ("expires_at", "first_seen", "last_seen"):
+        row[column] = _format_timestamp(row[column])
+    row["clipped"] = bool(row["clipped"])
+    return row
+
+
+def write_csv(rows, f):
+    writer = csv.DictWriter(f, fieldnames=COLUMNS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(_for_output(row))
+
+
+def write_json(rows, f):
+    """Writes a JSON array one row at a time, so memory use stays flat."""
+    f.write("[")
+    for i, row in enumerate(rows):
+        f.write(",\n" if i else "\n")
+        f.write(json.dumps(_for_output(row)))
+    f.write("\n]\n")
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Query the coupon catalog.")
+    parser.add_argument("--catalog-path", default=DEFAULT_CATALOG_PATH)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    query_parser = subparsers.add_parser(
+        "query", help="Print matching offers as CSV."
+    )
+    export_parser = subparsers.add_parser(
+        "export", help="Write matching offers to a CSV or JSON file."
+    )
+    for subparser in (query_parser, export_parser):
+        subparser.add_argument(
+            "--safeway_username",
+            default=None,
+            help="Only offers seen by this account. Defaults to all accounts.",
+        )
+        subparser.add_argument("--category", default=None)
+        clipped_group = subparser.add_mutually_exclusive_group()
+        clipped_group.add_argument(
+            "--clipped", dest="clipped", action="store_true", default=None
+        )
+        clipped_group.add_argument(
+            "--unclipped", dest="clipped", action="store_false", default=None
+        )
+        subparser.add_argument(
+            "--expires-before",
+            default=None,
+            help="Only offers expiring on or before this date (YYYY-MM-DD).",
+        )
+        subparser.add_argument(
+            "--expires-after",
+            default=None,
+            help="Only offers expiring on or after this date (YYYY-MM-DD).",
+        )
+    export_parser.add_argument("--format", choices=["csv", "json"], default="csv")
+    export_parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    # Offers expire at the end of their day, so these bound whole days.
+    expires_before = expires_after = None
+    if args.expires_before:
+        day = date.fromisoformat(args.expires_before) + timedelta(days=1)
+        expires_before = _start_of_day(day)
+    if args.expires_after:
+        expires_after = _start_of_day(date.fromisoformat(args.expires_after))
+    catalog = CouponCatalog(args.catalog_path, account=None)
+    try:
+        rows = catalog.query(
+            account=(
+                get_account_key(args.safeway_username)
+                if args.safeway_username
+                else None
+            ),
+            category=args.category,
+            clipped=args.clipped,
+            expires_before=expires_before,
+            expires_after=expires_after,
+        )
+        if args.command == "query":
+            write_csv(rows, sys.stdout)
+            return
+        with open(args.output, "w", newline="") as f:
+            if args.format == "csv":
+                write_csv(rows, f)
+            else:
+                write_json(rows, f)
+    finally:
+        catalog.close()
+
+
+if __name__ == "__main__":
+    main()
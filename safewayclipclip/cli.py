@@ -5,10 +5,9 @@
 import argparse
 import atexit
 from datetime import datetime
+from enum import Enum
 import logging
-import os
 from pprint import pprint
-import random
 import time
 
 from selenium.common.exceptions import (
@@ -16,21 +15,74 @@ from selenium.common.exceptions import (
     JavascriptException,
     StaleElementReferenceException,
 )
-from selenium.webdriver import ActionChains
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
 from safewayclipclip import VERSION
-from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.args import define_common_args
+from safewayclipclip.batch import batch_clip, ClipThroughput, STATUS_SUCCESS
+from safewayclipclip.catalog import open_catalog, stream_offers
+from safewayclipclip.discovery import CouponDiscovery, PREFETCH_LOW_WATER
+from safewayclipclip.events import (
+    event_bus,
+    publish_clip,
+    JsonlSink,
+    MetricsSink,
+    PAGE_LOADED,
+    RUN_FINISHED,
+    RUN_STARTED,
+)
+from safewayclipclip.http_clip import http_clip, HttpClipError
+from safewayclipclip.ledger import open_ledger, parse_expiry
+from safewayclipclip.log_setup import setup_logging
+from safewayclipclip.replay import CommandRecorder
+from safewayclipclip.retry import (
+    get_offer_key,
+    CircuitBreaker,
+    OfferRetries,
+    FAILURE_INTERCEPTED,
+    FAILURE_JAVASCRIPT,
+    FAILURE_NOT_CLIPPED,
+    FAILURE_STALE,
+)
+from safewayclipclip.selection import get_offer_selector, PrioritizedDiscovery
+from safewayclipclip.session import check_session, record_session_check
+from safewayclipclip.session_store import (
+    get_saved_session_path,
+    get_session_webdriver,
+    save_session_state,
+)
+from safewayclipclip.snapshot import mark_skipped, take_snapshot, work_available
+from safewayclipclip.tabs import clip_in_tabs
+from safewayclipclip.tracing import phase, traced, tracer, write_trace_outputs
+from safewayclipclip.watchdog import BrowserRecycleNeeded, BrowserWatchdog
+from safewayclipclip.waits import (
+    all_of,
+    button_clipped,
+    cancellable,
+    check_cancelled,
+    coupon_button_count_changed,
+    element_gone,
+    get_pacing_policy,
+    get_poll_frequency,
+    page_settled,
+    pace,
+    set_pacing_policy,
+    wait_stats,
+    AdaptiveWaiter,
+    CLIP_CONFIRMED,
+    LOAD_MORE_SPINNER_XPATH,
+)
 from safewayclipclip.webdriver import (
-    get_webdriver,
+    click_element,
     get_element_by_id,
     get_element_by_name,
     get_element_by_xpath,
     get_element_by_link_text,
     get_elements_by_class_name,
     get_elements_by_xpath,
+    implicit_wait_stats,
     is_visible,
+    probe_elements,
+    set_implicit_wait,
 )
 
 
@@ -39,32 +91,27 @@ logger = logging.getLogger(__name__)
 
 SAFEWAY_HOME = "https://www.safeway.com"
 # FOR_U = "{}/justforu/coupons-deals.html".format(SAFEWAY_HOME)
-LOGIN_THEN_FOR_U = "{}/account/sign-in.html?goto=/foru/coupons-deals.html".format(
-    SAFEWAY_HOME
-)
-COUPON_URL = "{}/loyalty/coupons-deals".format(SAFEWAY_HOME)
+LOGIN_THEN_FOR_U_PATH = "/account/sign-in.html?goto=/foru/coupons-deals.html"
+COUPON_PATH = "/loyalty/coupons-deals"
+LOGIN_THEN_FOR_U = SAFEWAY_HOME + LOGIN_THEN_FOR_U_PATH
+COUPON_URL = SAFEWAY_HOME + COUPON_PATH
 
 COUPON_BUTTON_XPATH = (
     '//button[contains(text(), "Activate") or contains(text(), "Clip Coupon")]'
 )
 
+# How many pending offers each snapshot returns handles for.
+SINGLE_PENDING_HANDLES = 20
+MAX_PENDING_HANDLES = 10000
+# Most times a run restarts a browser over --max-browser-rss-mb.
+MAX_BROWSER_RELAUNCHES = 10
+
 
 def main():
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.INFO)
-    root_logger.addHandler(logging.StreamHandler())
-    # Disable noisy log spam from filelock from within tldextract.
-    logging.getLogger("filelock").setLevel(logging.WARN)
-
-    # For helping remote debugging, also log to file.
-    # Developers should be vigilant to NOT log any PII, ever (including being
-    # mindful of what exceptions might be thrown).
-    log_directory = os.path.join(BASE_PATH, "Logs")
-    os.makedirs(log_directory, exist_ok=True)
-    log_filename = os.path.join(
-        log_directory, "{}.log".format(time.strftime("%Y-%m-%d_%H-%M-%S"))
-    )
-    root_logger.addHandler(logging.FileHandler(log_filename))
+    # Also logs to file, for helping remote debugging. Developers should be
+    # vigilant to NOT log any PII, ever (including being mindful of what
+    # exceptions might be thrown).
+    setup_logging("cli")
 
     parser = argparse.ArgumentParser(description="Clip Safeway coupons.")
     define_common_args(parser)
@@ -74,100 +121,589 @@ def main():
         print("SafewayClipClip {}\nBy: Jeff Prouty".format(VERSION))
         exit(0)
 
-    webdriver = get_webdriver(args.headless, args.session_path)
-    webdriver.implicitly_wait(2)
+    tracer.record_events = bool(args.trace_output)
+    event_bus.subscribe(MetricsSink())
+    events_sink = None
+    if args.events_output:
+        events_sink = event_bus.subscribe(JsonlSink(args.events_output))
+    if args.progress_bar:
+        # Imported where used, as the progress package is only needed here.
+        from safewayclipclip.my_progress import TerminalProgressSink
+
+        event_bus.subscribe(TerminalProgressSink())
+    recorder = None
+    if args.record_trace:
+        # The ledger is local state a replay can't see, so don't let it
+        # change which offers the recorded run clicks.
+        args.no_ledger = True
+        recorder = CommandRecorder(args)
+    with phase("launch"):
+        webdriver = get_session_webdriver(args)
+    if recorder:
+        recorder.attach(webdriver)
 
     def close_webdriver():
         webdriver.close()
 
+    def relaunch_webdriver():
+        nonlocal webdriver
+        webdriver.quit()
+        with phase("launch"):
+            webdriver = get_session_webdriver(args)
+        if recorder:
+            recorder.attach(webdriver)
+        return webdriver
+
     atexit.register(close_webdriver)
 
-    webdriver.get(LOGIN_THEN_FOR_U)
-    # Wait - there is sometimes a redirect here.
-    time.sleep(2)
-    logger.info("At Safeway For U coupons page: {}".format(webdriver.current_url))
-    if not login_if_needed(webdriver, args):
+    try:
+        throughput = clip_clip(webdriver, args, relaunch_webdriver)
+    finally:
+        event_bus.drain()
+        if events_sink:
+            events_sink.close()
+        write_trace_outputs(args)
+        if recorder:
+            recorder.write(args.record_trace)
+    if not throughput:
         logger.error("Cannot login - exiting")
         time.sleep(60)
         return
 
-    # Accept cookies bottom
-    coupons_clip_clip = get_elements_by_xpath(webdriver, COUPON_BUTTON_XPATH)
-    while len(coupons_clip_clip) == 0:
-        load_more_button = get_element_by_xpath(
-            webdriver, '//button[contains(text(), "Load more")]'
+    logger.info("All done! Sleeping for 5m before exiting to allow for review")
+    time.sleep(60 * 5)
+
+
+def get_safeway_url(args, path=""):
+    return (args.safeway_url or SAFEWAY_HOME) + path
+
+
+def clip_clip(webdriver, args, relaunch=None):
+    """Logs in and clips every coupon.
+
+    relaunch, if given, must quit the current driver and return a new one
+    with the same session path; it's used to restart a browser which grows
+    past --max-browser-rss-mb. Progress is published to the event bus.
+    Returns the run's ClipThroughput, or None if login failed.
+    """
+    event_bus.publish(
+        RUN_STARTED,
+        batch_clip=args.batch_clip,
+        http_clip=args.http_clip,
+        tabs=args.tabs,
+    )
+    throughput = None
+    try:
+        waiter = start_session(webdriver, args)
+        if waiter:
+            throughput = clip_logged_in(webdriver, args, waiter, relaunch)
+    finally:
+        event_bus.publish(
+            RUN_FINISHED,
+            logged_in=throughput is not None,
+            clicks=throughput.clicks if throughput else 0,
+            clipped=throughput.clipped if throughput else 0,
+            skipped=throughput.skipped if throughput else 0,
         )
-        if not load_more_button or not is_visible(load_more_button):
-            logger.warning(
-                'Cannot find "Load more" button OR any coupons to clip; either done or unexpectedly '
-                "missing"
-            )
-            time.sleep(60)
-            return
-        logger.info("Clicking load more!")
-        user_click(webdriver, load_more_button)
-        time.sleep(2)
-        coupons_clip_clip = get_elements_by_xpath(webdriver, COUPON_BUTTON_XPATH)
+    return throughput
 
-    accept_all_cookies = get_element_by_xpath(
-        webdriver, '//button[contains(text(), "Accept All")]'
+
+def start_session(webdriver, args):
+    """Configures the driver and logs in.
+
+    If the saved session looks valid, this goes straight to the coupons page
+    and only falls back to the sign-in page if that turns out not to be
+    logged in. Returns the AdaptiveWaiter to use with this driver, or None if
+    login failed.
+    """
+    set_implicit_wait(webdriver, 2)
+    set_pacing_policy(
+        get_pacing_policy(args.pacing, args.pacing_min_ms, args.pacing_max_ms)
     )
-    if is_visible(accept_all_cookies):
-        user_click(webdriver, accept_all_cookies)
-
-    # Avoid stale ref error by getting a new list of buttons after each click
-    while coupons_clip_clip:
-        try:
-            user_click(webdriver, coupons_clip_clip[0])
-            # logger.info("Clipped a coupon!")
-        except ElementClickInterceptedException:
-            logger.exception("Click interception error; continuing")
-        except StaleElementReferenceException:
-            logger.exception("Stale ref error; continuing")
-        except JavascriptException:
-            logger.exception("JS error; continuing")
-
-        # time.sleep(1)
-
-        close_modal_button = get_element_by_xpath(
-            webdriver, '//*[@id="errorModal"]//button[contains(text(), "Close")]'
+    waiter = AdaptiveWaiter(args.wait_floor_s, args.wait_ceiling_s)
+
+    base_url = get_safeway_url(args)
+    saved_session_path = get_saved_session_path(args)
+    with phase("login"):
+        if check_session(saved_session_path, base_url, args.session_check_ttl_s):
+            webdriver.get(get_safeway_url(args, COUPON_PATH))
+            waiter.wait(webdriver, page_settled())
+            if is_logged_in(webdriver):
+                logger.info("Saved session is logged in")
+                return waiter
+            logger.info("Saved session is not logged in after all")
+
+        webdriver.get(get_safeway_url(args, LOGIN_THEN_FOR_U_PATH))
+        # Wait - there is sometimes a redirect here.
+        waiter.wait(webdriver, page_settled())
+        logger.info("At Safeway For U coupons page: {}".format(webdriver.current_url))
+        logged_in = login_if_needed(webdriver, args)
+        record_session_check(saved_session_path, base_url, logged_in)
+    if not logged_in:
+        return None
+    if args.session_store == "cookies":
+        save_session_state(webdriver, saved_session_path, base_url)
+    return waiter
+
+
+def clip_logged_in(webdriver, args, waiter, relaunch=None):
+    """Clips every coupon with an already logged in driver."""
+    ledger = open_ledger(args)
+    catalog = open_catalog(args)
+    # Without a way to relaunch, the watchdog only monitors.
+    max_rss_mb = args.max_browser_rss_mb if relaunch else None
+    watchdog = BrowserWatchdog(webdriver, max_rss_mb).start()
+    throughput = None
+    relaunches = 0
+    # Clicks and skips made by the last relaunch; None before any relaunch.
+    progress_at_relaunch = None
+    try:
+        while True:
+            try:
+                return clip_all_coupons(
+                    webdriver, waiter, args, ledger, watchdog, throughput, catalog
+                )
+            except BrowserRecycleNeeded as e:
+                throughput = e.throughput
+                watchdog.stop()
+                watchdog.log_summary()
+                # A browser which outgrows the ceiling again before getting
+                # anything done would otherwise be relaunched forever.
+                progress = throughput.clicks + throughput.skipped
+                if relaunches >= MAX_BROWSER_RELAUNCHES or (
+                    progress_at_relaunch is not None
+                    and progress <= progress_at_relaunch
+                ):
+                    logger.error(
+                        "Browser keeps exceeding --max-browser-rss-mb without "
+                        "progress; stopping"
+                    )
+                    return throughput
+                relaunches += 1
+                progress_at_relaunch = progress
+                logger.info("Relaunching the browser and resuming")
+                webdriver = relaunch()
+                waiter = start_session(webdriver, args)
+                if not waiter:
+                    logger.error("Cannot log in after relaunching the browser")
+                    return throughput
+                watchdog = BrowserWatchdog(webdriver, max_rss_mb).start()
+    finally:
+        watchdog.stop()
+        watchdog.log_summary()
+        if ledger:
+            ledger.close()
+        if catalog:
+            catalog.close()
+
+
+def clip_all_coupons(
+    webdriver, waiter, args, ledger, watchdog, throughput=None, catalog=None
+):
+    """Runs the clip stages; throughput is given when resuming a run."""
+    selector = get_offer_selector(args)
+    # The offer API doesn't give the card details offer rules judge by.
+    use_http = args.http_clip and not (selector and selector.has_rules)
+    if args.http_clip and not use_http and not throughput:
+        logger.warning("Offer rules don't apply over HTTP; clipping in the browser")
+    if use_http and not throughput:
+        with phase("http-clip"):
+            http_throughput = clip_coupons_over_http(webdriver, args, ledger)
+        if http_throughput and http_throughput.clicks == http_throughput.clipped:
+            return http_throughput
+        if http_throughput:
+            # Include the offers already clipped over HTTP in the run's totals.
+            throughput = ClipThroughput("http+browser")
+            throughput.add(
+                clicks=http_throughput.clipped, clipped=http_throughput.clipped
+            )
+        webdriver.get(get_safeway_url(args, COUPON_PATH))
+        waiter.wait(webdriver, page_settled())
+
+    batch_pacing_ms = args.batch_pacing_ms if args.batch_clip else None
+    retries = OfferRetries(args.max_clip_attempts, args.retry_backoff_s)
+    breaker = CircuitBreaker(args.max_failure_rate, args.max_page_reloads)
+    if args.tabs > 1 and not args.batch_clip:
+        throughput = clip_in_tabs(
+            webdriver,
+            waiter,
+            get_safeway_url(args, COUPON_PATH),
+            args.tabs,
+            ledger,
+            watchdog,
+            throughput,
+            catalog,
+            retries,
+            breaker,
+            selector,
         )
-        if is_visible(close_modal_button):
-            user_click(webdriver, close_modal_button)
-            logger.info("Closed modal dialog")
+    else:
+        throughput = clip_coupons(
+            webdriver,
+            waiter,
+            batch_pacing_ms,
+            ledger,
+            watchdog,
+            throughput,
+            catalog,
+            retries,
+            breaker,
+            selector,
+        )
+    throughput.log_summary()
+    implicit_wait_stats.log_summary()
+    wait_stats.log_summary()
+    if args.session_store == "cookies":
+        # Keep any login cookies the site refreshed during the run.
+        save_session_state(
+            webdriver, get_saved_session_path(args), get_safeway_url(args)
+        )
+    return throughput
 
-        # Sometimes clipped ones disappear and new ones come in.
-        coupons_clip_clip = get_elements_by_xpath(webdriver, COUPON_BUTTON_XPATH)
 
-        # Othertimes you must explicitly click "load more".
-        if len(coupons_clip_clip) == 0:
-            load_more_button = get_element_by_xpath(
-                webdriver, '//button[contains(text(), "Load more")]'
+def clip_coupons_over_http(webdriver, args, ledger):
+    """Returns the HTTP stage's ClipThroughput, or None if unavailable."""
+    throughput = ClipThroughput("http")
+    base_url = args.http_base_url or get_safeway_url(args)
+    try:
+        num_offers, failed_offer_ids = http_clip(
+            webdriver, base_url, args.http_workers, ledger
+        )
+    except HttpClipError as e:
+        logger.warning("HTTP clipping unavailable: {}".format(e))
+        return None
+    throughput.add(clicks=num_offers, clipped=num_offers - len(failed_offer_ids))
+    throughput.log_summary()
+    if failed_offer_ids:
+        logger.warning(
+            "{} coupons failed over HTTP; retrying in the browser".format(
+                len(failed_offer_ids)
             )
-            if not load_more_button or not is_visible(load_more_button):
-                logger.warning(
-                    'Cannot find "Load more" button; either done or unexpectedly '
-                    "missing"
-                )
+        )
+    return throughput
+
+
+class ClipState(Enum):
+    LOADING = "loading"
+    CLIPPING = "clipping"
+    DISMISS_MODAL = "dismiss_modal"
+    LOAD_MORE = "load_more"
+    DONE = "done"
+
+
+def next_clip_state(snapshot, load_all_first=False):
+    """With load_all_first, every page is loaded before any coupon is clipped."""
+    if snapshot.modal_close_button:
+        return ClipState.DISMISS_MODAL
+    if load_all_first and snapshot.loading:
+        return ClipState.LOADING
+    if load_all_first and snapshot.load_more_button:
+        return ClipState.LOAD_MORE
+    if snapshot.pending_count:
+        return ClipState.CLIPPING
+    if snapshot.loading:
+        return ClipState.LOADING
+    if snapshot.load_more_button:
+        return ClipState.LOAD_MORE
+    return ClipState.DONE
+
+
+def clip_coupons(
+    webdriver,
+    waiter,
+    batch_pacing_ms=None,
+    ledger=None,
+    watchdog=None,
+    throughput=None,
+    catalog=None,
+    retries=None,
+    breaker=None,
+    selector=None,
+):
+    """Clips every coupon, driven by one page snapshot per step.
+
+    Snapshots come from an in-page observer which queues coupons as they
+    load, so each step only touches what changed, and the next page is
+    requested while the last few coupons of this one are clipped.
+
+    When batch_pacing_ms is set, all pending coupons on the page are clipped
+    with a single in-page script call instead of one click at a time. Offers
+    the ledger already knows about are skipped without clicking. Each page of
+    offers is added to the catalog, if given, before loading the next. Raises
+    BrowserRecycleNeeded between steps if the watchdog reports the browser
+    is over its memory ceiling.
+
+    Failed offers are retried with backoff until retries gives up on them,
+    and the page is reloaded, or the run abandoned, when breaker trips; so
+    every offer costs a bounded number of clicks and the loop always ends.
+    Each clip is published to the event bus. Raises RunCancelled between
+    steps once the run has been cancelled.
+
+    Offers the selector, if given, doesn't want are skipped. If it orders
+    offers, and coupons are clipped one at a time, every page is loaded
+    first and coupons are then clipped in priority order.
+    """
+    use_batch = batch_pacing_ms is not None
+    if not throughput:
+        throughput = ClipThroughput("batch" if use_batch else "one-by-one")
+    retries = retries or OfferRetries()
+    breaker = breaker or CircuitBreaker()
+    discovery = CouponDiscovery(webdriver)
+    ordered = bool(selector and selector.orders and not use_batch)
+    if ordered:
+        discovery = PrioritizedDiscovery(discovery, selector, MAX_PENDING_HANDLES)
+    if not waiter.wait(webdriver, work_available()):
+        logger.warning(
+            'Cannot find "Load more" button OR any coupons to clip; either done '
+            "or unexpectedly missing"
+        )
+        return throughput
+
+    state = ClipState.LOADING
+    while state != ClipState.DONE:
+        check_cancelled()
+        if watchdog and watchdog.over_limit():
+            raise BrowserRecycleNeeded(throughput)
+        if breaker.tripped():
+            if breaker.trip():
+                logger.error("Too many clips are failing; stopping")
                 break
-            logger.info("Clicking load more!")
-            user_click(webdriver, load_more_button)
-            time.sleep(2)
-            coupons_clip_clip = get_elements_by_xpath(webdriver, COUPON_BUTTON_XPATH)
+            reload_coupons(webdriver, waiter)
+        # Batches need every pending offer so skipped ones can be excluded.
+        max_handles = MAX_PENDING_HANDLES if use_batch else SINGLE_PENDING_HANDLES
+        snapshot = discovery.snapshot(max_handles)
+        state = next_clip_state(snapshot, load_all_first=ordered)
+
+        if state == ClipState.DISMISS_MODAL:
+            with phase("modal-dismiss"):
+                user_click(webdriver, snapshot.modal_close_button)
+            logger.info("Closed modal dialog")
+            # Counted so that a modal which keeps reappearing trips the breaker.
+            breaker.record(False)
+        elif state == ClipState.CLIPPING:
+            skipped = [
+                offer
+                for offer in snapshot.pending_offers
+                if (ledger and ledger.should_skip(offer["offerId"]))
+                or retries.exhausted(get_offer_key(offer))
+                or (selector and not selector.wants(offer))
+            ]
+            if skipped:
+                mark_skipped(webdriver, [offer["button"] for offer in skipped])
+                throughput.skip(len(skipped))
+                if ordered:
+                    discovery.discard(skipped)
+                continue
+            # Accept cookies bottom
+            if snapshot.cookie_banner_button:
+                user_click(webdriver, snapshot.cookie_banner_button)
+            if (
+                snapshot.pending_count <= PREFETCH_LOW_WATER
+                and snapshot.load_more_button
+                and not snapshot.loading
+            ):
+                prefetch_more(webdriver, snapshot.load_more_button, catalog)
+            if use_batch:
+                with phase("clip"):
+                    num_clipped = clip_batch(
+                        webdriver,
+                        batch_pacing_ms,
+                        snapshot,
+                        throughput,
+                        ledger,
+                        retries,
+                        breaker,
+                    )
+                if num_clipped == 0:
+                    logger.warning(
+                        "Batch clipped nothing; falling back to single clicks"
+                    )
+                    use_batch = False
+            else:
+                offer = retries.next_ready(snapshot.pending_offers)
+                if not offer:
+                    retries.wait_for_next(snapshot.pending_offers)
+                    continue
+                with phase("clip"):
+                    failure = clip_one(webdriver, waiter, offer, throughput, ledger)
+                publish_clip(
+                    offer["offerId"],
+                    failure,
+                    snapshot.pending_count - (0 if failure else 1),
+                )
+                breaker.record(failure is None)
+                if failure:
+                    retries.record_failure(get_offer_key(offer))
+                    recover_from_failure(webdriver, waiter, offer, failure)
+                    if ordered:
+                        # Its button may be stale, or the page reloaded.
+                        discovery.invalidate()
+                else:
+                    retries.record_success(get_offer_key(offer))
+                    if ordered:
+                        discovery.discard([offer])
+        elif state == ClipState.LOADING:
+            with phase("load-more"):
+                loaded = waiter.wait(webdriver, discovery.done_loading())
+            if not loaded:
+                logger.warning("Coupons are still loading; giving up")
+                state = ClipState.DONE
+        elif state == ClipState.LOAD_MORE:
+            if catalog:
+                catalog_offers(webdriver, catalog)
+            with phase("load-more"):
+                loaded = click_load_more(
+                    webdriver,
+                    waiter,
+                    snapshot.load_more_button,
+                    discovery.more_loaded(),
+                )
+            # A Load more which never loads anything trips the breaker too.
+            breaker.record(loaded)
+            if loaded:
+                event_bus.publish(PAGE_LOADED)
+        else:
+            logger.info('No more coupons or "Load more" button; done')
+            if catalog:
+                catalog_offers(webdriver, catalog)
+    return throughput
+
+
+def prefetch_more(webdriver, load_more_button, catalog):
+    """Clicks Load more without waiting, so the next page loads meanwhile."""
+    if catalog:
+        catalog_offers(webdriver, catalog)
+    logger.info("Loading more ahead of time")
+    with phase("load-more"):
+        user_click(webdriver, load_more_button)
 
-    logger.info("All done! Sleeping for 5m before exiting to allow for review")
-    time.sleep(60 * 5)
 
+def catalog_offers(webdriver, catalog):
+    """Adds offers which are new or changed since the last call."""
+    with phase("catalog"):
+        num_offers = catalog.add_offers(stream_offers(webdriver))
+    logger.info("Cataloged {} offers".format(num_offers))
 
+
+def clip_batch(webdriver, pacing_ms, snapshot, throughput, ledger, retries, breaker):
+    """Returns the number of offers clipped."""
+    results = batch_clip(
+        webdriver, COUPON_BUTTON_XPATH, pacing_ms, snapshot.pending_count
+    )
+    num_clipped = 0
+    remaining = snapshot.pending_count
+    for result in results:
+        expires_at = parse_expiry(result["expiry"])
+        success = result["status"] == STATUS_SUCCESS
+        remaining -= 1
+        failure = None if success else result["status"]
+        publish_clip(result["offerId"], failure, remaining)
+        breaker.record(success)
+        if success:
+            num_clipped += 1
+            if ledger:
+                ledger.record_clipped(result["offerId"], expires_at)
+            continue
+        # Without an offer id, the batch fallback to single clicks bounds
+        # retries instead.
+        if result["offerId"]:
+            retries.record_failure(result["offerId"])
+        if ledger:
+            ledger.record_failure(result["offerId"], expires_at)
+    throughput.add(clicks=len(results), clipped=num_clipped)
+    return num_clipped
+
+
+def clip_one(webdriver, waiter, offer, throughput, ledger):
+    """Returns None if the offer was clipped, otherwise a FAILURE_ kind."""
+    button = offer["button"]
+    failure = None
+    try:
+        user_click(webdriver, button)
+        # Ends early, as a failure, if the site shows its error modal.
+        if waiter.wait(webdriver, button_clipped(button)) != CLIP_CONFIRMED:
+            failure = FAILURE_NOT_CLIPPED
+        # logger.info("Clipped a coupon!")
+    except ElementClickInterceptedException:
+        logger.warning("Click interception error; continuing")
+        failure = FAILURE_INTERCEPTED
+    except StaleElementReferenceException:
+        logger.warning("Stale ref error; continuing")
+        failure = FAILURE_STALE
+    except JavascriptException:
+        logger.warning("JS error; continuing")
+        failure = FAILURE_JAVASCRIPT
+    clipped = failure is None
+    throughput.add(clicks=1, clipped=int(clipped))
+    if ledger:
+        expires_at = parse_expiry(offer["expiry"])
+        if clipped:
+            ledger.record_clipped(offer["offerId"], expires_at)
+        else:
+            ledger.record_failure(offer["offerId"], expires_at)
+    return failure
+
+
+def recover_from_failure(webdriver, waiter, offer, failure):
+    """Gets the page back into a clippable state after a failed clip."""
+    if failure == FAILURE_INTERCEPTED:
+        dismiss_overlays(webdriver, offer["button"])
+    elif failure == FAILURE_JAVASCRIPT:
+        reload_coupons(webdriver, waiter)
+    # Stale buttons are re-resolved by the next snapshot, and offers which
+    # didn't flip to clipped are simply retried after their backoff.
+
+
+def dismiss_overlays(webdriver, button):
+    """Closes whatever may be covering the button and scrolls it into view."""
+    snapshot = take_snapshot(webdriver, max_handles=0)
+    for overlay_button in (snapshot.modal_close_button, snapshot.cookie_banner_button):
+        if overlay_button:
+            user_click(webdriver, overlay_button)
+    try:
+        webdriver.execute_script(
+            "arguments[0].scrollIntoView({block: 'center'});", button
+        )
+    except StaleElementReferenceException:
+        pass
+
+
+def reload_coupons(webdriver, waiter):
+    """Reloads the coupon page, for when it's in a state clicks can't fix."""
+    logger.info("Reloading the coupon page")
+    with phase("reload"):
+        webdriver.refresh()
+        waiter.wait(webdriver, work_available())
+    event_bus.publish(PAGE_LOADED, reload=True)
+
+
+def click_load_more(webdriver, waiter, load_more_button, more_loaded=None):
+    """Returns True once more coupons have loaded.
+
+    more_loaded, if given, is the wait condition for that; by default the
+    coupon buttons are counted before and after.
+    """
+    logger.info("Clicking load more!")
+    if not more_loaded:
+        num_buttons = len(probe_elements(webdriver, COUPON_BUTTON_XPATH))
+        more_loaded = all_of(
+            element_gone(LOAD_MORE_SPINNER_XPATH),
+            coupon_button_count_changed(COUPON_BUTTON_XPATH, num_buttons),
+        )
+    user_click(webdriver, load_more_button)
+    return waiter.wait(webdriver, more_loaded)
+
+
+@traced
 def user_click(webdriver, elem):
     rand_user_delay()
-    ActionChains(webdriver).move_to_element(elem).click().perform()
+    click_element(webdriver, elem)
     # elem.click()
 
 
+@traced
 def rand_user_delay():
-    rand_sleep_time_s = random.randint(250, 1250) / 1000.0
-    time.sleep(rand_sleep_time_s)
+    pace()
 
 
 def on_critical(msg):
@@ -178,20 +714,29 @@ def on_critical(msg):
 PROFILE_NAME_XPATH = "//a[contains(concat(' ',normalize-space(@class),' '),' menu-nav__profile-button ')]/span[1]"
 
 
-def login_if_needed(webdriver, args):
-    # Already logged in.
+def is_logged_in(webdriver):
     profile_name_element = get_element_by_xpath(webdriver, PROFILE_NAME_XPATH)
-    if (
+    return bool(
         is_visible(profile_name_element)
         and profile_name_element.text.strip() != "Sign in"
-    ):
+    )
+
+
+def login_if_needed(webdriver, args):
+    # Already logged in.
+    if is_logged_in(webdriver):
         logger.error("Already logged in")
         return True
 
     maybe_prompt_for_safeway_credentials(args)
 
-    if webdriver.current_url != LOGIN_THEN_FOR_U:
-        webdriver.get(LOGIN_THEN_FOR_U)
+    login_url = get_safeway_url(args, LOGIN_THEN_FOR_U_PATH)
+    if webdriver.current_url != login_url:
+        webdriver.get(login_url)
+
+    if args.safeway_user_will_login:
+        logger.info("Waiting up to 5m for you to log in...")
+        return wait_for_login(webdriver, args, 5 * 60)
 
     username_input = get_element_by_id(webdriver, "enterUsername")
     if not username_input:
@@ -225,15 +770,19 @@ def login_if_needed(webdriver, args):
 
     # Delay to allow for any 2FA or captcha.
     logger.info("Waiting up to 120s for any 2FA or captcha...")
-    wait = WebDriverWait(webdriver, 2 * 60)
-    wait.until(EC.url_to_be(COUPON_URL))
+    return wait_for_login(webdriver, args, 2 * 60)
+
+
+def wait_for_login(webdriver, args, timeout_s):
+    """Waits for the sign-in page to land on the coupons page."""
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    wait = WebDriverWait(webdriver, timeout_s, poll_frequency=get_poll_frequency())
+    wait.until(cancellable(EC.url_to_be(get_safeway_url(args, COUPON_PATH))))
 
     logger.info("Login flow complete!")
-    profile_name_element = get_element_by_xpath(webdriver, PROFILE_NAME_XPATH)
-    return (
-        is_visible(profile_name_element)
-        and profile_name_element.text.strip() != "Sign in"
-    )
+    return is_logged_in(webdriver)
 
 
 def maybe_prompt_for_safeway_credentials(args):
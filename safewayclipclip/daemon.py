@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+
+# Keeps warm, logged-in browsers around between clip runs.
+#
+#   python -m safewayclipclip.daemon serve --safeway_username=...
+#   python -m safewayclipclip.daemon submit
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import queue
+import threading
+import time
+from urllib.request import Request, urlopen
+
+from safewayclipclip.args import define_common_args
+from safewayclipclip.log_setup import setup_logging
+
+# Selenium and the clip flow are imported where used, so that the submit
+# client stays a thin, fast-starting process.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8765
+JOBS_PATH = "/jobs"
+HEALTH_PATH = "/health"
+RESULT_PREFIX = "RESULT "
+# Sentinel which ends a job's progress stream.
+_END_OF_JOB = object()
+
+
+class WarmBrowser:
+    """One browser, kept logged in to one account."""
+
+    def __init__(self, args, label):
+        self.args = args
+        self.label = label
+        self.lock = threading.Lock()
+        self.webdriver = None
+        self.waiter = None
+        self.launched_at = 0.0
+        self.jobs_run = 0
+
+    def _new_webdriver(self):
+        from safewayclipclip.session_store import get_session_webdriver
+
+        return get_session_webdriver(self.args)
+
+    def launch(self):
+        from safewayclipclip.cli import start_session
+
+        logger.info("Launching browser for {}".format(self.label))
+        self.webdriver = self._new_webdriver()
+        self.launched_at = time.monotonic()
+        self.jobs_run = 0
+        self.waiter = start_session(self.webdriver, self.args)
+        if not self.waiter:
+            logger.warning("Browser for {} could not log in".format(self.label))
+
+    def close(self):
+        if self.webdriver:
+            try:
+                self.webdriver.quit()
+            except Exception:
+                logger.exception("Error closing browser for {}".format(self.label))
+        self.webdriver = None
+        self.waiter = None
+
+    def recycle(self):
+        self.close()
+        self.launch()
+
+    def relaunch_webdriver(self):
+        """Replaces the driver mid-job, keeping the same session path."""
+        self.webdriver.quit()
+        self.webdriver = self._new_webdriver()
+        self.launched_at = time.monotonic()
+        return self.webdriver
+
+    def is_healthy(self):
+        from selenium.common.exceptions import WebDriverException
+
+        if not self.webdriver or not self.waiter:
+            return False
+        try:
+            self.webdriver.execute_script("return document.readyState")
+            return True
+        except WebDriverException:
+            return False
+
+    def is_stale(self):
+        age_s = time.monotonic() - self.launched_at
+        return age_s > self.args.recycle_after_s or not self.is_healthy()
+
+    def run_job(self):
+        """Clips every coupon; the caller must hold self.lock."""
+        from safewayclipclip.cli import (
+            clip_logged_in,
+            get_safeway_url,
+            is_logged_in,
+            start_session,
+            COUPON_PATH,
+        )
+        from safewayclipclip.waits import page_settled, wait_stats
+        from safewayclipclip.webdriver import implicit_wait_stats
+
+        if not self.is_healthy():
+            self.recycle()
+        if not self.waiter:
+            return None
+        implicit_wait_stats.reset()
+        wait_stats.reset()
+        self.webdriver.get(get_safeway_url(self.args, COUPON_PATH))
+        self.waiter.wait(self.webdriver, page_settled())
+        if not is_logged_in(self.webdriver):
+            logger.info("Session expired; logging in again")
+            self.waiter = start_session(self.webdriver, self.args)
+            if not self.waiter:
+                return None
+        self.jobs_run += 1
+        return clip_logged_in(
+            self.webdriver, self.args, self.waiter, self.relaunch_webdriver
+        )
+
+
+class JobLogHandler(logging.Handler):
+    """Forwards log records from one job's thread to its progress queue."""
+
+    def __init__(self, thread_id, progress):
+        super().__init__()
+        self.thread_id = thread_id
+        self.progress = progress
+
+    def emit(self, record):
+        if record.thread == self.thread_id:
+            self.progress.put(self.format(record))
+
+
+class ClipDaemon:
+    def __init__(self, args, browsers):
+        self.args = args
+        self.browsers = browsers
+        self.stopping = threading.Event()
+        # Jobs, and health checks which may log in again, run one at a time:
+        # the wait stats and pacing policy they reset are process-wide.
+        self.job_lock = threading.Lock()
+
+    def get_browser(self, label):
+        if label is None:
+            return next(iter(self.browsers.values()))
+        return self.browsers.get(label)
+
+    def start(self):
+        for browser in self.browsers.values():
+            browser.launch()
+        threading.Thread(target=self.health_check_loop, daemon=True).start()
+
+    def stop(self):
+        self.stopping.set()
+        for browser in self.browsers.values():
+            with browser.lock:
+                browser.close()
+
+    def health_check_loop(self):
+        while not self.stopping.wait(self.args.health_check_interval_s):
+            # While a job runs, its browser is checked when the job starts,
+            # and the rest at the next interval.
+            if not self.job_lock.acquire(blocking=False):
+                continue
+            try:
+                self.check_browsers()
+            finally:
+                self.job_lock.release()
+
+    def check_browsers(self):
+        for browser in self.browsers.values():
+            with browser.lock:
+                try:
+                    if browser.is_stale():
+                        logger.info("Recycling browser for {}".format(browser.label))
+                        browser.recycle()
+                except Exception:
+                    logger.exception(
+                        "Health check failed for {}".format(browser.label)
+                    )
+
+    def run_job(self, browser, progress):
+        """Runs a job on this thread, sending log lines and a result."""
+        handler = JobLogHandler(threading.get_ident(), progress)
+        handler.setLevel(logging.INFO)
+        logging.getLogger().addHandler(handler)
+        result = {"account": browser.label, "logged_in": False, "error": None}
+        try:
+            with self.job_lock, browser.lock:
+                throughput = browser.run_job()
+            if throughput:
+                result.update(
+                    logged_in=True,
+                    clicks=throughput.clicks,
+                    clipped=throughput.clipped,
+                    skipped=throughput.skipped,
+                    elapsed_s=round(throughput.elapsed_s(), 1),
+                )
+        except Exception as e:
+            result["error"] = type(e).__name__
+            logger.exception("Job failed for {}".format(browser.label))
+        finally:
+            logging.getLogger().removeHandler(handler)
+            progress.put(RESULT_PREFIX + json.dumps(result))
+            progress.put(_END_OF_JOB)
+
+
+class ClipDaemonHandler(BaseHTTPRequestHandler):
+    @property
+    def clip_daemon(self):
+        return self.server.clip_daemon
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, obj, status=200):
+        data = json.dumps(obj).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != HEALTH_PATH:
+            self.send_json({"error": "not found"}, status=404)
+            return
+        self.send_json(
+            {
+                label: {
+                    "busy": browser.lock.locked(),
+                    "logged_in": browser.waiter is not None,
+                    "jobs_run": browser.jobs_run,
+                    "age_s": round(time.monotonic() - browser.launched_at),
+                }
+                for label, browser in self.clip_daemon.browsers.items()
+            }
+        )
+
+    def do_POST(self):
+        if self.path != JOBS_PATH:
+            self.send_json({"error": "not found"}, status=404)
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            job = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            self.send_json({"error": "bad request"}, status=400)
+            return
+        browser = self.clip_daemon.get_browser(job.get("account"))
+        if not browser:
+            self.send_json({"error": "unknown account"}, status=404)
+            return
+
+        # Stream progress back as plain text lines until the job finishes.
+        progress = queue.Queue()
+        threading.Thread(
+            target=self.clip_daemon.run_job, args=(browser, progress), daemon=True
+        ).start()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.end_headers()
+        while True:
+            line = progress.get()
+            if line is _END_OF_JOB:
+                break
+            self.wfile.write((line + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+
+def serve(args):
+    from safewayclipclip.cli import maybe_prompt_for_safeway_credentials
+    from safewayclipclip.multi import get_account_args, load_accounts
+
+    browsers = {}
+    if args.accounts:
+        for account in load_accounts(args.accounts):
+            account_args = get_account_args(args, account)
+            browsers[account.label] = WarmBrowser(account_args, account.label)
+    else:
+        maybe_prompt_for_safeway_credentials(args)
+        browsers["default"] = WarmBrowser(args, "default")
+
+    clip_daemon = ClipDaemon(args, browsers)
+    clip_daemon.start()
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), ClipDaemonHandler)
+    server.daemon_threads = True
+    server.clip_daemon = clip_daemon
+    logger.info("Clip daemon listening on 127.0.0.1:{}".format(args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        clip_daemon.stop()
+
+
+def submit(args):
+    """Submits a clip job and prints its progress as it streams back."""
+    request = Request(
+        "http://127.0.0.1:{}{}".format(args.port, JOBS_PATH),
+        data=json.dumps({"account": args.account}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    result = None
+    with urlopen(request) as response:
+        for raw_line in response:
+            line = raw_line.decode("utf-8").rstrip("\n")
+            if line.startswith(RESULT_PREFIX):
+                result = json.loads(line[len(RESULT_PREFIX) :])
+            else:
+                print(line)
+    print(json.dumps(result, indent=2))
+    return 0 if result and result["logged_in"] and not result["error"] else 1
+
+
+def main():
+    setup_logging("daemon")
+
+    parser = argparse.ArgumentParser(
+        description="Keep warm Safeway browsers running and clip on request."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="Run the daemon.")
+    define_common_args(serve_parser)
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument(
+        "--accounts",
+        default=None,
+        help=(
+            "JSON accounts file (see safewayclipclip.multi) to keep one warm "
+            "browser per account. Jobs run one at a time, so jobs for "
+            "different accounts queue rather than run in parallel. Defaults to "
+            "the single account given by the other flags."
+        ),
+    )
+    serve_parser.add_argument(
+        "--health-check-interval-s",
+        type=float,
+        default=60.0,
+        help="How often idle browsers are checked and recycled if stale.",
+    )
+    serve_parser.add_argument(
+        "--recycle-after-s",
+        type=float,
+        default=6 * 60 * 60,
+        help="Relaunch browsers older than this.",
+    )
+
+    submit_parser = subparsers.add_parser(
+        "submit", help="Submit a clip job to a running daemon."
+    )
+    submit_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    submit_parser.add_argument(
+        "--account",
+        default=None,
+        help="Account label to clip for. Defaults to the daemon's first account.",
+    )
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        exit(submit(args))
+
+
+if __name__ == "__main__":
+    main()
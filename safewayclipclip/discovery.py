@@ -0,0 +1,292 @@
+# Streams newly loaded coupons to the clip loop as they appear, instead of
+# rescanning the whole coupon grid on every step.
+
+from safewayclipclip.events import event_bus, OFFER_DISCOVERED
+from safewayclipclip.snapshot import (
+    COUPON_GRID_SELECTOR,
+    OFFER_EXPIRY_ATTRIBUTE,
+    OFFER_ID_ATTRIBUTE,
+    SKIP_ATTRIBUTE,
+    PageSnapshot,
+)
+from safewayclipclip.waits import script_only
+
+# Start loading the next page once this few coupons are left to clip.
+PREFETCH_LOW_WATER = 5
+
+# Installs a MutationObserver on the coupon grid which keeps, in page, an
+# insertion ordered queue of pending clip buttons, each with its card's
+# metadata read as for the catalog. Buttons are queued as they're added and
+# dequeued as they flip to clipped, so draining the queue only ever touches
+# what changed. References to the page's other controls
+# are cached, and only looked up again once something outside the grid
+# changes.
+INSTALL_SCRIPT = """
+const gridSelector = arguments[0];
+const offerIdAttribute = arguments[1];
+const expiryAttribute = arguments[2];
+const skipAttribute = arguments[3];
+const spinnerSelector = '.spinner, .loading';
+
+if (window.__clipclip) {
+    window.__clipclip.gridObserver.disconnect();
+    window.__clipclip.pageObserver.disconnect();
+}
+const grid = document.querySelector(gridSelector) || document.body;
+const s = {
+    grid: grid,
+    pending: new Map(),
+    added: 0,
+    clippedCount: 0,
+    spinners: new Set(grid.querySelectorAll(spinnerSelector)),
+    refs: null,
+};
+
+function isClipButton(b) {
+    const text = b.textContent;
+    return text.includes('Activate') || text.includes('Clip Coupon');
+}
+
+function text(card, names) {
+    for (const name of names) {
+        const el = card.querySelector('[class*="' + name + '"]');
+        if (el) {
+            return el.textContent.trim();
+        }
+    }
+    return null;
+}
+
+function describe(card) {
+    if (!card) {
+        return {offerId: null, expiry: null};
+    }
+    return {
+        offerId: card.getAttribute(offerIdAttribute),
+        expiry: card.getAttribute(expiryAttribute),
+        brand: text(card, ['brand']),
+        category: card.dataset.category || text(card, ['category']),
+        discount: card.dataset.discount || text(card, ['discount', 'savings']),
+    };
+}
+
+function queue(b) {
+    if (s.pending.has(b) || b.hasAttribute(skipAttribute) || !isClipButton(b)) {
+        return;
+    }
+    const card = b.closest('[' + offerIdAttribute + ']');
+    s.pending.set(b, Object.assign({button: b}, describe(card)));
+    s.added++;
+}
+
+function scan(node) {
+    if (node.nodeType !== Node.ELEMENT_NODE) {
+        return;
+    }
+    if (node.matches(spinnerSelector)) {
+        s.spinners.add(node);
+    }
+    if (node.tagName === 'BUTTON') {
+        queue(node);
+        return;
+    }
+    for (const b of node.querySelectorAll('button')) {
+        queue(b);
+    }
+    for (const spinner of node.querySelectorAll(spinnerSelector)) {
+        s.spinners.add(spinner);
+    }
+}
+
+function update(node) {
+    const el = node.nodeType === Node.ELEMENT_NODE ? node : node.parentElement;
+    const b = el ? el.closest('button') : null;
+    if (!b) {
+        return;
+    }
+    if (b.textContent.includes('Clipped')) {
+        if (s.pending.delete(b)) {
+            s.clippedCount++;
+        }
+    } else {
+        queue(b);
+    }
+}
+
+s.gridObserver = new MutationObserver((mutations) => {
+    for (const m of mutations) {
+        if (m.type === 'childList') {
+            for (const node of m.addedNodes) {
+                scan(node);
+            }
+        }
+        update(m.target);
+    }
+});
+s.gridObserver.observe(grid, {
+    childList: true,
+    subtree: true,
+    characterData: true,
+    attributes: true,
+    attributeFilter: ['class', 'disabled'],
+});
+s.pageObserver = new MutationObserver((mutations) => {
+    for (const m of mutations) {
+        if (!grid.contains(m.target)) {
+            s.refs = null;
+            return;
+        }
+    }
+});
+s.pageObserver.observe(document.body, {childList: true, subtree: true});
+
+scan(grid);
+for (const b of grid.querySelectorAll('button')) {
+    if (b.textContent.includes('Clipped')) {
+        s.clippedCount++;
+    }
+}
+window.__clipclip = s;
+"""
+
+# Returns the same fields as SNAPSHOT_SCRIPT, from the observer's queue. Only
+# the first `maxHandles` queued buttons are checked and returned. Returns null
+# if the observer is gone, e.g. after the page was reloaded.
+DRAIN_SCRIPT = """
+const maxHandles = arguments[0];
+const skipAttribute = arguments[1];
+const s = window.__clipclip;
+if (!s || !s.grid.isConnected) {
+    return null;
+}
+
+function isVisible(el) {
+    return el && el.isConnected && el.getClientRects().length > 0;
+}
+
+function findButton(root, text) {
+    if (!root) {
+        return null;
+    }
+    for (const b of root.querySelectorAll('button')) {
+        if (b.textContent.includes(text)) {
+            return b;
+        }
+    }
+    return null;
+}
+
+if (!s.refs || !Object.values(s.refs).every((ref) => !ref || ref.isConnected)) {
+    const modal = document.getElementById('errorModal');
+    s.refs = {
+        loadMore: findButton(document, 'Load more'),
+        modalClose: findButton(modal, 'Close'),
+        cookieBanner: findButton(document, 'Accept All'),
+    };
+}
+
+function isClipButton(b) {
+    const text = b.textContent;
+    return text.includes('Activate') || text.includes('Clip Coupon');
+}
+
+const pending = [];
+for (const [b, offer] of s.pending) {
+    if (pending.length >= maxHandles) {
+        break;
+    }
+    // Buttons relabeled to anything but Clipped are dropped here, as the
+    // observer only dequeues those labeled Clipped.
+    if (
+        !b.isConnected ||
+        b.hasAttribute(skipAttribute) ||
+        !isClipButton(b) ||
+        !isVisible(b)
+    ) {
+        s.pending.delete(b);
+        continue;
+    }
+    pending.push(offer);
+}
+
+let loading = false;
+for (const spinner of s.spinners) {
+    if (!spinner.isConnected) {
+        s.spinners.delete(spinner);
+    } else if (isVisible(spinner)) {
+        loading = true;
+    }
+}
+
+return {
+    pendingOffers: pending,
+    pendingCount: s.pending.size,
+    clippedCount: s.clippedCount,
+    loading: loading,
+    loadMoreButton: isVisible(s.refs.loadMore) ? s.refs.loadMore : null,
+    modalCloseButton: isVisible(s.refs.modalClose) ? s.refs.modalClose : null,
+    cookieBannerButton: isVisible(s.refs.cookieBanner) ? s.refs.cookieBanner : null,
+    added: s.added,
+};
+"""
+
+
+class CouponDiscovery:
+    """Drains coupons found by an in-page MutationObserver.
+
+    A drop-in for take_snapshot in the clip loop: the observer is installed
+    on first use, and again whenever the page has been reloaded.
+    """
+
+    def __init__(self, webdriver):
+        self.webdriver = webdriver
+        # Clip buttons the observer has queued since it was installed.
+        self.added = 0
+        # Times the observer has been installed, i.e. the page (re)loaded.
+        self.installs = 0
+
+    def install(self):
+        self.installs += 1
+        self.webdriver.execute_script(
+            INSTALL_SCRIPT,
+            COUPON_GRID_SELECTOR,
+            OFFER_ID_ATTRIBUTE,
+            OFFER_EXPIRY_ATTRIBUTE,
+            SKIP_ATTRIBUTE,
+        )
+
+    def snapshot(self, max_handles=1):
+        raw = self.webdriver.execute_script(DRAIN_SCRIPT, max_handles, SKIP_ATTRIBUTE)
+        if raw is None:
+            self.install()
+            raw = self.webdriver.execute_script(
+                DRAIN_SCRIPT, max_handles, SKIP_ATTRIBUTE
+            )
+        if raw["added"] > self.added:
+            event_bus.publish(
+                OFFER_DISCOVERED,
+                count=raw["added"] - self.added,
+                remaining=raw["pendingCount"],
+            )
+        self.added = raw["added"]
+        return PageSnapshot(raw)
+
+    def more_loaded(self):
+        """Wait condition: true once loading ends having queued new buttons."""
+        added = self.added
+
+        @script_only
+        def condition(driver):
+            snapshot = self.snapshot(max_handles=0)
+            return not snapshot.loading and self.added > added
+
+        return condition
+
+    def done_loading(self):
+        """Wait condition: true once no loading spinner is showing."""
+
+        @script_only
+        def condition(driver):
+            return not self.snapshot(max_handles=0).loading
+
+        return condition
@@ -0,0 +1,167 @@
+from collections import Counter, namedtuple
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Events published by the clip pipeline. Data never includes PII: offers are
+# identified by their offer id only.
+RUN_STARTED = "run_started"
+OFFER_DISCOVERED = "offer_discovered"
+CLIP_OK = "clip_ok"
+CLIP_FAILED = "clip_failed"
+PAGE_LOADED = "page_loaded"
+RUN_FINISHED = "run_finished"
+
+# How long sinks may sit on coalesced updates before they're flushed.
+FLUSH_INTERVAL_S = 0.1
+
+Event = namedtuple("Event", ["type", "time", "data"])
+
+
+class EventBus:
+    """Carries events from the clip pipeline to any number of sinks.
+
+    Publishing only queues the event, and is a no-op with no sinks, so the
+    clip loop never waits on presentation. A single dispatcher thread, idle
+    until there's an event, hands each one to every sink's handle(event),
+    then calls their flush() once things go quiet for flush_interval_s, so
+    sinks can coalesce updates.
+    """
+
+    def __init__(self, flush_interval_s=FLUSH_INTERVAL_S):
+        self.flush_interval_s = flush_interval_s
+        self.sinks = []
+        self.queue = queue.SimpleQueue()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def subscribe(self, sink):
+        with self.lock:
+            # Replaced rather than mutated, so the dispatcher never sees a
+            # list change under it.
+            self.sinks = self.sinks + [sink]
+            if not self.thread:
+                self.thread = threading.Thread(
+                    target=self._run, name="event-bus", daemon=True
+                )
+                self.thread.start()
+        return sink
+
+    def unsubscribe(self, sink):
+        with self.lock:
+            self.sinks = [s for s in self.sinks if s is not sink]
+
+    def publish(self, event_type, **data):
+        if self.sinks:
+            self.queue.put(Event(event_type, time.time(), data))
+
+    def drain(self, timeout_s=5.0):
+        """Waits until every event published so far is handled and flushed."""
+        if not self.thread:
+            return
+        drained = threading.Event()
+        self.queue.put(drained)
+        drained.wait(timeout_s)
+
+    def _run(self):
+        dirty = False
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval_s if dirty else None)
+            except queue.Empty:
+                self._flush()
+                dirty = False
+                continue
+            if isinstance(item, threading.Event):
+                self._flush()
+                dirty = False
+                item.set()
+                continue
+            for sink in self.sinks:
+                try:
+                    sink.handle(item)
+                except Exception:
+                    logger.exception("Event sink {} failed".format(type(sink).__name__))
+            dirty = True
+
+    def _flush(self):
+        for sink in self.sinks:
+            try:
+                sink.flush()
+            except Exception:
+                logger.exception("Event sink {} failed".format(type(sink).__name__))
+
+
+event_bus = EventBus()
+
+
+def publish_clip(offer_id, failure=None, remaining=None):
+    """Publishes a clip_ok, or a clip_failed with the FAILURE_ kind."""
+    if failure:
+        event_bus.publish(
+            CLIP_FAILED, offer_id=offer_id, failure=failure, remaining=remaining
+        )
+    else:
+        event_bus.publish(CLIP_OK, offer_id=offer_id, remaining=remaining)
+
+
+class JsonlSink:
+    """Appends every event to a file, one JSON object per line."""
+
+    def __init__(self, filename):
+        os.makedirs(os.path.dirname(os.path.abspath(filename)), exist_ok=True)
+        self.f = open(filename, "a")
+
+    def handle(self, event):
+        record = {"type": event.type, "time": round(event.time, 3)}
+        record.update(event.data)
+        self.f.write(json.dumps(record) + "\n")
+
+    def flush(self):
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+class MetricsSink:
+    """Aggregates event counts and clip rate, logged when the run finishes."""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.failures = Counter()
+        self.started_at = None
+
+    def handle(self, event):
+        self.counts[event.type] += 1
+        if event.type == RUN_STARTED:
+            self.started_at = event.time
+        elif event.type == CLIP_FAILED:
+            self.failures[event.data["failure"]] += 1
+        elif event.type == RUN_FINISHED:
+            self.log_summary(event.time)
+
+    def flush(self):
+        pass
+
+    def clips_per_s(self, now=None):
+        if self.started_at is None:
+            return 0.0
+        elapsed_s = (now or time.time()) - self.started_at
+        return self.counts[CLIP_OK] / elapsed_s if elapsed_s > 0 else 0.0
+
+    def log_summary(self, now=None):
+        logger.info(
+            "Events: {} clipped, {} failed {}, {} pages loaded ({:.2f} clips/s)".format(
+                self.counts[CLIP_OK],
+                self.counts[CLIP_FAILED],
+                dict(self.failures),
+                self.counts[PAGE_LOADED],
+                self.clips_per_s(now),
+            )
+        )
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+# A local stand-in for the Safeway sign-in and coupon pages, used to exercise
+# and benchmark the clip loop without a real account.
+
+import argparse
+from datetime import date, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import logging
+import random
+from string import Template
+import threading
+from urllib.parse import parse_qs, quote, urlparse
+
+from safewayclipclip.http_clip import (
+    ACCESS_TOKEN_COOKIE,
+    CLIP_PATH,
+    OFFERS_PATH,
+    SESSION_INFO_COOKIE,
+)
+
+logger = logging.getLogger(__name__)
+
+SIGN_IN_PATH = "/account/sign-in.html"
+COUPON_PATH = "/loyalty/coupons-deals"
+LOGIN_API_PATH = "/bench/login"
+OFFERS_PAGE_PATH = "/bench/offers"
+STATS_PATH = "/bench/stats"
+
+SESSION_COOKIE = "bench_session"
+STORE_ID = "1234"
+
+BRANDS = [
+    "Lucerne",
+    "Signature Select",
+    "O Organics",
+    "Open Nature",
+    "Kraft",
+    "General Mills",
+    "Tide",
+    "Coca-Cola",
+]
+CATEGORIES = [
+    "Dairy",
+    "Frozen",
+    "Beverages",
+    "Snacks",
+    "Household",
+    "Meat & Seafood",
+    "Produce",
+    "Personal Care",
+]
+OFFER_PROGRAMS = ["MF", "PD", "SC"]
+
+PAGE_STYLE = """
+body { font-family: sans-serif; margin: 0; padding-bottom: 80px; }
+.coupon-card { display: inline-block; width: 200px; height: 160px;
+    margin: 8px; padding: 8px; border: 1px solid #ccc; vertical-align: top; }
+.loading { padding: 16px; }
+#errorModal { position: fixed; top: 0; left: 0; right: 0; bottom: 0;
+    background: rgba(0, 0, 0, 0.5); }
+#errorModal div { background: white; margin: 200px auto; width: 300px;
+    padding: 16px; }
+#cookieBanner { position: fixed; bottom: 0; left: 0; right: 0; height: 48px;
+    background: #eee; }
+"""
+
+SIGN_IN_PAGE = Template(
+    """<!DOCTYPE html>
+<html><head><title>Sign In</title><style>$style</style></head><body>
+<nav><a class="menu-nav__profile-button" href="#"><span>Sign in</span></a></nav>
+<input id="enterUsername" type="text">
+<button id="passwordButton">Sign in with password</button>
+<div id="passwordSection" style="display: none">
+  <input id="password" type="password">
+  <button id="signInButton">Sign In</button>
+</div>
+<script>
+document.getElementById('passwordButton').addEventListener('click', () => {
+  document.getElementById('passwordSection').style.display = '';
+});
+document.getElementById('signInButton').addEventListener('click', () => {
+  fetch('$login_api_path', {method: 'POST'}).then(() => {
+    window.location.href = '$coupon_path';
+  });
+});
+</script>
+</body></html>
+"""
+)
+
+COUPON_PAGE = Template(
+    """<!DOCTYPE html>
+<html><head><title>Coupons &amp; Deals</title><style>$style</style></head><body>
+<nav><a class="menu-nav__profile-button" href="#"><span>Bench User</span></a></nav>
+<div class="coupon-grid-container">
+  <div id="couponCards">$cards</div>
+  <div class="loading" style="display: none">Loading...</div>
+</div>
+<button id="loadMoreButton" style="$load_more_style">Load more</button>
+<div id="errorModal" style="display: none">
+  <div><p>Something went wrong.</p><button>Close</button></div>
+</div>
+<div id="cookieBanner"><button>Accept All</button></div>
+<script>
+const pageSize = $page_size;
+const total = $total;
+const loadDelayMs = $load_delay_ms;
+let nextOffset = pageSize;
+
+const cards = document.getElementById('couponCards');
+const spinner = document.querySelector('.loading');
+const loadMoreButton = document.getElementById('loadMoreButton');
+const errorModal = document.getElementById('errorModal');
+const cookieBanner = document.getElementById('cookieBanner');
+
+cookieBanner.querySelector('button').addEventListener('click', () => {
+  cookieBanner.style.display = 'none';
+});
+errorModal.querySelector('button').addEventListener('click', () => {
+  errorModal.style.display = 'none';
+});
+
+cards.addEventListener('click', (event) => {
+  const button = event.target.closest('button');
+  if (!button || !button.textContent.includes('Clip Coupon')) {
+    return;
+  }
+  const card = button.closest('.coupon-card');
+  const body = {items: [{
+    clipType: 'C',
+    itemId: card.dataset.offerId,
+    itemType: card.dataset.offerPgm,
+  }]};
+  fetch('$clip_path?storeId=$store_id', {
+    method: 'POST',
+    headers: {'Content-Type': 'application/json'},
+    body: JSON.stringify(body),
+  }).then((r) => r.json()).then((data) => {
+    if (data.items.some((item) => item.errorCd)) {
+      errorModal.style.display = '';
+      return;
+    }
+    button.textContent = 'Clipped';
+    button.className = 'clipped';
+    button.disabled = true;
+  }).catch(() => {
+    errorModal.style.display = '';
+  });
+});
+
+loadMoreButton.addEventListener('click', () => {
+  loadMoreButton.style.display = 'none';
+  spinner.style.display = '';
+  const url = '$offers_page_path?offset=' + nextOffset + '&limit=' + pageSize;
+  fetch(url).then((r) => r.text()).then((html) => {
+    setTimeout(() => {
+      cards.insertAdjacentHTML('beforeend', html);
+      nextOffset += pageSize;
+      spinner.style.display = 'none';
+      if (nextOffset < total) {
+        loadMoreButton.style.display = '';
+      }
+    }, loadDelayMs);
+  });
+});
+</script>
+</body></html>
+"""
+)
+
+CARD = Template(
+    """<div class="coupon-card" data-offer-id="$offer_id" data-offer-pgm="$offer_pgm"
+  data-category="$category" data-expiry="$expiry" data-discount="$discount">
+  <div class="coupon-brand">$brand</div>
+  <div class="coupon-title">$title</div>
+  <div class="coupon-category">$category</div>
+  <div class="coupon-discount">$$$discount OFF</div>
+  <div class="coupon-expiry">Expires $expiry</div>
+  $button
+</div>
+"""
+)
+
+
+class FakeSafewaySite:
+    """Serves a fake sign-in page, coupon grid and offer API on localhost."""
+
+    def __init__(
+        self, num_coupons, page_size=30, error_rate=0.02, load_delay_ms=300, seed=0
+    ):
+        self.page_size = page_size
+        self.error_rate = error_rate
+        self.load_delay_ms = load_delay_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.offers = self.generate_offers(num_coupons)
+        self.offer_ids = list(self.offers.keys())
+        self.clip_requests = 0
+        self.clip_errors = 0
+        self.server = None
+        self.thread = None
+
+    def generate_offers(self, num_coupons):
+        today = date.today()
+        offers = {}
+        for i in range(num_coupons):
+            offer_id = str(1000000 + i)
+            brand = self.random.choice(BRANDS)
+            offers[offer_id] = {
+                "offerId": offer_id,
+                "offerPgm": self.random.choice(OFFER_PROGRAMS),
+                "brand": brand,
+                "name": "{} offer #{}".format(brand, i),
+                "category": self.random.choice(CATEGORIES),
+                "discount": "{:.2f}".format(self.random.randint(25, 500) / 100.0),
+                "expiry": (
+                    today + timedelta(days=self.random.randint(1, 60))
+                ).isoformat(),
+                "status": "U",
+            }
+        return offers
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return "http://{}:{}".format(host, port)
+
+    def start(self, port=0):
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), FakeSafewayHandler)
+        self.server.daemon_threads = True
+        self.server.site = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info("Fake Safeway site serving at {}".format(self.url))
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def num_clipped(self):
+        with self.lock:
+            return sum(1 for o in self.offers.values() if o["status"] == "C")
+
+    def stats(self):
+        return {
+            "offers": len(self.offers),
+            "clipped": self.num_clipped(),
+            "clip_requests": self.clip_requests,
+            "clip_errors": self.clip_errors,
+        }
+
+    def clip(self, offer_id):
+        """Returns False when simulating a server error."""
+        with self.lock:
+            self.clip_requests += 1
+            if offer_id not in self.offers or self.random.random() < self.error_rate:
+                self.clip_errors += 1
+                return False
+            self.offers[offer_id]["status"] = "C"
+            return True
+
+    def render_cards(self, offset, limit):
+        html = []
+        with self.lock:
+            for offer_id in self.offer_ids[offset : offset + limit]:
+                offer = self.offers[offer_id]
+                if offer["status"] == "C":
+                    button = '<button class="clipped" disabled>Clipped</button>'
+                else:
+                    button = "<button>Clip Coupon</button>"
+                html.append(
+                    CARD.substitute(
+                        offer_id=offer_id,
+                        offer_pgm=offer["offerPgm"],
+                        brand=offer["brand"],
+                        title=offer["name"],
+                        category=offer["category"],
+                        discount=offer["discount"],
+                        expiry=offer["expiry"],
+                        button=button,
+                    )
+                )
+        return "".join(html)
+
+
+class FakeSafewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def site(self):
+        return self.server.site
+
+    def log_message(self, format, *args):
+        pass
+
+    def is_logged_in(self):
+        if self.headers.get("Authorization"):
+            return True
+        cookies = SimpleCookie(self.headers.get("Cookie", ""))
+        return SESSION_COOKIE in cookies
+
+    def send_body(self, body, content_type="text/html", status=200, headers=()):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, obj, status=200, headers=()):
+        self.send_body(json.dumps(obj), "application/json", status, headers)
+
+    def redirect(self, location):
+        self.send_response(302)
+        self.send_header("Location", location)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == SIGN_IN_PATH:
+            if self.is_logged_in():
+                self.redirect(COUPON_PATH)
+            else:
+                self.send_body(
+                    SIGN_IN_PAGE.substitute(
+                        style=PAGE_STYLE,
+                        login_api_path=LOGIN_API_PATH,
+                        coupon_path=COUPON_PATH,
+                    )
+                )
+        elif url.path == COUPON_PATH:
+            if not self.is_logged_in():
+                self.redirect(SIGN_IN_PATH)
+                return
+            total = len(self.site.offers)
+            self.send_body(
+                COUPON_PAGE.substitute(
+                    style=PAGE_STYLE,
+                    cards=self.site.render_cards(0, self.site.page_size),
+                    load_more_style=(
+                        "" if total > self.site.page_size else "display: none"
+                    ),
+                    page_size=self.site.page_size,
+                    total=total,
+                    load_delay_ms=self.site.load_delay_ms,
+                    clip_path=CLIP_PATH,
+                    store_id=STORE_ID,
+                    offers_page_path=OFFERS_PAGE_PATH,
+                )
+            )
+        elif url.path == OFFERS_PAGE_PATH:
+            offset = int(query.get("offset", ["0"])[0])
+            limit = int(query.get("limit", [str(self.site.page_size)])[0])
+            self.send_body(self.site.render_cards(offset, limit))
+        elif url.path == OFFERS_PATH:
+            if not self.is_logged_in():
+                self.send_json({"error": "unauthorized"}, status=401)
+                return
+            with self.site.lock:
+                offers = {k: dict(v) for k, v in self.site.offers.items()}
+            self.send_json({"companionGalleryOffer": offers})
+        elif url.path == STATS_PATH:
+            self.send_json(self.site.stats())
+        else:
+            self.send_body("Not found", "text/plain", status=404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length) if length else b""
+        if url.path == LOGIN_API_PATH:
+            session_info = json.dumps({"info": {"J4U": {"storeId": STORE_ID}}})
+            access_token = json.dumps({"accessToken": "bench-token"})
+            cookies = [
+                "{}=1".format(SESSION_COOKIE),
+                "{}={}".format(SESSION_INFO_COOKIE, quote(session_info)),
+                "{}={}".format(ACCESS_TOKEN_COOKIE, quote(access_token)),
+            ]
+            self.send_json(
+                {"ok": True},
+                headers=[("Set-Cookie", c + "; Path=/") for c in cookies],
+            )
+        elif url.path == CLIP_PATH:
+            if not self.is_logged_in():
+                self.send_json({"error": "unauthorized"}, status=401)
+                return
+            try:
+                items = json.loads(body or b"{}").get("items", [])
+            except ValueError:
+                self.send_json({"error": "bad request"}, status=400)
+                return
+            results = []
+            for offer_id in sorted({item.get("itemId") for item in items}):
+                if self.site.clip(offer_id):
+                    results.append({"itemId": offer_id, "status": 1})
+                else:
+                    results.append({"itemId": offer_id, "errorCd": "CLIP_ERROR"})
+            self.send_json({"items": results})
+        else:
+            self.send_body("Not found", "text/plain", status=404)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Serve a fake Safeway site.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--coupons", type=int, default=100)
+    parser.add_argument("--page-size", type=int, default=30)
+    parser.add_argument("--error-rate", type=float, default=0.02)
+    parser.add_argument("--load-delay-ms", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    site = FakeSafewaySite(
+        args.coupons, args.page_size, args.error_rate, args.load_delay_ms, args.seed
+    )
+    site.start(args.port)
+    try:
+        site.thread.join()
+    except KeyboardInterrupt:
+        site.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,307 @@
+# The Qt GUI, imported by main.py only once it's actually shown.
+
+import argparse
+import atexit
+from functools import partial
+import logging
+import sys
+import threading
+
+from PyQt5.QtCore import (
+    Qt, QObject, QThread, pyqtSlot, pyqtSignal)
+from PyQt5.QtGui import QKeySequence
+from PyQt5.QtWidgets import (
+    QApplication, QCheckBox, QDialog, QFormLayout, QGroupBox, QHBoxLayout,
+    QLabel, QLineEdit, QMainWindow, QProgressBar,
+    QPushButton, QShortcut, QWidget, QVBoxLayout)
+
+from safewayclipclip.cli import clip_clip
+from safewayclipclip.events import event_bus
+from safewayclipclip.my_progress import QtProgressSink
+from safewayclipclip.session_store import get_session_webdriver
+from safewayclipclip.waits import set_cancel_event, RunCancelled
+
+logger = logging.getLogger(__name__)
+
+NEVER_SAVE_MSG = 'Username is *never* saved.'
+NEVER_SAVE_PASSWORD_MSG = 'Password is *never* saved.'
+
+# Progress is coalesced off the Qt thread and emitted at most this often, so
+# a long run doesn't flood the Qt event loop.
+PROGRESS_INTERVAL_S = 0.1
+
+
+class ClipClipGui:
+    def __init__(self, args, arg_name_to_help):
+        self.args = args
+        self.arg_name_to_help = arg_name_to_help
+
+    def create_gui(self):
+        try:
+            from fbs_runtime.application_context.PyQt5 import (
+                ApplicationContext)
+            appctxt = ApplicationContext()
+            app = appctxt.app
+        except ImportError:
+            app = QApplication(sys.argv)
+        app.setStyle('Fusion')
+        self.window = QMainWindow()
+
+        self.quit_shortcuts = []
+        for seq in ("Ctrl+Q", "Ctrl+C", "Ctrl+W", "ESC"):
+            s = QShortcut(QKeySequence(seq), self.window)
+            s.activated.connect(app.exit)
+            self.quit_shortcuts.append(s)
+
+        v_layout = QVBoxLayout()
+
+        safeway_group = QGroupBox('Safeway Login')
+        safeway_group.setMinimumWidth(350)
+        safeway_layout = QFormLayout()
+
+        safeway_layout.addRow(
+            'Username (email or phone#):',
+            self.create_line_edit('safeway_username', tool_tip=NEVER_SAVE_MSG))
+        safeway_layout.addRow(
+            'Password:',
+            self.create_line_edit(
+                'safeway_password', tool_tip=NEVER_SAVE_PASSWORD_MSG,
+                password=True))
+        safeway_layout.addRow(
+            'I will login myself',
+            self.create_checkbox('safeway_user_will_login'))
+
+        safeway_group.setLayout(safeway_layout)
+        v_layout.addWidget(safeway_group)
+
+        self.start_button = QPushButton('Go')
+        self.start_button.setAutoDefault(True)
+        self.start_button.clicked.connect(self.on_start_button_clicked)
+        v_layout.addWidget(self.start_button)
+
+        main_widget = QWidget()
+        main_widget.setLayout(v_layout)
+        self.window.setCentralWidget(main_widget)
+        self.window.show()
+        return app.exec_()
+
+    def on_quit(self):
+        pass
+
+    def on_dialog_closed(self):
+        self.start_button.setEnabled(True)
+
+    def on_start_button_clicked(self):
+        self.start_button.setEnabled(False)
+        args = argparse.Namespace(**vars(self.args))
+        self.progress = ProgressDialog(
+            args=args,
+            parent=self.window)
+        self.progress.show()
+        self.progress.finished.connect(self.on_dialog_closed)
+
+    def clear_layout(self, layout):
+        if layout:
+            while layout.count():
+                child = layout.takeAt(0)
+                if child.widget() is not None:
+                    child.widget().deleteLater()
+                elif child.layout() is not None:
+                    self.clear_layout(child.layout())
+
+    def create_checkbox(self, name, tool_tip=None, invert=False):
+        x_box = QCheckBox()
+        x_box.setTristate(False)
+        x_box.setCheckState(
+            Qt.Checked if getattr(self.args, name) else Qt.Unchecked)
+        if not tool_tip and name in self.arg_name_to_help:
+            tool_tip = 'When checked, ' + self.arg_name_to_help[name]
+        if tool_tip:
+            x_box.setToolTip(tool_tip)
+
+        def on_changed(state):
+            setattr(
+                self.args, name,
+                state != Qt.Checked if invert else state == Qt.Checked)
+        x_box.stateChanged.connect(on_changed)
+        return x_box
+
+    def advance_focus(self):
+        self.window.focusNextChild()
+
+    def create_line_edit(self, name, tool_tip=None, password=False):
+        line_edit = QLineEdit(getattr(self.args, name))
+        if not tool_tip:
+            tool_tip = self.arg_name_to_help[name]
+        if tool_tip:
+            line_edit.setToolTip(tool_tip)
+        if password:
+            line_edit.setEchoMode(QLineEdit.PasswordEchoOnEdit)
+
+        def on_changed(state):
+            setattr(self.args, name, state)
+
+        def on_return():
+            self.advance_focus()
+        line_edit.textChanged.connect(on_changed)
+        line_edit.returnPressed.connect(on_return)
+        return line_edit
+
+
+class ProgressDialog(QDialog):
+    def __init__(self, args, **kwargs):
+        super(ProgressDialog, self).__init__(**kwargs)
+
+        self.args = args
+
+        self.worker = Worker()
+        self.thread = QThread()
+        self.worker.moveToThread(self.thread)
+
+        self.worker.on_error.connect(self.on_error)
+        self.worker.on_done.connect(self.on_done)
+        self.worker.on_stopped.connect(self.on_stopped)
+        self.worker.on_progress.connect(self.on_progress)
+
+        self.thread.started.connect(
+            partial(self.worker.clip_clip, args, self))
+        self.thread.start()
+
+        self.init_ui()
+
+    def init_ui(self):
+        self.setWindowTitle('ClipClip is running...')
+        self.setModal(True)
+        self.v_layout = QVBoxLayout()
+        self.setLayout(self.v_layout)
+
+        self.label = QLabel('Logging in...')
+        self.v_layout.addWidget(self.label)
+        self.reviewing = False
+
+        self.progress = 0
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 0)
+        self.v_layout.addWidget(self.progress_bar)
+
+        self.button_bar = QHBoxLayout()
+        self.v_layout.addLayout(self.button_bar)
+
+        self.cancel_button = QPushButton('Cancel')
+        self.button_bar.addWidget(self.cancel_button)
+        self.cancel_button.clicked.connect(self.on_cancel)
+
+    def on_error(self, msg):
+        logger.error(msg)
+        self.thread.quit()
+        self.reviewing = True
+        self.label.setText('Error: {}'.format(msg))
+        self.label.setStyleSheet(
+            'QLabel { color: red; font-weight: bold; }')
+        self.cancel_button.setText('Close')
+        self.cancel_button.setEnabled(True)
+
+    def on_done(self, num_clipped):
+        self.thread.quit()
+        self.reviewing = True
+        self.label.setText('Done! Clipped {} coupons.'.format(num_clipped))
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(1)
+        self.cancel_button.setText('Close')
+        self.cancel_button.setEnabled(True)
+
+    def on_stopped(self):
+        self.thread.quit()
+        self.close()
+
+    def on_progress(self, clipped, failed, remaining):
+        self.label.setText(
+            'Clipped {}, {} failed, {} remaining'.format(
+                clipped, failed, remaining))
+        attempted = clipped + failed
+        self.progress_bar.setRange(0, attempted + remaining)
+        self.progress_bar.setValue(attempted)
+
+    def on_cancel(self):
+        if not self.reviewing:
+            # Called directly rather than queued: the worker's thread is busy
+            # clipping, so a queued call would only run once it's done.
+            self.cancel_button.setEnabled(False)
+            self.label.setText('Cancelling...')
+            self.worker.stop()
+        else:
+            self.close()
+
+
+class Worker(QObject):
+    """This class is required to prevent locking up the main Qt thread."""
+    on_error = pyqtSignal(str)
+    on_done = pyqtSignal(int)
+    on_stopped = pyqtSignal()
+    # Clipped, failed and remaining coupon counts.
+    on_progress = pyqtSignal(int, int, int)
+    webdriver = None
+
+    def __init__(self):
+        super(Worker, self).__init__()
+        self.cancel_event = threading.Event()
+
+    @pyqtSlot()
+    def stop(self):
+        """Cancels the run between clicks. Safe to call from any thread."""
+        self.cancel_event.set()
+
+    @pyqtSlot(object)
+    def clip_clip(self, args, parent):
+        try:
+            self.do_clip_clip(args, parent)
+        except Exception as e:
+            msg = 'Internal error while running clip clip: {}'.format(e)
+            self.on_error.emit(msg)
+            logger.exception(msg)
+
+    def close_webdriver(self):
+        if self.webdriver:
+            self.webdriver.close()
+            self.webdriver = None
+
+    def get_webdriver(self, args):
+        if self.webdriver:
+            logger.info('Using existing webdriver')
+            return self.webdriver
+        logger.info('Creating a new webdriver')
+        self.webdriver = get_session_webdriver(args)
+        return self.webdriver
+
+    def relaunch_webdriver(self, args):
+        self.webdriver.quit()
+        self.webdriver = None
+        return self.get_webdriver(args)
+
+    def do_clip_clip(self, args, parent):
+        # There's no console to prompt on, so without both credentials the
+        # user logs in themselves in the browser window.
+        if not args.safeway_username or not args.safeway_password:
+            args.safeway_user_will_login = True
+        atexit.register(self.close_webdriver)
+        progress = event_bus.subscribe(QtProgressSink(
+            self.on_progress.emit, interval_s=PROGRESS_INTERVAL_S))
+        set_cancel_event(self.cancel_event)
+        try:
+            throughput = clip_clip(
+                self.get_webdriver(args),
+                args,
+                partial(self.relaunch_webdriver, args))
+        except RunCancelled:
+            logger.info('Clipping cancelled')
+            self.on_stopped.emit()
+            return
+        finally:
+            set_cancel_event(None)
+            event_bus.drain()
+            event_bus.unsubscribe(progress)
+            self.close_webdriver()
+        if not throughput:
+            self.on_error.emit('Cannot login')
+            return
+        self.on_done.emit(throughput.clipped)
@@ -0,0 +1,176 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+from urllib.parse import unquote
+
+# requests is imported where used; it's only needed with --http-clip.
+
+logger = logging.getLogger(__name__)
+
+OFFERS_PATH = "/abs/pub/xapi/offers/companiongalleryoffer"
+CLIP_PATH = "/abs/pub/web/j4u/api/offers/clip"
+
+# Cookies set by the Safeway site after login which carry the API bearer
+# token and the customer's preferred store.
+ACCESS_TOKEN_COOKIE = "swyConsumerDirectoryPro"
+SESSION_INFO_COOKIE = "SWY_SHARED_SESSION_INFO"
+
+API_HEADERS = {
+    "Accept": "application/json",
+    "Content-Type": "application/json",
+    "X-SWY_API_KEY": "emjou",
+    "X-SWY_BANNER": "safeway",
+    "X-SWY_VERSION": "1.1",
+}
+
+UNCLIPPED_STATUS = "U"
+
+
+class HttpClipError(Exception):
+    pass
+
+
+def _parse_cookie_json(cookies, name):
+    if name not in cookies:
+        return {}
+    try:
+        return json.loads(unquote(cookies[name]))
+    except ValueError:
+        return {}
+
+
+def get_session_from_cookies(cookies, user_agent, pool_size=1):
+    """Builds a keep-alive requests.Session logged in with the given cookies.
+
+    cookies are dicts with at least "name" and "value", as returned by
+    WebDriver or saved by session_store.
+    """
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    values = {}
+    for cookie in cookies:
+        session.cookies.set(
+            cookie["name"],
+            cookie["value"],
+            # requests can't set a cookie with a None domain.
+            domain=cookie.get("domain") or "",
+            path=cookie.get("path", "/"),
+        )
+        values[cookie["name"]] = cookie["value"]
+
+    session.headers.update(API_HEADERS)
+    session.headers["User-Agent"] = user_agent
+    access_token = _parse_cookie_json(values, ACCESS_TOKEN_COOKIE).get("accessToken")
+    if access_token:
+        session.headers["Authorization"] = "Bearer {}".format(access_token)
+
+    session_info = _parse_cookie_json(values, SESSION_INFO_COOKIE)
+    store_id = session_info.get("info", {}).get("J4U", {}).get("storeId")
+    if not store_id:
+        session.close()
+        raise HttpClipError("Cannot determine store id from browser session")
+    return session, store_id
+
+
+def get_session_from_webdriver(webdriver, pool_size):
+    """Builds a keep-alive requests.Session sharing the browser's login."""
+    return get_session_from_cookies(
+        webdriver.get_cookies(),
+        webdriver.execute_script("return navigator.userAgent;"),
+        pool_size,
+    )
+
+
+def _get_offers(session, base_url, store_id):
+    response = session.get(
+        base_url + OFFERS_PATH, params={"storeId": store_id}, timeout=30
+    )
+    response.raise_for_status()
+    return response.json().get("companionGalleryOffer", {})
+
+
+def list_offer_ids(session, base_url, store_id):
+    """Returns the ids of every offer, clipped or not."""
+    return list(_get_offers(session, base_url, store_id))
+
+
+def list_unclipped_offers(session, base_url, store_id):
+    """Returns a list of (offer_id, offer_program) for unclipped offers."""
+    offers = _get_offers(session, base_url, store_id)
+    return [
+        (offer_id, offer.get("offerPgm"))
+        for offer_id, offer in offers.items()
+        if offer.get("status") == UNCLIPPED_STATUS
+    ]
+
+
+def clip_offer(session, base_url, store_id, offer_id, offer_program):
+    """Clips a single offer. Returns True on success."""
+    import requests
+
+    items = [
+        {"clipType": clip_type, "itemId": offer_id, "itemType": offer_program}
+        for clip_type in ("C", "L")
+    ]
+    try:
+        response = session.post(
+            base_url + CLIP_PATH,
+            params={"storeId": store_id},
+            json={"items": items},
+            timeout=30,
+        )
+        if not response.ok:
+            return False
+        return all("errorCd" not in item for item in response.json().get("items", []))
+    except (requests.RequestException, ValueError):
+        return False
+
+
+def http_clip(webdriver, base_url, num_workers, ledger=None):
+    """Clips every unclipped offer over HTTP using the browser's session.
+
+    Offers the ledger says to skip are not attempted, and clipped ones are
+    recorded in it. Failures are not, as the browser retries them and
+    records how that goes.
+
+    Returns the number of offers attempted and a list of offer ids which
+    could not be clipped, for the caller to retry through the browser. Raises
+    HttpClipError if offers cannot be listed at all.
+    """
+    import requests
+
+    session, store_id = get_session_from_webdriver(webdriver, num_workers)
+    try:
+        try:
+            offers = list_unclipped_offers(session, base_url, store_id)
+        except (requests.RequestException, ValueError) as e:
+            raise HttpClipError("Cannot list offers: {}".format(type(e).__name__))
+        if ledger:
+            offers = [o for o in offers if not ledger.should_skip(o[0])]
+        logger.info("Found {} unclipped offers over HTTP".format(len(offers)))
+
+        def clip(offer):
+            return clip_offer(session, base_url, store_id, *offer)
+
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            clipped = list(executor.map(clip, offers))
+    finally:
+        session.close()
+
+    failed = [offer[0] for offer, ok in zip(offers, clipped) if not ok]
+    if ledger:
+        for (offer_id, _), ok in zip(offers, clipped):
+            if ok:
+                ledger.record_clipped(offer_id)
+    logger.info(
+        "Clipped {} offers over HTTP; {} failed".format(
+            len(offers) - len(failed), len(failed)
+        )
+    )
+    return len(offers), failed
@@ -0,0 +1,139 @@
+from datetime import date, datetime, time as dt_time
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+OUTCOME_CLIPPED = "clipped"
+OUTCOME_FAILED = "failed"
+
+# Rows for offers without a known expiry are kept this long.
+DEFAULT_TTL_S = 30 * 24 * 60 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS clips (
+    account TEXT NOT NULL,
+    offer_id TEXT NOT NULL,
+    outcome TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (account, offer_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS clips_expires_at ON clips (expires_at);
+"""
+
+
+def get_account_key(username):
+    """Stable, non-reversible key so the ledger never stores the username."""
+    if not username:
+        return "default"
+    return hashlib.sha256(username.strip().lower().encode("utf-8")).hexdigest()[:16]
+
+
+def parse_expiry(expiry):
+    """Converts an ISO date (offer expires at the end of it) to a timestamp."""
+    if not expiry:
+        return None
+    try:
+        expiry_date = date.fromisoformat(expiry[:10])
+    except ValueError:
+        return None
+    return datetime.combine(expiry_date, dt_time.max).timestamp()
+
+
+class ClipLedger:
+    """Per-account record of offers already clipped or known to fail.
+
+    Every outcome is committed as it happens so an interrupted run resumes
+    where it left off. The account's skip set is held in memory, making each
+    lookup a set membership test regardless of ledger size.
+
+    A ledger is opened per run, and counts at most one failure per offer per
+    run: retries within the run are bounded by OfferRetries, and an offer is
+    only skipped for good once it has failed in max_failures separate runs.
+    """
+
+    def __init__(self, path, account, max_failures=3):
+        self.account = account
+        self.max_failures = max_failures
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.prune_expired()
+        self.skip_offer_ids = set()
+        self.failures = {}
+        self.failed_this_run = set()
+        for offer_id, outcome, attempts in self.conn.execute(
+            "SELECT offer_id, outcome, attempts FROM clips WHERE account = ?",
+            (account,),
+        ):
+            if outcome == OUTCOME_CLIPPED or attempts >= max_failures:
+                self.skip_offer_ids.add(offer_id)
+            else:
+                self.failures[offer_id] = attempts
+        logger.info(
+            "Ledger has {} offers to skip for this account".format(
+                len(self.skip_offer_ids)
+            )
+        )
+
+    def prune_expired(self):
+        cursor = self.conn.execute(
+            "DELETE FROM clips WHERE expires_at < ?", (time.time(),)
+        )
+        if cursor.rowcount:
+            logger.info("Pruned {} expired ledger rows".format(cursor.rowcount))
+
+    def should_skip(self, offer_id):
+        return offer_id in self.skip_offer_ids
+
+    def _record(self, offer_id, outcome, attempts, expires_at):
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO clips VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                self.account,
+                offer_id,
+                outcome,
+                attempts,
+                now,
+                expires_at or now + DEFAULT_TTL_S,
+            ),
+        )
+
+    def record_clipped(self, offer_id, expires_at=None):
+        if not offer_id:
+            return
+        self.skip_offer_ids.add(offer_id)
+        self.failures.pop(offer_id, None)
+        self._record(offer_id, OUTCOME_CLIPPED, 0, expires_at)
+
+    def record_failure(self, offer_id, expires_at=None):
+        if not offer_id or offer_id in self.failed_this_run:
+            return
+        self.failed_this_run.add(offer_id)
+        attempts = self.failures.get(offer_id, 0) + 1
+        self.failures[offer_id] = attempts
+        if attempts >= self.max_failures:
+            self.skip_offer_ids.add(offer_id)
+        self._record(offer_id, OUTCOME_FAILED, attempts, expires_at)
+
+    def close(self):
+        self.conn.close()
+
+
+def open_ledger(args):
+    """Returns the ClipLedger for the run's account, or None if disabled."""
+    if args.no_ledger:
+        return None
+    os.makedirs(os.path.dirname(os.path.abspath(args.ledger_path)), exist_ok=True)
+    return ClipLedger(
+        args.ledger_path,
+        get_account_key(args.safeway_username),
+        args.ledger_max_failures,
+    )
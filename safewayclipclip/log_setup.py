@@ -0,0 +1,166 @@
+# Logging for the entry points: to the console, and to a rotating, compressed
+# log file per process for helping remote debugging. Records are handed to a background
+# thread to format and write, so the clip loop never waits on the disk.
+#
+# Developers should be vigilant to NOT log any PII, ever (including being
+# mindful of what exceptions might be thrown).
+
+import atexit
+import gzip
+import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import os
+import queue
+import shutil
+import threading
+import time
+
+from safewayclipclip.args import BASE_PATH
+
+LOG_DIRECTORY = os.path.join(BASE_PATH, "Logs")
+MAX_LOG_BYTES = 5 * 2**20
+NUM_LOG_BACKUPS = 10
+# Older logs, including those from before logs were rotated, are deleted.
+MAX_LOG_AGE_DAYS = 30
+FILE_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Identical warnings and errors within this window are counted rather than
+# logged.
+DEDUP_WINDOW_S = 60.0
+MAX_DEDUP_KEYS = 1000
+
+_listener = None
+_queue_handler = None
+# The process which started _listener; forked children must start their own.
+_listener_pid = None
+
+
+class DuplicateFilter(logging.Filter):
+    """Drops repeats of a warning or error within window_s of the first.
+
+    Records are the same when they're logged from the same place with the
+    same message and exception type. The first is logged whole, traceback
+    included; the next one after the window notes how many were dropped.
+    Records below min_level, like progress messages, always pass.
+    """
+
+    def __init__(self, window_s=DEDUP_WINDOW_S, min_level=logging.WARNING):
+        super().__init__()
+        self.window_s = window_s
+        self.min_level = min_level
+        self.lock = threading.Lock()
+        # Key to [time first logged, number dropped since].
+        self.seen = {}
+
+    def filter(self, record):
+        if record.levelno < self.min_level and not record.exc_info:
+            return True
+        exc_type = record.exc_info[0] if record.exc_info else None
+        message = record.getMessage()
+        key = (record.name, record.levelno, record.lineno, message, exc_type)
+        with self.lock:
+            entry = self.seen.get(key)
+            if entry and record.created - entry[0] < self.window_s:
+                entry[1] += 1
+                return False
+            dropped = entry[1] if entry else 0
+            self.seen[key] = [record.created, 0]
+            if len(self.seen) > MAX_DEDUP_KEYS:
+                self._prune(record.created)
+        if dropped:
+            record.msg = "{} [{} repeats dropped]".format(message, dropped)
+            record.args = None
+        return True
+
+    def _prune(self, now):
+        for key, (logged_at, _) in list(self.seen.items()):
+            if now - logged_at >= self.window_s:
+                del self.seen[key]
+
+
+class _InProcessQueueHandler(QueueHandler):
+    """Queues records untouched, leaving all formatting to the listener.
+
+    QueueHandler formats on the logging thread so records can be pickled,
+    which the in-process queue doesn't need.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def _gzip_namer(name):
+    return name + ".gz"
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+def prune_old_logs(directory, max_age_days=MAX_LOG_AGE_DAYS):
+    cutoff = time.time() - max_age_days * 24 * 60 * 60
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        try:
+            if ".log" in name and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def get_log_filename(command):
+    """The process's log file, e.g. Logs/daemon-1234.log.
+
+    The daemon, scheduler and cron runs may all be running at once, and
+    rotating a file another process is writing to loses its lines, so each
+    process writes and rotates its own.
+    """
+    return os.path.join(LOG_DIRECTORY, "{}-{}.log".format(command, os.getpid()))
+
+
+def setup_logging(command="clipclip", log_to_file=True):
+    """Logs INFO and up to the console and, with log_to_file, a file.
+
+    command names the log file. Safe to call more than once; only the first
+    call in each process has any effect.
+    """
+    global _listener, _queue_handler, _listener_pid
+    if _listener:
+        if _listener_pid == os.getpid():
+            return
+        # Forked with the parent's handler, whose listener thread didn't
+        # come along, so records would just queue up.
+        logging.getLogger().removeHandler(_queue_handler)
+    handlers = [logging.StreamHandler()]
+    if log_to_file:
+        log_filename = get_log_filename(command)
+        log_directory = os.path.dirname(os.path.abspath(log_filename))
+        os.makedirs(log_directory, exist_ok=True)
+        prune_old_logs(log_directory)
+        file_handler = RotatingFileHandler(
+            log_filename,
+            maxBytes=MAX_LOG_BYTES,
+            backupCount=NUM_LOG_BACKUPS,
+            delay=True,
+        )
+        file_handler.namer = _gzip_namer
+        file_handler.rotator = _gzip_rotator
+        file_handler.setFormatter(logging.Formatter(FILE_FORMAT))
+        handlers.append(file_handler)
+
+    log_queue = queue.SimpleQueue()
+    _queue_handler = _InProcessQueueHandler(log_queue)
+    _queue_handler.addFilter(DuplicateFilter())
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(_queue_handler)
+    # Disable noisy log spam from filelock from within tldextract.
+    logging.getLogger("filelock").setLevel(logging.WARN)
+
+    _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+    # Flushes whatever is still queued on the way out.
+    atexit.register(_listener.stop)
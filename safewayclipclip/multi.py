@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+# Clips coupons for several Safeway accounts in parallel, one browser each.
+
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import json
+import logging
+import multiprocessing
+import os
+import time
+
+from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.ledger import get_account_key
+from safewayclipclip.log_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Shared between worker processes to space out browser launches.
+_launch_lock = None
+_last_launch_time = None
+
+
+class Account:
+    def __init__(self, username, password, label=None, session_path=None):
+        self.username = username
+        self.password = password
+        self.key = get_account_key(username)
+        # Labels are what's logged, so never default to the username.
+        self.label = label or self.key
+        self.session_path = session_path or os.path.join(
+            BASE_PATH, "ChromeSessions", self.key
+        )
+
+
+def load_accounts(filename):
+    """Reads a JSON list of {"username", "password", "label", "session_path"}."""
+    with open(filename) as f:
+        entries = json.load(f)
+    accounts = []
+    for i, entry in enumerate(entries):
+        if not entry.get("username") or not entry.get("password"):
+            raise ValueError("Account #{} needs a username and password".format(i))
+        accounts.append(
+            Account(
+                entry["username"],
+                entry["password"],
+                entry.get("label"),
+                entry.get("session_path"),
+            )
+        )
+    return accounts
+
+
+def _init_worker(launch_lock, last_launch_time):
+    global _launch_lock, _last_launch_time
+    _launch_lock = launch_lock
+    _last_launch_time = last_launch_time
+    setup_logging("multi")
+
+
+def _wait_for_launch_slot(stagger_s):
+    if not _launch_lock:
+        # Not in a worker pool; the caller spaces out launches itself.
+        return
+    with _launch_lock:
+        wait_s = _last_launch_time.value + stagger_s - time.time()
+        if wait_s > 0:
+            time.sleep(wait_s)
+        _last_launch_time.value = time.time()
+
+
+def get_account_args(args, account):
+    """A copy of args which logs in to, and keeps the session of, account."""
+    args = argparse.Namespace(**vars(args))
+    args.safeway_username = account.username
+    args.safeway_password = account.password
+    args.safeway_user_will_login = False
+    args.session_path = account.session_path
+    # With --session-store=cookies, each account gets its own session file.
+    args.session_file = None
+    return args
+
+
+def clip_account(args, account):
+    """Runs the full clip flow for one account in its own browser."""
+    from safewayclipclip.cli import clip_clip
+    from safewayclipclip.session_store import get_session_webdriver
+
+    args = get_account_args(args, account)
+    if args.session_store == "profile":
+        os.makedirs(account.session_path, exist_ok=True)
+
+    result = {"account": account.label, "logged_in": False, "error": None}
+    _wait_for_launch_slot(args.launch_stagger_s)
+    start_time = time.monotonic()
+    webdriver = get_session_webdriver(args)
+
+    def relaunch_webdriver():
+        nonlocal webdriver
+        webdriver.quit()
+        webdriver = get_session_webdriver(args)
+        return webdriver
+
+    try:
+        throughput = clip_clip(webdriver, args, relaunch_webdriver)
+        if throughput:
+            result.update(
+                logged_in=True,
+                clicks=throughput.clicks,
+                clipped=throughput.clipped,
+                skipped=throughput.skipped,
+            )
+    except Exception as e:
+        # Only the exception type: messages may contain account details.
+        result["error"] = type(e).__name__
+        logger.exception("Clipping failed for account {}".format(account.label))
+    finally:
+        webdriver.quit()
+    result["elapsed_s"] = round(time.monotonic() - start_time, 1)
+    return result
+
+
+def summarize(results, wall_time_s):
+    summary = {
+        "accounts": len(results),
+        "logged_in": sum(1 for r in results if r["logged_in"]),
+        "errors": sum(1 for r in results if r["error"]),
+    }
+    for key in ("clicks", "clipped", "skipped"):
+        summary[key] = sum(r.get(key, 0) for r in results)
+    summary["elapsed_s"] = round(wall_time_s, 1)
+    return summary
+
+
+def run_accounts(args, accounts):
+    launch_lock = multiprocessing.Lock()
+    last_launch_time = multiprocessing.Value("d", 0.0, lock=False)
+    results = []
+    with ProcessPoolExecutor(
+        max_workers=args.concurrency,
+        initializer=_init_worker,
+        initargs=(launch_lock, last_launch_time),
+    ) as executor:
+        futures = {
+            executor.submit(clip_account, args, account): account
+            for account in accounts
+        }
+        for future in as_completed(futures):
+            account = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {
+                    "account": account.label,
+                    "logged_in": False,
+                    "error": type(e).__name__,
+                    "elapsed_s": 0,
+                }
+            logger.info("Finished account {}: {}".format(account.label, result))
+            results.append(result)
+    return results
+
+
+def main():
+    setup_logging("multi")
+
+    parser = argparse.ArgumentParser(
+        description="Clip Safeway coupons for several accounts in parallel."
+    )
+    define_common_args(parser)
+    parser.add_argument(
+        "--accounts",
+        required=True,
+        help=(
+            'JSON file with a list of accounts, each with "username" and '
+            '"password", and optionally "label" and "session_path".'
+        ),
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="Max number of browsers running at once.",
+    )
+    parser.add_argument(
+        "--launch-stagger-s",
+        type=float,
+        default=10.0,
+        help="Minimum seconds between browser launches.",
+    )
+    parser.add_argument(
+        "--summary-output",
+        default=None,
+        help="If set, write per-account results and the summary to this file.",
+    )
+    args = parser.parse_args()
+
+    accounts = load_accounts(args.accounts)
+    start_time = time.monotonic()
+    results = run_accounts(args, accounts)
+    summary = summarize(results, time.monotonic() - start_time)
+    logger.info("Summary: {}".format(summary))
+    if args.summary_output:
+        with open(args.summary_output, "w") as f:
+            json.dump({"accounts": results, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
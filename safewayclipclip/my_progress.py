@@ -1,31 +1,32 @@
-from threading import Thread
 import time
 
 from progress.bar import IncrementalBar
 from progress.counter import Counter
 from progress.spinner import Spinner
 
+from safewayclipclip.events import (
+    CLIP_FAILED, CLIP_OK, RUN_FINISHED, FLUSH_INTERVAL_S)
 
-class AsyncProgress:
-    def __init__(self, progress):
-        super()
+
+class ThrottledProgressBar:
+    """Redraws a bar or spinner on next(), at most once per interval_s."""
+
+    def __init__(self, progress, interval_s=FLUSH_INTERVAL_S):
         self.progress = progress
-        self.spinning = True
-        self.timer = Thread(target=self.runnable)
-        self.timer.start()
+        self.unrendered = 0
+        self.throttle = ThrottledProgress(self.render, interval_s)
 
     def next(self, i=1):
-        pass
+        self.unrendered += i
+        self.throttle.update()
 
-    def runnable(self):
-        while self.spinning:
-            self.progress.next()
-            time.sleep(0.1)
+    def render(self):
+        self.progress.next(self.unrendered)
+        self.unrendered = 0
 
     def finish(self):
-        self.spinning = False
+        self.throttle.flush()
         self.progress.finish()
-        print()
 
 
 class NoProgress:
@@ -36,23 +37,112 @@ class NoProgress:
         pass
 
 
+class ThrottledProgress:
+    """Coalesces updates, passing the latest on at most once per interval_s.
+
+    Keeps a fast loop from flooding a slow consumer, like the Qt event loop.
+    Call flush() at the end so the final update is never dropped.
+    """
+
+    def __init__(self, emitter, interval_s=0.1):
+        self.emitter = emitter
+        self.interval_s = interval_s
+        self.last_emit_time = None
+        self.pending = None
+
+    def update(self, *values):
+        self.pending = values
+        now = time.monotonic()
+        last = self.last_emit_time
+        if last is None or now - last >= self.interval_s:
+            self.flush(now)
+
+    def flush(self, now=None):
+        if self.pending is None:
+            return
+        values = self.pending
+        self.pending = None
+        self.last_emit_time = time.monotonic() if now is None else now
+        self.emitter(*values)
+
+
+class ProgressSink:
+    """Event bus sink tracking clipped, failed and remaining counts.
+
+    Renders through render(clipped, failed, remaining), at most once per
+    interval_s, plus once more when the run finishes.
+    """
+
+    def __init__(self, interval_s=FLUSH_INTERVAL_S):
+        self.clipped = 0
+        self.failed = 0
+        self.remaining = 0
+        self.throttle = ThrottledProgress(self.render, interval_s)
+
+    def handle(self, event):
+        if event.type == CLIP_OK:
+            self.clipped += 1
+        elif event.type == CLIP_FAILED:
+            self.failed += 1
+        if event.data.get('remaining') is not None:
+            self.remaining = event.data['remaining']
+        self.throttle.update(self.clipped, self.failed, self.remaining)
+        if event.type == RUN_FINISHED:
+            self.throttle.flush()
+            self.finish()
+
+    def flush(self):
+        self.throttle.flush()
+
+    def render(self, clipped, failed, remaining):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class TerminalProgressSink(ProgressSink):
+    def __init__(self, **kwargs):
+        super(TerminalProgressSink, self).__init__(**kwargs)
+        self.bar = IncrementalBar('Clipping', max=0)
+
+    def render(self, clipped, failed, remaining):
+        self.bar.message = 'Clipping ({} failed)'.format(failed)
+        self.bar.max = clipped + failed + remaining
+        self.bar.goto(clipped + failed)
+
+    def finish(self):
+        self.bar.finish()
+
+
+class QtProgressSink(ProgressSink):
+    """Emits the counts through a Qt signal's emit."""
+
+    def __init__(self, emitter, **kwargs):
+        super(QtProgressSink, self).__init__(**kwargs)
+        self.emitter = emitter
+
+    def render(self, clipped, failed, remaining):
+        self.emitter(clipped, failed, remaining)
+
+
 class QtProgress:
     def __init__(self, msg, max, emitter):
         self.msg = msg
         self.curr = 0
         self.max = max
-        self.emitter = emitter
+        self.throttle = ThrottledProgress(emitter)
 
-        self.emitter(self.msg, self.max, self.curr)
+        self.throttle.update(self.msg, self.max, self.curr)
 
     def next(self, incr=1):
         self.curr += incr
         if self.curr > self.max:
             self.max += self.max if self.max else 32
-        self.emitter(self.msg, self.max, self.curr)
+        self.throttle.update(self.msg, self.max, self.curr)
 
     def finish(self):
-        pass
+        self.throttle.flush()
 
 
 def no_progress_factory(msg, max):
@@ -60,7 +150,7 @@ def no_progress_factory(msg, max):
 
 
 def indeterminate_progress_cli(msg, max=0):
-    return AsyncProgress(Spinner(msg))
+    return ThrottledProgressBar(Spinner(msg))
 
 
 def determinate_progress_cli(msg, max):
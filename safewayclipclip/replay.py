@@ -0,0 +1,432 @@
+#!/usr/bin/env python3
+
+# Records the WebDriver commands a clip run sends, with their responses, and
+# replays them without a browser, so the clip loop and login flow can be
+# benchmarked and regression tested offline in milliseconds.
+#
+#   python -m safewayclipclip.cli --record-trace=run.jsonl
+#   python -m safewayclipclip.replay run.jsonl
+
+import argparse
+import copy
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from safewayclipclip import VERSION
+from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.http_clip import ACCESS_TOKEN_COOKIE
+from safewayclipclip.session import CHROME_COOKIE_DBS, CHROME_EPOCH_OFFSET_S
+from safewayclipclip.session_store import SAVE_LOCAL_STORAGE_SCRIPT
+from safewayclipclip.waits import get_poll_frequency, set_poll_frequency
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 1
+REDACTED = "<redacted>"
+
+# Commands whose params carry typed text, i.e. credentials at login.
+TYPING_COMMANDS = {"sendKeysToElement", "sendKeysToActiveElement"}
+# CDP commands whose responses carry cookie values.
+COOKIE_CDP_COMMANDS = {"Network.getAllCookies", "Network.getCookies"}
+# Commands whose responses carry an element's text, attributes or properties,
+# such as the account holder's name in the profile menu.
+ELEMENT_READ_COMMANDS = {
+    "getElementText",
+    "getElementAttribute",
+    "getElementProperty",
+}
+# Selenium's get_attribute() runs a script starting with this instead.
+GET_ATTRIBUTE_SCRIPT_PREFIX = "/* getAttribute */"
+# Element text the clip flow compares against (see cli.is_logged_in), kept
+# so replays take the same branches as the recording.
+KEPT_ELEMENT_TEXT = {"", "Sign in"}
+
+# Args which change the commands a run sends, and so are replayed as recorded.
+REPLAYED_ARGS = [
+    "safeway_url",
+    "safeway_user_will_login",
+    "http_clip",
+    "session_store",
+    "batch_clip",
+    "batch_pacing_ms",
+    "tabs",
+    "no_catalog",
+    "max_clip_attempts",
+    "retry_backoff_s",
+    "max_failure_rate",
+    "max_page_reloads",
+    "include_brand",
+    "exclude_brand",
+    "include_category",
+    "exclude_category",
+    "min_discount",
+    "expires_within_days",
+    "priority",
+]
+
+# Replayed responses are instant, so waits poll nearly continuously, and give
+# up quickly where the recorded run timed out.
+REPLAY_POLL_FREQUENCY_S = 0.0001
+REPLAY_WAIT_CEILING_S = 0.05
+REPLAY_USERNAME = "replay"
+REPLAY_PASSWORD = "replay"
+
+# How far ahead to look for a command when the replay polled fewer times than
+# the recording, and how many recent commands count as the polls to skip.
+LOOKAHEAD = 50
+NUM_RECENT_ENTRIES = 4
+
+
+class ReplayMismatchError(Exception):
+    """The replayed run sent a command the trace doesn't have next."""
+
+
+def get_command_digest(command, params):
+    """Identifies a command by its name and params, minus the session id.
+
+    Typed text is redacted first, so traces never hold credentials and
+    replays match whatever placeholder credentials they log in with.
+    """
+    params = {k: v for k, v in (params or {}).items() if k != "sessionId"}
+    if command in TYPING_COMMANDS:
+        params = {
+            k: REDACTED if k in ("text", "value") else v for k, v in params.items()
+        }
+    key = json.dumps([command, params], sort_keys=True, default=str)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _redact_local_storage(response):
+    local_storage = response.get("value")
+    if not isinstance(local_storage, dict):
+        return response
+    response = dict(response)
+    response["value"] = {key: REDACTED for key in local_storage}
+    return response
+
+
+def _is_element_read(command, params):
+    if command in ELEMENT_READ_COMMANDS:
+        return True
+    script = params.get("script") or ""
+    return command == "executeScript" and script.startswith(
+        GET_ATTRIBUTE_SCRIPT_PREFIX
+    )
+
+
+def _redact_element_read(response):
+    value = response.get("value")
+    if not isinstance(value, str) or value.strip() in KEPT_ELEMENT_TEXT:
+        return response
+    response = dict(response)
+    response["value"] = REDACTED
+    return response
+
+
+def _redact_response(command, params, response):
+    # Saved local storage can hold auth tokens as well as cookies do.
+    if command == "executeScript" and params.get("script") == SAVE_LOCAL_STORAGE_SCRIPT:
+        return _redact_local_storage(response)
+    if _is_element_read(command, params):
+        return _redact_element_read(response)
+    cookies = None
+    if command == "getCookies":
+        cookies = response.get("value")
+    elif command == "executeCdpCommand" and params.get("cmd") in COOKIE_CDP_COMMANDS:
+        cookies = (response.get("value") or {}).get("cookies")
+    if not cookies:
+        return response
+    response = copy.deepcopy(response)
+    if command == "getCookies":
+        cookies = response["value"]
+    else:
+        cookies = response["value"]["cookies"]
+    for cookie in cookies:
+        cookie["value"] = REDACTED
+    return response
+
+
+class CommandRecorder:
+    """Records every command sent by the drivers it's attached to.
+
+    Wraps the driver's command executor, so responses are recorded raw, as
+    chromedriver sent them, including errors.
+    """
+
+    def __init__(self, args):
+        self.meta = {
+            "trace_version": TRACE_VERSION,
+            "version": VERSION,
+            "recorded_at": datetime.now().isoformat(timespec="seconds"),
+            "args": {name: getattr(args, name) for name in REPLAYED_ARGS},
+        }
+        self.entries = []
+
+    def attach(self, webdriver):
+        executor = webdriver.command_executor
+        execute = executor.execute
+
+        def recording_execute(command, params):
+            start_time = time.perf_counter()
+            response = execute(command, params)
+            duration_ms = (time.perf_counter() - start_time) * 1000
+            entry = {
+                "command": command,
+                "digest": get_command_digest(command, params),
+                "duration_ms": round(duration_ms, 3),
+                "response": _redact_response(command, params or {}, response or {}),
+            }
+            if command == "get":
+                entry["url"] = params["url"]
+            self.entries.append(entry)
+            return response
+
+        executor.execute = recording_execute
+
+    def write(self, filename):
+        """Writes the trace as JSON lines: the metadata, then one per command."""
+        trace_dir = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(filename, "w") as f:
+            f.write(json.dumps(self.meta) + "\n")
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+        logger.info(
+            "Recorded {} WebDriver commands to {}".format(len(self.entries), filename)
+        )
+
+
+def read_trace(filename):
+    """Returns a trace's metadata and its list of recorded commands."""
+    with open(filename) as f:
+        meta = json.loads(f.readline())
+        if meta.get("trace_version") != TRACE_VERSION:
+            raise ValueError(
+                "Unsupported trace version: {}".format(meta.get("trace_version"))
+            )
+        return meta, [json.loads(line) for line in f if line.strip()]
+
+
+class ReplayExecutor:
+    """Serves a driver's commands from a trace, in recorded order.
+
+    Waits poll a varying number of times, so a command may be answered by
+    skipping ahead past recorded polls, or by repeating a recent answer.
+    Anything else raises ReplayMismatchError.
+    """
+
+    def __init__(self, entries, lookahead=LOOKAHEAD):
+        self.entries = entries
+        self.lookahead = lookahead
+        self.position = 0
+        self.recent_entries = []
+        self.served = 0
+        self.skipped = 0
+        self.repeated = 0
+        self.recorded_ms = 0.0
+
+    def execute(self, command, params):
+        if command == "newSession":
+            return {
+                "value": {"sessionId": "replay", "capabilities": {"browserName": ""}}
+            }
+        digest = get_command_digest(command, params)
+        end = min(self.position + self.lookahead, len(self.entries))
+        for i in range(self.position, end):
+            entry = self.entries[i]
+            if entry["digest"] == digest:
+                return self._serve(entry, i)
+            if not self._recently_served(entry["digest"]):
+                break
+        repeat = self._recently_served(digest)
+        if repeat:
+            self.repeated += 1
+            return copy.deepcopy(repeat["response"])
+        if command in ("quit", "closeWindow"):
+            return {"value": None}
+        raise ReplayMismatchError(
+            "Command {} ({}) doesn't match the trace at entry {} ({})".format(
+                self.served + self.repeated + 1,
+                command,
+                self.position,
+                self.entries[self.position]["command"]
+                if self.position < len(self.entries)
+                else "end of trace",
+            )
+        )
+
+    def _serve(self, entry, index):
+        self.skipped += index - self.position
+        self.position = index + 1
+        self.served += 1
+        self.recorded_ms += entry["duration_ms"]
+        self.recent_entries = (self.recent_entries + [entry])[-NUM_RECENT_ENTRIES:]
+        return copy.deepcopy(entry["response"])
+
+    def _recently_served(self, digest):
+        for entry in reversed(self.recent_entries):
+            if entry["digest"] == digest:
+                return entry
+        return None
+
+    def close(self):
+        pass
+
+
+def get_replay_driver(entries):
+    """Returns a driver answering from the trace, and its ReplayExecutor.
+
+    It's Selenium's own remote WebDriver, so find_element(s), execute_script,
+    ActionChains, current_url and the rest behave exactly as with a browser.
+    """
+    # Imported where used, as recording runs don't need them.
+    from selenium.webdriver import ChromeOptions
+    from selenium.webdriver.remote.webdriver import WebDriver
+
+    class ReplayDriver(WebDriver):
+        def execute_cdp_cmd(self, cmd, cmd_args):
+            return self.execute("executeCdpCommand", {"cmd": cmd, "params": cmd_args})[
+                "value"
+            ]
+
+    executor = ReplayExecutor(entries)
+    return ReplayDriver(command_executor=executor, options=ChromeOptions()), executor
+
+
+def _write_saved_session(args, temp_dir, base_url, valid):
+    """Fakes a saved login which start_session's check finds valid or not."""
+    host = urlparse(base_url).hostname
+    expires = time.time() + (24 * 60 * 60 if valid else -60)
+    if args.session_store == "cookies":
+        args.session_file = os.path.join(temp_dir, "session.json")
+        cookie = {"name": ACCESS_TOKEN_COOKIE, "domain": host, "expires": expires}
+        with open(args.session_file, "w") as f:
+            json.dump({"cookies": [cookie], "local_storage": {}}, f)
+        return
+    args.session_path = os.path.join(temp_dir, "profile")
+    cookie_db = os.path.join(args.session_path, CHROME_COOKIE_DBS[0])
+    os.makedirs(os.path.dirname(cookie_db))
+    conn = sqlite3.connect(cookie_db)
+    try:
+        conn.execute(
+            "CREATE TABLE cookies (host_key TEXT, name TEXT, expires_utc INTEGER, "
+            "has_expires INTEGER)"
+        )
+        conn.execute(
+            "INSERT INTO cookies VALUES (?, ?, ?, 1)",
+            (host, ACCESS_TOKEN_COOKIE, int((expires + CHROME_EPOCH_OFFSET_S) * 1e6)),
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def get_replay_args(meta, temp_dir):
+    parser = argparse.ArgumentParser()
+    define_common_args(parser)
+    args = parser.parse_args([])
+    for name, value in meta["args"].items():
+        setattr(args, name, value)
+    args.safeway_username = REPLAY_USERNAME
+    args.safeway_password = REPLAY_PASSWORD
+    args.pacing = "none"
+    args.wait_floor_s = 0.0
+    args.wait_ceiling_s = REPLAY_WAIT_CEILING_S
+    args.session_check_ttl_s = 0
+    args.no_ledger = True
+    args.catalog_path = os.path.join(temp_dir, "catalog.sqlite3")
+    args.session_path = None
+    args.session_file = os.path.join(temp_dir, "session.json")
+    return args
+
+
+def replay_trace(filename):
+    """Replays a recorded clip run against a driver serving the trace.
+
+    Returns stats on the replay, including whether it diverged from the
+    recording.
+    """
+    # Imported here since cli imports this module to record traces.
+    from safewayclipclip.cli import clip_clip, get_safeway_url, COUPON_PATH
+
+    meta, entries = read_trace(filename)
+    if meta["args"]["http_clip"]:
+        raise ValueError("Runs which clip over HTTP can't be replayed")
+    urls = [entry["url"] for entry in entries if entry["command"] == "get"]
+    saved_session_valid = bool(urls) and urls[0].endswith(COUPON_PATH)
+
+    poll_frequency_s = get_poll_frequency()
+    set_poll_frequency(REPLAY_POLL_FREQUENCY_S)
+    webdriver, executor = get_replay_driver(entries)
+    error = None
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            args = get_replay_args(meta, temp_dir)
+            _write_saved_session(
+                args, temp_dir, get_safeway_url(args), saved_session_valid
+            )
+            start_time = time.perf_counter()
+            try:
+                throughput = clip_clip(webdriver, args, relaunch=lambda: webdriver)
+            except ReplayMismatchError as e:
+                throughput = None
+                error = str(e)
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+    finally:
+        set_poll_frequency(poll_frequency_s)
+
+    return {
+        "version": VERSION,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "trace": os.path.basename(filename),
+        "recorded_version": meta["version"],
+        "matched": error is None and executor.position == len(entries),
+        "error": error,
+        "logged_in": throughput is not None,
+        "clicks": throughput.clicks if throughput else None,
+        "clipped": throughput.clipped if throughput else None,
+        "recorded_commands": len(entries),
+        "served": executor.served,
+        "skipped": executor.skipped,
+        "repeated": executor.repeated,
+        "unreplayed": len(entries) - executor.position,
+        "recorded_ms": round(executor.recorded_ms, 1),
+        "replay_ms": round(elapsed_ms, 1),
+    }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Replay recorded clip runs without a browser."
+    )
+    parser.add_argument("traces", nargs="+", help="Trace files from --record-trace.")
+    parser.add_argument(
+        "--output",
+        default=os.path.join(BASE_PATH, "replay_bench.json"),
+        help="JSON file which results are appended to.",
+    )
+    args = parser.parse_args()
+
+    # Imported here to keep this module's imports light for recording.
+    from safewayclipclip.bench import append_result
+
+    results = [replay_trace(trace) for trace in args.traces]
+    print(json.dumps(results, indent=2))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    for result in results:
+        append_result(args.output, result)
+    # Exit non-zero if any replay diverged, for CI.
+    sys.exit(0 if all(result["matched"] for result in results) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+from collections import deque
+import logging
+import time
+
+from safewayclipclip.waits import interruptible_sleep
+
+logger = logging.getLogger(__name__)
+
+# Ways a single clip can fail, each recovered from differently.
+FAILURE_NOT_CLIPPED = "not-clipped"
+FAILURE_STALE = "stale"
+FAILURE_INTERCEPTED = "intercepted"
+FAILURE_JAVASCRIPT = "javascript"
+
+# How many recent clips the circuit breaker judges the failure rate over.
+BREAKER_WINDOW = 20
+
+
+def get_offer_key(offer):
+    """Stable identity for an offer: its id, else its button's element id."""
+    return offer["offerId"] or offer["button"].id
+
+
+class OfferRetries:
+    """Per-offer failure counts, with exponential backoff between attempts.
+
+    An offer which fails max_attempts times is exhausted, and should be
+    skipped for the rest of the run, which bounds the clicks any one offer
+    can cost.
+    """
+
+    def __init__(self, max_attempts=3, base_backoff_s=0.5, max_backoff_s=8.0):
+        self.max_attempts = max_attempts
+        self.base_backoff_s = base_backoff_s
+        self.max_backoff_s = max_backoff_s
+        self.attempts = {}
+        self.retry_at = {}
+
+    def exhausted(self, key):
+        return self.attempts.get(key, 0) >= self.max_attempts
+
+    def is_ready(self, key, now=None):
+        now = time.monotonic() if now is None else now
+        return self.retry_at.get(key, 0) <= now
+
+    def next_ready(self, offers):
+        """Returns the first offer not backing off, or None."""
+        now = time.monotonic()
+        for offer in offers:
+            if self.is_ready(get_offer_key(offer), now):
+                return offer
+        return None
+
+    def next_retry_at(self, offers):
+        """The monotonic time the first of the offers is due to be retried."""
+        return min(self.retry_at.get(get_offer_key(o), 0) for o in offers)
+
+    def wait_for_next(self, offers):
+        """Sleeps until the first of the offers is due to be retried."""
+        interruptible_sleep(max(self.next_retry_at(offers) - time.monotonic(), 0))
+
+    def record_success(self, key):
+        self.attempts.pop(key, None)
+        self.retry_at.pop(key, None)
+
+    def record_failure(self, key):
+        attempts = self.attempts.get(key, 0) + 1
+        self.attempts[key] = attempts
+        backoff_s = min(self.base_backoff_s * 2 ** (attempts - 1), self.max_backoff_s)
+        self.retry_at[key] = time.monotonic() + backoff_s
+        if attempts >= self.max_attempts:
+            logger.warning("Giving up on an offer after {} attempts".format(attempts))
+        return attempts
+
+
+class CircuitBreaker:
+    """Trips when the recent clip failure rate spikes.
+
+    The clip loop reloads the page when it trips, and aborts the run once
+    it has tripped more than max_trips times.
+    """
+
+    def __init__(self, max_failure_rate=0.5, max_trips=2, window=BREAKER_WINDOW):
+        self.max_failure_rate = max_failure_rate
+        self.max_trips = max_trips
+        self.outcomes = deque(maxlen=window)
+        self.trips = 0
+
+    def record(self, success):
+        self.outcomes.append(bool(success))
+
+    def tripped(self):
+        if len(self.outcomes) < self.outcomes.maxlen:
+            return False
+        failures = self.outcomes.maxlen - sum(self.outcomes)
+        return failures / self.outcomes.maxlen >= self.max_failure_rate
+
+    def trip(self):
+        """Records a trip; returns True if the run should be aborted."""
+        self.trips += 1
+        self.outcomes.clear()
+        logger.warning(
+            "Clip failure rate is over {:.0%} (trip {} of {})".format(
+                self.max_failure_rate, self.trips, self.max_trips
+            )
+        )
+        return self.trips > self.max_trips
@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+# Clips on a schedule, only launching the full clip flow for an account once
+# its offers have changed since they were last clipped.
+#
+#   python -m safewayclipclip.scheduler --accounts accounts.json
+#   python -m safewayclipclip.scheduler --once --safeway_username=...
+#
+# Each check first takes a cheap fingerprint of the account's offer set: over
+# HTTP with the saved session cookies when using --session-store=cookies, and
+# otherwise from one load of the coupons page in a lean headless browser.
+# Accounts are checked one at a time, spread over the interval, so no two
+# browsers ever start at once.
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import random
+import tempfile
+import time
+
+from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.log_setup import setup_logging
+from safewayclipclip.multi import (
+    clip_account,
+    get_account_args,
+    load_accounts,
+    Account,
+)
+
+# Selenium, requests and the clip flow are imported where used, so checks
+# which find nothing new stay cheap.
+
+logger = logging.getLogger(__name__)
+
+STATE_PATH = os.path.join(BASE_PATH, "schedule_state.json")
+
+# The saved session doesn't record the browser's user agent, so HTTP checks
+# send a current desktop Chrome one.
+PROBE_USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
+# Returns the offer id of every coupon card loaded on the page.
+OFFER_IDS_SCRIPT = """
+const offerIdAttribute = arguments[0];
+return Array.from(
+    document.querySelectorAll('[' + offerIdAttribute + ']'),
+    (card) => card.getAttribute(offerIdAttribute)
+);
+"""
+
+
+def get_fingerprint(offer_ids):
+    """Identifies a set of offers, regardless of order."""
+    digest = hashlib.sha256("\n".join(sorted(set(offer_ids))).encode("utf-8"))
+    return "{}:{}".format(len(set(offer_ids)), digest.hexdigest()[:16])
+
+
+def _fetch_offer_ids(session, store_id, args):
+    from safewayclipclip.cli import get_safeway_url
+    from safewayclipclip.http_clip import list_offer_ids
+
+    try:
+        return list_offer_ids(
+            session, args.http_base_url or get_safeway_url(args), store_id
+        )
+    finally:
+        session.close()
+
+
+def probe_over_http(args):
+    """Fingerprints the offers using the saved session file, if there is one.
+
+    Returns None if there's no saved session or the API won't list offers.
+    """
+    import requests
+
+    from safewayclipclip.http_clip import get_session_from_cookies, HttpClipError
+    from safewayclipclip.session_store import get_session_file
+
+    try:
+        with open(get_session_file(args)) as f:
+            cookies = json.load(f)["cookies"]
+        session, store_id = get_session_from_cookies(cookies, PROBE_USER_AGENT)
+        return get_fingerprint(_fetch_offer_ids(session, store_id, args))
+    except (
+        OSError,
+        KeyError,
+        ValueError,
+        HttpClipError,
+        requests.RequestException,
+    ) as e:
+        logger.info("Cannot check offers over HTTP: {}".format(type(e).__name__))
+    return None
+
+
+def probe_in_browser(args):
+    """Fingerprints the offers from one load of the coupons page.
+
+    Asks the offer API through the browser's session where it can, which
+    sees every offer; otherwise only the offers on the first page are
+    counted. Returns None if the saved session isn't logged in.
+    """
+    import requests
+
+    from safewayclipclip.cli import get_safeway_url, is_logged_in, COUPON_PATH
+    from safewayclipclip.http_clip import get_session_from_webdriver, HttpClipError
+    from safewayclipclip.session_store import get_session_webdriver
+    from safewayclipclip.snapshot import work_available, OFFER_ID_ATTRIBUTE
+    from safewayclipclip.waits import page_settled, AdaptiveWaiter
+
+    probe_args = argparse.Namespace(**vars(args))
+    probe_args.headless = True
+    probe_args.browser_profile = "lean"
+    waiter = AdaptiveWaiter(0.0, args.wait_ceiling_s)
+    webdriver = get_session_webdriver(probe_args)
+    try:
+        webdriver.get(get_safeway_url(args, COUPON_PATH))
+        waiter.wait(webdriver, page_settled())
+        if not is_logged_in(webdriver):
+            logger.info("Saved session is not logged in")
+            return None
+        try:
+            session, store_id = get_session_from_webdriver(webdriver, 1)
+            return get_fingerprint(_fetch_offer_ids(session, store_id, args))
+        except (HttpClipError, requests.RequestException, ValueError) as e:
+            logger.info("Counting offers on the page: {}".format(type(e).__name__))
+        waiter.wait(webdriver, work_available())
+        return get_fingerprint(
+            webdriver.execute_script(OFFER_IDS_SCRIPT, OFFER_ID_ATTRIBUTE)
+        )
+    finally:
+        webdriver.quit()
+
+
+def load_state(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state_path, state):
+    state_dir = os.path.dirname(os.path.abspath(state_path))
+    os.makedirs(state_dir, exist_ok=True)
+    # Rename into place so a crash never truncates it.
+    fd, temp_path = tempfile.mkstemp(dir=state_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, state_path)
+
+
+def check_account(args, account, state):
+    """Clips the account if its offers changed since they were last clipped.
+
+    Updates state, keyed by account key so it holds no PII. Returns the clip
+    result, or None if nothing changed.
+    """
+    account_args = get_account_args(args, account)
+    entry = state.get(account.key, {})
+    fingerprint = None
+    if args.session_store == "cookies":
+        fingerprint = probe_over_http(account_args)
+    if not fingerprint:
+        fingerprint = probe_in_browser(account_args)
+    entry["checked_at"] = time.time()
+    if fingerprint and fingerprint == entry.get("fingerprint") and entry.get("ok"):
+        logger.info("No new offers for account {}".format(account.label))
+        state[account.key] = entry
+        return None
+
+    logger.info("Offers changed for account {}; clipping".format(account.label))
+    result = clip_account(args, account)
+    ok = result["logged_in"] and not result["error"]
+    # Only remember offers as done once a run clips them, so a failed run
+    # is retried at the next check.
+    entry.update(fingerprint=fingerprint, ok=ok, clipped_at=time.time())
+    state[account.key] = entry
+    logger.info("Finished account {}: {}".format(account.label, result))
+    return result
+
+
+def get_jittered_interval_s(interval_s, jitter):
+    return interval_s * random.uniform(1 - jitter, 1 + jitter)
+
+
+def run_schedule(args, accounts):
+    """Checks each account every --interval-s, give or take --jitter.
+
+    With --once, checks each account once and returns whether every clip
+    run succeeded.
+    """
+    state = load_state(args.state_path)
+    now = time.time()
+    # Spread the accounts' first checks evenly over the interval.
+    spacing_s = 0.0 if args.once else args.interval_s / len(accounts)
+    next_check_at = {
+        account.key: now + i * spacing_s for i, account in enumerate(accounts)
+    }
+    accounts_by_key = {account.key: account for account in accounts}
+    last_check_at = 0.0
+    all_ok = True
+    while next_check_at:
+        account = accounts_by_key[min(next_check_at, key=next_check_at.get)]
+        check_at = max(
+            next_check_at[account.key], last_check_at + args.launch_stagger_s
+        )
+        wait_s = check_at - time.time()
+        if wait_s > 0:
+            logger.info("Next check in {:.0f}s".format(wait_s))
+            time.sleep(wait_s)
+        try:
+            result = check_account(args, account, state)
+            if result:
+                all_ok = all_ok and result["logged_in"] and not result["error"]
+        except Exception:
+            all_ok = False
+            logger.exception("Check failed for account {}".format(account.label))
+        save_state(args.state_path, state)
+        last_check_at = time.time()
+        if args.once:
+            del next_check_at[account.key]
+        else:
+            next_check_at[account.key] = last_check_at + get_jittered_interval_s(
+                args.interval_s, args.jitter
+            )
+    return all_ok
+
+
+def main():
+    setup_logging("scheduler")
+
+    parser = argparse.ArgumentParser(
+        description="Clip Safeway coupons on a schedule, whenever new offers appear."
+    )
+    define_common_args(parser)
+    parser.add_argument(
+        "--accounts",
+        default=None,
+        help=(
+            "JSON accounts file (see safewayclipclip.multi) to check every "
+            "account in turn. Defaults to the single account given by the "
+            "other flags."
+        ),
+    )
+    parser.add_argument(
+        "--interval-s",
+        type=float,
+        default=6 * 60 * 60,
+        help="How often each account's offers are checked.",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.2,
+        help="Vary each interval randomly by up to this fraction of it.",
+    )
+    parser.add_argument(
+        "--launch-stagger-s",
+        type=float,
+        default=10.0,
+        help="Minimum seconds between one account's check and the next.",
+    )
+    parser.add_argument(
+        "--state-path",
+        default=STATE_PATH,
+        help="JSON file recording each account's last offer fingerprint.",
+    )
+    parser.add_argument(
+        "--once",
+        action="store_true",
+        default=False,
+        help=(
+            "Check each account once and exit, for running from cron. Exits "
+            "non-zero if any clip run failed."
+        ),
+    )
+    args = parser.parse_args()
+
+    if args.accounts:
+        accounts = load_accounts(args.accounts)
+    else:
+        # Imported where used, as it pulls in the clip flow.
+        from safewayclipclip.cli import maybe_prompt_for_safeway_credentials
+
+        maybe_prompt_for_safeway_credentials(args)
+        accounts = [
+            Account(
+                args.safeway_username,
+                args.safeway_password,
+                label="default",
+                session_path=args.session_path,
+            )
+        ]
+    try:
+        ok = run_schedule(args, accounts)
+    except KeyboardInterrupt:
+        return
+    exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# Decides which offers a run clips, and in what order. Include and exclude
+# rules are compiled once into predicates over the metadata the in-page
+# observer reads from each card, so judging an offer costs no round trips.
+
+import logging
+import re
+import time
+
+from safewayclipclip.ledger import parse_expiry
+from safewayclipclip.retry import get_offer_key
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_PAGE = "page"
+PRIORITY_EXPIRY = "expiry"
+PRIORITY_DISCOUNT = "discount"
+PRIORITIES = (PRIORITY_PAGE, PRIORITY_EXPIRY, PRIORITY_DISCOUNT)
+
+DOLLARS_PATTERN = re.compile(r"\$\s*(\d+(?:\.\d+)?)")
+PERCENT_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*%")
+NUMBER_PATTERN = re.compile(r"\s*(\d+(?:\.\d+)?)\s*")
+
+
+def parse_discount(discount):
+    """Returns (dollars, percent) off, either None where it's not given.
+
+    Discounts like "$1.50 OFF", "20% off" or a bare "1.50" (dollars) are
+    understood; anything else, like "Buy 2 Get 1", is neither.
+    """
+    if not discount:
+        return None, None
+    match = PERCENT_PATTERN.search(discount)
+    if match:
+        return None, float(match.group(1))
+    match = DOLLARS_PATTERN.search(discount) or NUMBER_PATTERN.fullmatch(discount)
+    if match:
+        return float(match.group(1)), None
+    return None, None
+
+
+def _compile_names(names):
+    """A case-insensitive regex matching any of names within a field."""
+    return re.compile("|".join(re.escape(name) for name in names), re.IGNORECASE)
+
+
+class OfferInfo:
+    """An offer's metadata, parsed once into comparable values."""
+
+    def __init__(self, offer):
+        self.brand = offer.get("brand")
+        self.category = offer.get("category")
+        self.dollars, self.percent = parse_discount(offer.get("discount"))
+        self.expires_at = parse_expiry(offer.get("expiry"))
+
+
+class OfferSelector:
+    """Include/exclude rules and a priority order for the offers to clip.
+
+    min_discount is ("dollars" or "percent", minimum), as parsed from
+    --min-discount.
+
+    Rules only skip offers they can tell don't match: an offer whose card
+    doesn't show a field is kept by rules on that field, and a dollar
+    minimum keeps offers with a percent discount (and vice versa).
+    """
+
+    def __init__(
+        self,
+        include_brands=(),
+        exclude_brands=(),
+        include_categories=(),
+        exclude_categories=(),
+        min_discount=None,
+        expires_within_days=None,
+        priority=PRIORITY_PAGE,
+    ):
+        self.priority = priority
+        self.predicates = []
+        if include_brands:
+            self._add_match("brand", _compile_names(include_brands), True)
+        if exclude_brands:
+            self._add_match("brand", _compile_names(exclude_brands), False)
+        if include_categories:
+            self._add_match("category", _compile_names(include_categories), True)
+        if exclude_categories:
+            self._add_match("category", _compile_names(exclude_categories), False)
+        if min_discount:
+            self._add_min_discount(min_discount)
+        if expires_within_days is not None:
+            self._add_expires_within(expires_within_days * 24 * 60 * 60)
+        self.sort_key = {
+            PRIORITY_PAGE: None,
+            PRIORITY_EXPIRY: _expiry_key,
+            PRIORITY_DISCOUNT: _discount_key,
+        }[priority]
+        # Offer key to OfferInfo, so each card is only parsed once per run.
+        self.infos = {}
+
+    def _add_match(self, field, pattern, include):
+        def predicate(info):
+            value = getattr(info, field)
+            return value is None or bool(pattern.search(value)) == include
+
+        self.predicates.append(predicate)
+
+    def _add_min_discount(self, min_discount):
+        field, minimum = min_discount
+
+        def predicate(info):
+            value = getattr(info, field)
+            return value is None or value >= minimum
+
+        self.predicates.append(predicate)
+
+    def _add_expires_within(self, within_s):
+        # Fixed at the start of the run, so an offer's fate doesn't change
+        # partway through.
+        cutoff = time.time() + within_s
+
+        def predicate(info):
+            return info.expires_at is None or info.expires_at <= cutoff
+
+        self.predicates.append(predicate)
+
+    @property
+    def has_rules(self):
+        return bool(self.predicates)
+
+    @property
+    def orders(self):
+        return self.sort_key is not None
+
+    def get_info(self, offer):
+        key = get_offer_key(offer)
+        info = self.infos.get(key)
+        if info is None:
+            info = self.infos[key] = OfferInfo(offer)
+        return info
+
+    def wants(self, offer):
+        info = self.get_info(offer)
+        return all(predicate(info) for predicate in self.predicates)
+
+    def unwanted(self, offers):
+        """Returns the offers the rules skip."""
+        if not self.predicates:
+            return []
+        return [offer for offer in offers if not self.wants(offer)]
+
+    def order(self, offers):
+        """Returns offers sorted by priority, keeping page order for ties."""
+        if not self.sort_key:
+            return list(offers)
+        return sorted(offers, key=lambda offer: self.sort_key(self.get_info(offer)))
+
+
+def _expiry_key(info):
+    # Soonest first; offers without an expiry last.
+    return (info.expires_at is None, info.expires_at or 0)
+
+
+def _discount_key(info):
+    # Biggest dollar discount first, then biggest percent, then the rest.
+    return (-(info.dollars or 0), -(info.percent or 0))
+
+
+def get_offer_selector(args):
+    """Returns the run's OfferSelector, or None if it has no rules or order."""
+    selector = OfferSelector(
+        include_brands=args.include_brand or (),
+        exclude_brands=args.exclude_brand or (),
+        include_categories=args.include_category or (),
+        exclude_categories=args.exclude_category or (),
+        min_discount=args.min_discount,
+        expires_within_days=args.expires_within_days,
+        priority=args.priority,
+    )
+    if not selector.has_rules and not selector.orders:
+        return None
+    logger.info(
+        "Clipping in {} order with {} offer rules".format(
+            args.priority, len(selector.predicates)
+        )
+    )
+    return selector
+
+
+class PrioritizedDiscovery:
+    """Wraps a CouponDiscovery so snapshots list offers in priority order.
+
+    Ordering needs every pending offer, so the full list is drained once and
+    kept, then only drained again once the page's offers change, a clip
+    fails, or the list runs out. Until every page has loaded, snapshots list
+    no offers, since the clip loop only loads pages then.
+    """
+
+    def __init__(self, discovery, selector, max_handles):
+        self.discovery = discovery
+        self.selector = selector
+        self.max_handles = max_handles
+        self.offers = []
+        self.generation = None
+
+    def snapshot(self, max_handles=1):
+        snapshot = self.discovery.snapshot(0)
+        if snapshot.loading or snapshot.load_more_button or not max_handles:
+            return snapshot
+        generation = (self.discovery.installs, self.discovery.added)
+        if generation != self.generation or not self.offers:
+            snapshot = self.discovery.snapshot(self.max_handles)
+            self.offers = self.selector.order(snapshot.pending_offers)
+            self.generation = (self.discovery.installs, self.discovery.added)
+        snapshot.pending_offers = self.offers[:max_handles]
+        return snapshot
+
+    def discard(self, offers):
+        """Drops offers which were clipped or skipped from the kept list."""
+        keys = {get_offer_key(offer) for offer in offers}
+        self.offers = [o for o in self.offers if get_offer_key(o) not in keys]
+
+    def invalidate(self):
+        """Drains the full list again on the next snapshot."""
+        self.generation = None
+
+    def more_loaded(self):
+        return self.discovery.more_loaded()
+
+    def done_loading(self):
+        return self.discovery.done_loading()
@@ -0,0 +1,153 @@
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import sqlite3
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from safewayclipclip.args import BASE_PATH
+from safewayclipclip.http_clip import ACCESS_TOKEN_COOKIE
+
+logger = logging.getLogger(__name__)
+
+SESSION_CHECK_CACHE_PATH = os.path.join(BASE_PATH, "session_checks.json")
+
+# Where Chrome keeps cookies within a user-data-dir, newest layout first.
+CHROME_COOKIE_DBS = [
+    os.path.join("Default", "Network", "Cookies"),
+    os.path.join("Default", "Cookies"),
+]
+# Chrome timestamps count microseconds from 1601-01-01 rather than 1970.
+CHROME_EPOCH_OFFSET_S = 11644473600
+
+
+def host_matches(host, cookie_host):
+    cookie_host = cookie_host.lstrip(".")
+    return host == cookie_host or host.endswith("." + cookie_host)
+
+
+def _get_saved_cookie_expiry(session_file, host, name):
+    try:
+        with open(session_file) as f:
+            cookies = json.load(f)["cookies"]
+    except (OSError, ValueError, KeyError):
+        return None
+    expiry = 0
+    for cookie in cookies:
+        if cookie["name"] != name or not host_matches(host, cookie["domain"]):
+            continue
+        if cookie.get("session") or cookie.get("expires", -1) < 0:
+            return float("inf")
+        expiry = max(expiry, cookie["expires"])
+    return expiry
+
+
+def get_cookie_expiry(session_path, host, name=ACCESS_TOKEN_COOKIE):
+    """Reads when the saved login cookie expires, without a browser.
+
+    session_path is either a Chrome profile dir or a session file written by
+    safewayclipclip.session_store. Returns a unix timestamp (inf for a cookie
+    without an expiry), 0 if there's no such cookie, or None if the saved
+    cookies can't be read.
+    """
+    if os.path.isfile(session_path):
+        return _get_saved_cookie_expiry(session_path, host, name)
+    for relative_path in CHROME_COOKIE_DBS:
+        path = os.path.join(session_path, relative_path)
+        if os.path.isfile(path):
+            break
+    else:
+        return None
+    # immutable skips locking, so this works while Chrome has the file open.
+    uri = pathlib.Path(path).absolute().as_uri() + "?mode=ro&immutable=1"
+    try:
+        conn = sqlite3.connect(uri, uri=True)
+        try:
+            rows = conn.execute(
+                "SELECT host_key, expires_utc, has_expires FROM cookies "
+                "WHERE name = ?",
+                (name,),
+            ).fetchall()
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        logger.warning("Cannot read saved cookies: {}".format(type(e).__name__))
+        return None
+    expiry = 0
+    for cookie_host, expires_utc, has_expires in rows:
+        if not host_matches(host, cookie_host):
+            continue
+        if not has_expires:
+            return float("inf")
+        expiry = max(expiry, expires_utc / 1e6 - CHROME_EPOCH_OFFSET_S)
+    return expiry
+
+
+def _get_cache_key(session_path, host):
+    key = "{}|{}".format(os.path.abspath(session_path), host)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+
+def _read_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def record_session_check(
+    session_path, base_url, valid, cache_path=SESSION_CHECK_CACHE_PATH
+):
+    """Caches whether the saved session was found to be logged in."""
+    if not session_path or not cache_path:
+        return
+    cache = _read_cache(cache_path)
+    host = urlparse(base_url).hostname
+    cache[_get_cache_key(session_path, host)] = {
+        "valid": valid,
+        "checked_at": time.time(),
+    }
+    cache_dir = os.path.dirname(os.path.abspath(cache_path))
+    os.makedirs(cache_dir, exist_ok=True)
+    # Write then rename, since several processes may share the cache.
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(cache, f)
+    os.replace(temp_path, cache_path)
+
+
+def check_session(session_path, base_url, ttl_s, cache_path=SESSION_CHECK_CACHE_PATH):
+    """Quickly checks whether the saved session is likely still logged in.
+
+    Uses a result cached within the last ttl_s seconds if there is one;
+    otherwise checks the expiry of the profile's login cookie. Returns True
+    or False, or None when there's no saved session to check.
+    """
+    if not session_path:
+        return None
+    host = urlparse(base_url).hostname
+    if ttl_s and cache_path:
+        cached = _read_cache(cache_path).get(_get_cache_key(session_path, host))
+        if cached and time.time() - cached["checked_at"] < ttl_s:
+            logger.info(
+                "Saved session was {} {:.0f}s ago".format(
+                    "valid" if cached["valid"] else "invalid",
+                    time.time() - cached["checked_at"],
+                )
+            )
+            return cached["valid"]
+
+    expiry = get_cookie_expiry(session_path, host)
+    if expiry is None:
+        return None
+    valid = expiry > time.time()
+    logger.info(
+        "Saved session {}".format("is valid" if valid else "is expired or logged out")
+    )
+    if ttl_s:
+        record_session_check(session_path, base_url, valid, cache_path)
+    return valid
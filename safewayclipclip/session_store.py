@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+# A compact alternative to keeping a full Chrome profile per account: just the
+# cookies and local storage login needs, in a small JSON file, injected into a
+# throwaway profile at launch.
+#
+#   python -m safewayclipclip.session_store migrate --session-path=...
+#   python -m safewayclipclip.session_store compact [PROFILE_DIR ...]
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from urllib.parse import urlparse
+
+from safewayclipclip.args import define_common_args, BASE_PATH
+from safewayclipclip.ledger import get_account_key
+from safewayclipclip.session import host_matches
+from safewayclipclip.webdriver import add_tab_setup, get_webdriver, use_lean_profile
+
+logger = logging.getLogger(__name__)
+
+SESSIONS_DIR = os.path.join(BASE_PATH, "Sessions")
+
+# Fields of a CDP Network.Cookie which Network.setCookies accepts back.
+COOKIE_PARAMS = ("name", "value", "domain", "path", "secure", "httpOnly", "sameSite")
+
+# Profile subdirectories which only hold caches, safe to delete.
+PROFILE_CACHE_DIRS = [
+    "Cache",
+    "Code Cache",
+    "GPUCache",
+    "DawnCache",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "ShaderCache",
+    "component_crx_cache",
+    "optimization_guide_model_store",
+    os.path.join("Service Worker", "CacheStorage"),
+    os.path.join("Service Worker", "ScriptCache"),
+]
+
+# Returns the page's local storage as an object.
+SAVE_LOCAL_STORAGE_SCRIPT = "return Object.assign({}, window.localStorage)"
+
+# Restores saved local storage for the page's origin, keeping anything the
+# site has set since.
+LOCAL_STORAGE_SCRIPT = """
+(() => {
+  const items = (%s)[window.location.origin];
+  if (!items) return;
+  try {
+    for (const [key, value] of Object.entries(items)) {
+      if (localStorage.getItem(key) === null) localStorage.setItem(key, value);
+    }
+  } catch (e) {}
+})();
+"""
+
+
+def get_session_file(args):
+    """The session file used with --session-store=cookies.
+
+    Fixed the first time it's asked for, so a username entered at the login
+    prompt later in the run doesn't move it.
+    """
+    if not args.session_file:
+        args.session_file = os.path.join(
+            SESSIONS_DIR, get_account_key(args.safeway_username) + ".json"
+        )
+    return args.session_file
+
+
+def get_saved_session_path(args):
+    """The profile dir or session file which holds the run's saved login."""
+    if args.session_store == "cookies":
+        return get_session_file(args)
+    return args.session_path
+
+
+def get_session_webdriver(args):
+    """Launches a browser carrying the saved login, per --session-store."""
+    if args.session_store != "cookies":
+        return get_webdriver(args.headless, args.session_path, use_lean_profile(args))
+    # Without a profile dir, undetected_chromedriver uses a temp one which is
+    # deleted on quit.
+    webdriver = get_webdriver(args.headless, None, use_lean_profile(args))
+    load_session_state(webdriver, get_session_file(args))
+    return webdriver
+
+
+def save_session_state(webdriver, session_file, base_url):
+    """Saves the site's cookies and the current page's local storage."""
+    host = urlparse(base_url).hostname
+    cookies = [
+        cookie
+        for cookie in webdriver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]
+        if host_matches(host, cookie["domain"])
+    ]
+    local_storage = {}
+    origin = webdriver.execute_script("return window.location.origin")
+    if host_matches(urlparse(origin).hostname or "", host):
+        local_storage[origin] = webdriver.execute_script(SAVE_LOCAL_STORAGE_SCRIPT)
+    state = {
+        "saved_at": time.time(),
+        "cookies": cookies,
+        "local_storage": local_storage,
+    }
+
+    session_dir = os.path.dirname(os.path.abspath(session_file))
+    os.makedirs(session_dir, exist_ok=True)
+    # mkstemp creates the file readable only by the user, which matters as it
+    # holds login tokens. Rename into place so a crash never truncates it.
+    fd, temp_path = tempfile.mkstemp(dir=session_dir)
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+    os.replace(temp_path, session_file)
+    logger.info("Saved {} session cookies".format(len(cookies)))
+
+
+def load_session_state(webdriver, session_file):
+    """Injects a saved session into a freshly launched browser.
+
+    Must be called before the first navigation. Returns False if there's no
+    saved session.
+    """
+    try:
+        with open(session_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        logger.info("No saved session to load")
+        return False
+
+    now = time.time()
+    cookies = []
+    for cookie in state["cookies"]:
+        param = {k: cookie[k] for k in COOKIE_PARAMS if k in cookie}
+        if not cookie.get("session") and cookie.get("expires", -1) >= 0:
+            if cookie["expires"] <= now:
+                continue
+            param["expires"] = cookie["expires"]
+        cookies.append(param)
+    if cookies:
+        webdriver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+    if state.get("local_storage"):
+        add_tab_setup(
+            webdriver,
+            "Page.addScriptToEvaluateOnNewDocument",
+            {"source": LOCAL_STORAGE_SCRIPT % json.dumps(state["local_storage"])},
+        )
+    logger.info("Loaded {} saved session cookies".format(len(cookies)))
+    return True
+
+
+def get_dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def compact_profile(session_path):
+    """Deletes a Chrome profile's caches. Returns the bytes freed."""
+    freed = 0
+    for parent in (session_path, os.path.join(session_path, "Default")):
+        for name in PROFILE_CACHE_DIRS:
+            path = os.path.join(parent, name)
+            if os.path.isdir(path):
+                freed += get_dir_size(path)
+                shutil.rmtree(path, ignore_errors=True)
+    return freed
+
+
+def migrate_profile(args):
+    """Saves the login from a Chrome profile dir into a session file.
+
+    Chrome encrypts cookies on disk, so this opens the profile in a browser
+    to read them back.
+    """
+    session_file = get_session_file(args)
+    base_url = args.safeway_url or "https://www.safeway.com"
+    webdriver = get_webdriver(True, args.session_path, lean=True)
+    try:
+        webdriver.get(base_url)
+        save_session_state(webdriver, session_file, base_url)
+    finally:
+        webdriver.quit()
+    logger.info("Migrated session to {}".format(session_file))
+    if args.remove_profile:
+        shutil.rmtree(args.session_path, ignore_errors=True)
+        logger.info("Removed the profile dir")
+
+
+def main():
+    root_logger = logging.getLogger()
+    root_logger.setLevel(logging.INFO)
+    root_logger.addHandler(logging.StreamHandler())
+
+    parser = argparse.ArgumentParser(
+        description="Compact or migrate saved Chrome profile sessions."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="Copy a profile dir's login into a compact session file."
+    )
+    define_common_args(migrate_parser)
+    migrate_parser.add_argument(
+        "--remove-profile",
+        action="store_true",
+        help="Delete the profile dir once its session is migrated.",
+    )
+
+    compact_parser = subparsers.add_parser(
+        "compact", help="Delete the caches in profile dirs, keeping the login."
+    )
+    compact_parser.add_argument(
+        "profile_dirs",
+        nargs="*",
+        help=(
+            "Profile dirs to compact. Defaults to ChromeSession and every "
+            "account's profile under ChromeSessions."
+        ),
+    )
+
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate_profile(args)
+        return
+
+    profile_dirs = args.profile_dirs
+    if not profile_dirs:
+        profile_dirs = [os.path.join(BASE_PATH, "ChromeSession")]
+        accounts_dir = os.path.join(BASE_PATH, "ChromeSessions")
+        if os.path.isdir(accounts_dir):
+            profile_dirs += [
+                os.path.join(accounts_dir, name) for name in os.listdir(accounts_dir)
+            ]
+    for profile_dir in profile_dirs:
+        if not os.path.isdir(profile_dir):
+            continue
+        freed = compact_profile(profile_dir)
+        name = os.path.basename(profile_dir)
+        logger.info("Freed {:.1f}MB from {}".format(freed / 2**20, name))
+
+
+if __name__ == "__main__":
+    main()
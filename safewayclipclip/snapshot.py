@@ -0,0 +1,134 @@
+from safewayclipclip.waits import script_only
+
+# Container holding the coupon cards. Queries are scoped to it when present
+# so they don't walk the whole document; otherwise they fall back to the
+# document.
+COUPON_GRID_SELECTOR = ".coupon-grid-container, .grid-coupon-container"
+
+# Cards carry the offer's id and expiry as data attributes.
+OFFER_ID_ATTRIBUTE = "data-offer-id"
+OFFER_EXPIRY_ATTRIBUTE = "data-expiry"
+# Set on clip buttons the clip loop has decided not to click.
+SKIP_ATTRIBUTE = "data-clipclip-skip"
+
+# Gathers everything the clip loop needs to decide its next step in a single
+# round trip. Returns at most `maxHandles` pending clip buttons, along with
+# their offer ids and expiry dates where the page provides them.
+SNAPSHOT_SCRIPT = """
+const gridSelector = arguments[0];
+const maxHandles = arguments[1];
+const offerIdAttribute = arguments[2];
+const expiryAttribute = arguments[3];
+const skipAttribute = arguments[4];
+const grid = document.querySelector(gridSelector) || document;
+
+function isVisible(el) {
+    return el.getClientRects().length > 0;
+}
+
+function visibleButton(root, text) {
+    for (const b of root.querySelectorAll('button')) {
+        if (b.textContent.includes(text) && isVisible(b)) {
+            return b;
+        }
+    }
+    return null;
+}
+
+const pending = [];
+let pendingCount = 0;
+let clippedCount = 0;
+for (const b of grid.querySelectorAll('button')) {
+    const text = b.textContent;
+    if (text.includes('Activate') || text.includes('Clip Coupon')) {
+        if (b.hasAttribute(skipAttribute) || !isVisible(b)) {
+            continue;
+        }
+        pendingCount++;
+        if (pending.length < maxHandles) {
+            const card = b.closest('[' + offerIdAttribute + ']');
+            pending.push({
+                button: b,
+                offerId: card ? card.getAttribute(offerIdAttribute) : null,
+                expiry: card ? card.getAttribute(expiryAttribute) : null,
+            });
+        }
+    } else if (text.includes('Clipped')) {
+        clippedCount++;
+    }
+}
+
+const modal = document.getElementById('errorModal');
+let loading = false;
+for (const s of grid.querySelectorAll('.spinner, .loading')) {
+    if (isVisible(s)) {
+        loading = true;
+        break;
+    }
+}
+
+return {
+    pendingOffers: pending,
+    pendingCount: pendingCount,
+    clippedCount: clippedCount,
+    loading: loading,
+    loadMoreButton: visibleButton(document, 'Load more'),
+    modalCloseButton: modal ? visibleButton(modal, 'Close') : null,
+    cookieBannerButton: visibleButton(document, 'Accept All'),
+};
+"""
+
+
+class PageSnapshot:
+    def __init__(self, raw):
+        self.pending_offers = raw["pendingOffers"]
+        self.pending_count = raw["pendingCount"]
+        self.clipped_count = raw["clippedCount"]
+        self.loading = raw["loading"]
+        self.load_more_button = raw["loadMoreButton"]
+        self.modal_close_button = raw["modalCloseButton"]
+        self.cookie_banner_button = raw["cookieBannerButton"]
+
+    @property
+    def pending_buttons(self):
+        return [offer["button"] for offer in self.pending_offers]
+
+    def has_work(self):
+        return bool(self.pending_count or self.load_more_button)
+
+
+def take_snapshot(webdriver, max_handles=1):
+    return PageSnapshot(
+        webdriver.execute_script(
+            SNAPSHOT_SCRIPT,
+            COUPON_GRID_SELECTOR,
+            max_handles,
+            OFFER_ID_ATTRIBUTE,
+            OFFER_EXPIRY_ATTRIBUTE,
+            SKIP_ATTRIBUTE,
+        )
+    )
+
+
+MARK_SKIPPED_SCRIPT = """
+const buttons = arguments[0];
+const skipAttribute = arguments[1];
+for (const b of buttons) {
+    b.setAttribute(skipAttribute, '');
+}
+"""
+
+
+def mark_skipped(webdriver, buttons):
+    """Hides buttons from later snapshots and batch clips without clicking."""
+    webdriver.execute_script(MARK_SKIPPED_SCRIPT, buttons, SKIP_ATTRIBUTE)
+
+
+def work_available():
+    """Wait condition: true once there are coupons to clip or to load."""
+
+    @script_only
+    def condition(driver):
+        return take_snapshot(driver, max_handles=0).has_work()
+
+    return condition
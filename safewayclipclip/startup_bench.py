@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Benchmarks cold start: how long the entry points take to import, and how
+# long it takes from launching the process to the browser's first navigation.
+
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+from safewayclipclip import VERSION
+from safewayclipclip.args import BASE_PATH
+from safewayclipclip.fake_site import FakeSafewaySite, SIGN_IN_PATH
+
+logger = logging.getLogger(__name__)
+
+ENTRY_MODULES = [
+    "safewayclipclip.cli",
+    "safewayclipclip.main",
+    "safewayclipclip.daemon",
+]
+NUM_SLOWEST_IMPORTS = 5
+
+
+def measure_import_time(module):
+    """Imports the module in a fresh interpreter with -X importtime.
+
+    Returns the module's cumulative import time and the slowest imports by
+    self time, both in ms.
+    """
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module],
+        capture_output=True,
+        text=True,
+    )
+    if process.returncode:
+        return {"module": module, "error": process.stderr.strip().splitlines()[-1]}
+    imports = []
+    total_us = None
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((name.strip(), int(self_us)))
+        if name.strip() == module:
+            total_us = int(cumulative_us)
+    imports.sort(key=lambda i: -i[1])
+    return {
+        "module": module,
+        "import_ms": round(total_us / 1000, 1) if total_us else None,
+        "slowest": [
+            [name, round(us / 1000, 1)] for name, us in imports[:NUM_SLOWEST_IMPORTS]
+        ],
+    }
+
+
+def measure_version_time(module):
+    """Wall time, in ms, of running the entry point with --version."""
+    start_time = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-m", module, "--version"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return round((time.perf_counter() - start_time) * 1000, 1)
+
+
+def measure_first_navigation(url, headless, browser_profile):
+    """Times a fresh process from launch until it has navigated to url."""
+    command = [
+        sys.executable,
+        "-m",
+        "safewayclipclip.startup_bench",
+        "--navigate",
+        url,
+    ]
+    if headless:
+        command.append("--headless")
+    if browser_profile:
+        command += ["--browser-profile", browser_profile]
+    start_time = time.time()
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode:
+        logger.error("First navigation failed:\n{}".format(process.stderr))
+        return None
+    child = json.loads(process.stdout.strip().splitlines()[-1])
+    return {
+        "interpreter_s": round(child["started_at"] - start_time, 3),
+        "imports_s": round(child["imported_at"] - child["started_at"], 3),
+        "launch_s": round(child["launched_at"] - child["imported_at"], 3),
+        "navigate_s": round(child["navigated_at"] - child["launched_at"], 3),
+        "first_navigation_s": round(child["navigated_at"] - start_time, 3),
+        "chromedriver_cached": child["chromedriver_cached"],
+    }
+
+
+def navigate(args, started_at):
+    """Runs in the child process of measure_first_navigation."""
+    from safewayclipclip.webdriver import (
+        get_webdriver,
+        use_lean_profile,
+        CHROMEDRIVER_CACHE_PATH,
+    )
+
+    imported_at = time.time()
+    chromedriver_cached = os.path.isfile(CHROMEDRIVER_CACHE_PATH)
+    webdriver = get_webdriver(args.headless, None, use_lean_profile(args))
+    launched_at = time.time()
+    try:
+        webdriver.get(args.navigate)
+        navigated_at = time.time()
+    finally:
+        webdriver.quit()
+    print(
+        json.dumps(
+            {
+                "started_at": started_at,
+                "imported_at": imported_at,
+                "launched_at": launched_at,
+                "navigated_at": navigated_at,
+                "chromedriver_cached": chromedriver_cached,
+            }
+        )
+    )
+
+
+def run_benchmark(args):
+    result = {
+        "version": VERSION,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "imports": [measure_import_time(m) for m in ENTRY_MODULES],
+        "version_flag_ms": {m: measure_version_time(m) for m in ENTRY_MODULES[:2]},
+    }
+    if not args.skip_browser:
+        site = FakeSafewaySite(num_coupons=10)
+        site.start()
+        try:
+            result["first_navigation"] = [
+                measure_first_navigation(
+                    site.url + SIGN_IN_PATH, args.headless, args.browser_profile
+                )
+                for _ in range(args.runs)
+            ]
+        finally:
+            site.stop()
+    return result
+
+
+def main():
+    started_at = time.time()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(
+        description="Benchmark cold start time of the ClipClip entry points."
+    )
+    parser.add_argument("--headless", action="store_true")
+    parser.add_argument("--browser-profile", choices=["normal", "lean"])
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="Number of cold starts to time through to first navigation.",
+    )
+    parser.add_argument(
+        "--skip-browser",
+        action="store_true",
+        help="Only measure imports, without launching a browser.",
+    )
+    parser.add_argument(
+        "--output",
+        default=os.path.join(BASE_PATH, "startup_bench.json"),
+        help="JSON file which results are appended to.",
+    )
+    parser.add_argument("--navigate", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.navigate:
+        navigate(args, started_at)
+        return
+
+    # Imported here so the child process above stays as light as possible.
+    from safewayclipclip.bench import append_result
+
+    result = run_benchmark(args)
+    print(json.dumps(result, indent=2))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    append_result(args.output, result)
+
+
+if __name__ == "__main__":
+    main()
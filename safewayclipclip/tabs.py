@@ -0,0 +1,341 @@
+# Clips in several tabs of one logged-in browser at once. Each tab takes a
+# disjoint slice of the offers, and the tabs are stepped in turn without
+# blocking, so one tab's pacing delay or wait for a clip to land overlaps with
+# clicks in the others.
+
+import logging
+import time
+import zlib
+
+from selenium.common.exceptions import (
+    ElementClickInterceptedException,
+    JavascriptException,
+    StaleElementReferenceException,
+)
+
+from safewayclipclip.batch import ClipThroughput
+from safewayclipclip.discovery import CouponDiscovery, PREFETCH_LOW_WATER
+from safewayclipclip.events import event_bus, publish_clip, PAGE_LOADED
+from safewayclipclip.ledger import parse_expiry
+from safewayclipclip.retry import (
+    get_offer_key,
+    CircuitBreaker,
+    OfferRetries,
+    FAILURE_INTERCEPTED,
+    FAILURE_JAVASCRIPT,
+    FAILURE_NOT_CLIPPED,
+    FAILURE_STALE,
+)
+from safewayclipclip.snapshot import mark_skipped, work_available
+from safewayclipclip.tracing import phase
+from safewayclipclip.waits import (
+    button_clipped,
+    check_cancelled,
+    interruptible_sleep,
+    next_delay_s,
+    CLIP_CONFIRMED,
+)
+from safewayclipclip.watchdog import BrowserRecycleNeeded
+from safewayclipclip.webdriver import click_element, open_tab
+
+logger = logging.getLogger(__name__)
+
+# How soon a tab which is waiting on the page is stepped again.
+TAB_POLL_S = 0.1
+
+
+class ClipTab:
+    """One tab's slice of the work, and what it's waiting on."""
+
+    def __init__(self, webdriver, handle, index, num_tabs):
+        self.handle = handle
+        self.index = index
+        self.num_tabs = num_tabs
+        self.discovery = CouponDiscovery(webdriver)
+        # The offer clicked last, and when, until it's confirmed clipped.
+        self.clicked_offer = None
+        self.clicked_at = None
+        # The wait condition for a Load more click, and when it was clicked.
+        self.more_loaded = None
+        self.load_more_at = None
+        self.loading_since = None
+        self.pending_count = 0
+        self.ready_at = 0.0
+        self.done = False
+        # The indexes of the slices this tab clips: its own, plus those of
+        # tabs which gave up.
+        self.slices = {index}
+        self.gave_up = False
+        # Set once the tab takes on another slice, whose buttons it has
+        # already marked skipped.
+        self.reload_needed = False
+
+    def owns(self, offer):
+        """Offers are split between tabs by a stable hash of their id.
+
+        Offers without an id can't be told apart across tabs, so only the
+        tab with the first slice clips them.
+        """
+        if not offer["offerId"]:
+            return 0 in self.slices
+        offer_hash = zlib.crc32(offer["offerId"].encode("utf-8"))
+        return offer_hash % self.num_tabs in self.slices
+
+
+def open_tabs(webdriver, waiter, coupon_url, num_tabs):
+    """Opens the coupon page in num_tabs - 1 more tabs of the same session."""
+    handles = [webdriver.current_window_handle]
+    for _ in range(num_tabs - 1):
+        # Blocked URLs and the saved session's local storage are set up per
+        # tab, so repeat them before the tab loads anything.
+        open_tab(webdriver)
+        webdriver.get(coupon_url)
+        handles.append(webdriver.current_window_handle)
+    tabs = []
+    for index, handle in enumerate(handles):
+        webdriver.switch_to.window(handle)
+        waiter.wait(webdriver, work_available())
+        tabs.append(ClipTab(webdriver, handle, index, num_tabs))
+    return tabs
+
+
+def close_tabs(webdriver, tabs):
+    """Closes all but the first tab, and switches back to it."""
+    for tab in tabs[1:]:
+        webdriver.switch_to.window(tab.handle)
+        webdriver.close()
+    webdriver.switch_to.window(tabs[0].handle)
+
+
+def clip_in_tabs(
+    webdriver,
+    waiter,
+    coupon_url,
+    num_tabs,
+    ledger=None,
+    watchdog=None,
+    throughput=None,
+    catalog=None,
+    retries=None,
+    breaker=None,
+    selector=None,
+):
+    """Clips every coupon using num_tabs tabs of the one browser.
+
+    Works like clip_coupons, except each tab only clips the offers it owns,
+    and never blocks: the tab due soonest is stepped next. Offers clicked in
+    any tab are claimed, so no offer is clicked in two tabs at once or once
+    it has clipped. Offers the selector doesn't want are skipped, and each
+    tab clips its next few offers in the selector's priority order.
+    """
+    # Imported here since cli imports this module.
+    from safewayclipclip.cli import (
+        catalog_offers,
+        next_clip_state,
+        recover_from_failure,
+        reload_coupons,
+        ClipState,
+        SINGLE_PENDING_HANDLES,
+    )
+
+    if not throughput:
+        throughput = ClipThroughput("tabs")
+    retries = retries or OfferRetries()
+    breaker = breaker or CircuitBreaker()
+    claimed = set()
+    tabs = []
+
+    def finish_clip(tab, failure):
+        offer = tab.clicked_offer
+        key = get_offer_key(offer)
+        tab.clicked_offer = tab.clicked_at = None
+        clipped = failure is None
+        throughput.add(clicks=1, clipped=int(clipped))
+        if clipped:
+            tab.pending_count -= 1
+        publish_clip(offer["offerId"], failure, sum(t.pending_count for t in tabs))
+        breaker.record(clipped)
+        expires_at = parse_expiry(offer["expiry"])
+        if clipped:
+            retries.record_success(key)
+            if ledger:
+                ledger.record_clipped(offer["offerId"], expires_at)
+            return
+        # Let the owning tab retry it after its backoff.
+        claimed.discard(key)
+        retries.record_failure(key)
+        if ledger:
+            ledger.record_failure(offer["offerId"], expires_at)
+        recover_from_failure(webdriver, waiter, offer, failure)
+
+    def give_up(tab):
+        """Hands the tab's slices to the surviving tab with the fewest."""
+        tab.gave_up = tab.done = True
+        heirs = [t for t in tabs if not t.gave_up]
+        if not heirs:
+            logger.warning(
+                "Coupons are still loading in tab {}; its {} of {} slices of "
+                "the coupons won't be clipped".format(
+                    tab.index + 1, len(tab.slices), tab.num_tabs
+                )
+            )
+            return
+        heir = min(heirs, key=lambda t: len(t.slices))
+        logger.warning(
+            "Coupons are still loading in tab {}; tab {} takes its "
+            "coupons".format(tab.index + 1, heir.index + 1)
+        )
+        heir.slices |= tab.slices
+        tab.slices = set()
+        heir.reload_needed = True
+        heir.done = False
+
+    def step(tab):
+        """Takes the tab's next step; returns when it should be stepped again."""
+        now = time.monotonic()
+        if tab.clicked_offer:
+            outcome = button_clipped(tab.clicked_offer["button"])(webdriver)
+            if outcome == CLIP_CONFIRMED:
+                finish_clip(tab, None)
+            elif not outcome and now - tab.clicked_at < waiter.ceiling_s:
+                return now + TAB_POLL_S
+            else:
+                finish_clip(tab, FAILURE_NOT_CLIPPED)
+            return now
+        if tab.more_loaded:
+            if tab.more_loaded(webdriver):
+                breaker.record(True)
+                event_bus.publish(PAGE_LOADED)
+            elif now - tab.load_more_at < waiter.ceiling_s:
+                return now + TAB_POLL_S
+            else:
+                breaker.record(False)
+            tab.more_loaded = tab.load_more_at = None
+            return now
+        if tab.reload_needed:
+            # Brings back the buttons it skipped as another tab's.
+            tab.reload_needed = False
+            reload_coupons(webdriver, waiter)
+            return now
+
+        snapshot = tab.discovery.snapshot(SINGLE_PENDING_HANDLES)
+        state = next_clip_state(snapshot)
+        tab.pending_count = snapshot.pending_count
+        if state != ClipState.LOADING:
+            tab.loading_since = None
+
+        if state == ClipState.DISMISS_MODAL:
+            with phase("modal-dismiss"):
+                click_element(webdriver, snapshot.modal_close_button)
+            logger.info("Closed modal dialog")
+            breaker.record(False)
+            return now + next_delay_s()
+        if state == ClipState.CLIPPING:
+            others = []
+            skipped = []
+            for offer in snapshot.pending_offers:
+                key = get_offer_key(offer)
+                if (
+                    (ledger and ledger.should_skip(offer["offerId"]))
+                    or retries.exhausted(key)
+                    or (selector and not selector.wants(offer))
+                ):
+                    skipped.append(offer["button"])
+                elif not tab.owns(offer) or key in claimed:
+                    others.append(offer["button"])
+            if skipped or others:
+                mark_skipped(webdriver, skipped + others)
+                throughput.skip(len(skipped))
+                return now
+            if snapshot.cookie_banner_button:
+                click_element(webdriver, snapshot.cookie_banner_button)
+            if (
+                snapshot.pending_count <= PREFETCH_LOW_WATER
+                and snapshot.load_more_button
+                and not snapshot.loading
+            ):
+                if catalog and tab.index == 0:
+                    catalog_offers(webdriver, catalog)
+                logger.info("Loading more ahead of time")
+                with phase("load-more"):
+                    click_element(webdriver, snapshot.load_more_button)
+            pending_offers = snapshot.pending_offers
+            if selector:
+                pending_offers = selector.order(pending_offers)
+            offer = retries.next_ready(pending_offers)
+            if not offer:
+                return retries.next_retry_at(snapshot.pending_offers)
+            claimed.add(get_offer_key(offer))
+            tab.clicked_offer = offer
+            tab.clicked_at = now
+            failure = None
+            with phase("clip"):
+                try:
+                    click_element(webdriver, offer["button"])
+                except ElementClickInterceptedException:
+                    logger.warning("Click interception error; continuing")
+                    failure = FAILURE_INTERCEPTED
+                except StaleElementReferenceException:
+                    logger.warning("Stale ref error; continuing")
+                    failure = FAILURE_STALE
+                except JavascriptException:
+                    logger.warning("JS error; continuing")
+                    failure = FAILURE_JAVASCRIPT
+            if failure:
+                finish_clip(tab, failure)
+            # Other tabs click while this one waits out its pacing delay.
+            return now + next_delay_s()
+        if state == ClipState.LOADING:
+            tab.loading_since = tab.loading_since or now
+            if now - tab.loading_since > waiter.ceiling_s:
+                give_up(tab)
+            return now + TAB_POLL_S
+        if state == ClipState.LOAD_MORE:
+            # Every tab sees every offer, so one tab catalogs them all.
+            if catalog and tab.index == 0:
+                catalog_offers(webdriver, catalog)
+            logger.info("Clicking load more!")
+            tab.more_loaded = tab.discovery.more_loaded()
+            tab.load_more_at = now
+            with phase("load-more"):
+                click_element(webdriver, snapshot.load_more_button)
+            return now + TAB_POLL_S
+        logger.info("Tab {} is done".format(tab.index + 1))
+        if catalog and tab.index == 0:
+            catalog_offers(webdriver, catalog)
+        tab.done = True
+        return now
+
+    tabs[:] = open_tabs(webdriver, waiter, coupon_url, num_tabs)
+    logger.info("Clipping in {} tabs".format(len(tabs)))
+    current = tabs[0]
+    try:
+        while True:
+            active = [tab for tab in tabs if not tab.done]
+            if not active:
+                break
+            check_cancelled()
+            if watchdog and watchdog.over_limit():
+                raise BrowserRecycleNeeded(throughput)
+            if breaker.tripped():
+                if breaker.trip():
+                    logger.error("Too many clips are failing; stopping")
+                    break
+                for tab in active:
+                    webdriver.switch_to.window(tab.handle)
+                    reload_coupons(webdriver, waiter)
+                    tab.clicked_offer = tab.more_loaded = tab.loading_since = None
+                    tab.reload_needed = False
+                claimed.clear()
+                current = active[-1]
+            tab = min(active, key=lambda t: t.ready_at)
+            wait_s = tab.ready_at - time.monotonic()
+            if wait_s > 0:
+                interruptible_sleep(wait_s)
+            if tab is not current:
+                webdriver.switch_to.window(tab.handle)
+                current = tab
+            tab.ready_at = step(tab)
+    finally:
+        close_tabs(webdriver, tabs)
+    return throughput
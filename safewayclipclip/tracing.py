@@ -0,0 +1,232 @@
+from contextlib import contextmanager
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+NO_PHASE = "other"
+PHASE_CALL = "[phase]"
+
+
+class CallStats:
+    def __init__(self):
+        self.count = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.timeouts = 0
+        # One count per bucket, plus a final overflow bucket.
+        self.buckets = [0] * (len(BUCKETS_S) + 1)
+
+    def add(self, duration_s, timed_out):
+        self.count += 1
+        self.total_s += duration_s
+        self.max_s = max(self.max_s, duration_s)
+        if timed_out:
+            self.timeouts += 1
+        for i, bound in enumerate(BUCKETS_S):
+            if duration_s <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+
+    def percentile_s(self, q):
+        """Approximates a percentile as the upper bound of its bucket."""
+        target = q * self.count
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target and count:
+                if i == len(BUCKETS_S):
+                    return self.max_s
+                return min(BUCKETS_S[i], self.max_s)
+        return self.max_s
+
+
+class Tracer:
+    """Collects latency per (phase, call site) across a run.
+
+    Phases are tracked per thread. Individual events for a Chrome trace are
+    only kept when record_events is set, since they grow with the run.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.events = []
+        self.record_events = False
+        self.origin = time.perf_counter()
+        self._local = threading.local()
+
+    def current_phase(self):
+        phases = getattr(self._local, "phases", None)
+        return phases[-1] if phases else NO_PHASE
+
+    @contextmanager
+    def phase(self, name):
+        if not hasattr(self._local, "phases"):
+            self._local.phases = []
+        self._local.phases.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._local.phases.pop()
+            self.record(name, PHASE_CALL, start, time.perf_counter() - start)
+
+    def record(self, phase, call, start, duration_s, timed_out=False):
+        with self.lock:
+            key = (phase, call)
+            if key not in self.stats:
+                self.stats[key] = CallStats()
+            self.stats[key].add(duration_s, timed_out)
+            if self.record_events:
+                self.events.append(
+                    {
+                        "name": call if call != PHASE_CALL else phase,
+                        "cat": phase,
+                        "ph": "X",
+                        "ts": round((start - self.origin) * 1e6),
+                        "dur": round(duration_s * 1e6),
+                        "pid": os.getpid(),
+                        "tid": threading.get_ident(),
+                    }
+                )
+
+    def summary_lines(self):
+        lines = [
+            "{:<14} {:<28} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9} {:>8}".format(
+                "phase",
+                "call",
+                "count",
+                "total_s",
+                "mean_ms",
+                "p50_ms",
+                "p95_ms",
+                "max_ms",
+                "timeouts",
+            )
+        ]
+        with self.lock:
+            items = sorted(self.stats.items(), key=lambda kv: -kv[1].total_s)
+            for (phase, call), stats in items:
+                lines.append(
+                    "{:<14} {:<28} {:>7} {:>9.2f} {:>9.1f} {:>9.1f} {:>9.1f} "
+                    "{:>9.1f} {:>8}".format(
+                        phase,
+                        call,
+                        stats.count,
+                        stats.total_s,
+                        stats.total_s / stats.count * 1000,
+                        stats.percentile_s(0.5) * 1000,
+                        stats.percentile_s(0.95) * 1000,
+                        stats.max_s * 1000,
+                        stats.timeouts,
+                    )
+                )
+        return lines
+
+    def log_summary(self):
+        logger.info("Timing by phase and call:\n" + "\n".join(self.summary_lines()))
+
+    def write_chrome_trace(self, filename):
+        """Writes events in the Chrome trace-event format (chrome://tracing)."""
+        with self.lock:
+            trace = {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+        with open(filename, "w") as f:
+            json.dump(trace, f)
+
+    def write_prometheus(self, filename):
+        """Writes the histograms in the Prometheus text exposition format."""
+        name = "clipclip_call_duration_seconds"
+        lines = [
+            "# HELP {} Latency of traced calls.".format(name),
+            "# TYPE {} histogram".format(name),
+        ]
+        timeout_lines = [
+            "# HELP clipclip_implicit_wait_timeouts_total Finder calls which "
+            "waited out the implicit wait.",
+            "# TYPE clipclip_implicit_wait_timeouts_total counter",
+        ]
+        with self.lock:
+            for (phase, call), stats in sorted(self.stats.items()):
+                labels = 'phase="{}",call="{}"'.format(phase, call)
+                cumulative = 0
+                for bound, count in zip(BUCKETS_S, stats.buckets):
+                    cumulative += count
+                    lines.append(
+                        '{}_bucket{{{},le="{}"}} {}'.format(
+                            name, labels, bound, cumulative
+                        )
+                    )
+                lines.append(
+                    '{}_bucket{{{},le="+Inf"}} {}'.format(name, labels, stats.count)
+                )
+                lines.append("{}_sum{{{}}} {}".format(name, labels, stats.total_s))
+                lines.append("{}_count{{{}}} {}".format(name, labels, stats.count))
+                timeout_lines.append(
+                    "clipclip_implicit_wait_timeouts_total{{{}}} {}".format(
+                        labels, stats.timeouts
+                    )
+                )
+        with open(filename, "w") as f:
+            f.write("\n".join(lines + timeout_lines) + "\n")
+
+
+tracer = Tracer()
+
+
+def traced(func=None, empty_is_timeout=False):
+    """Records each call's latency under the current phase.
+
+    With empty_is_timeout, a None or empty result counts as an implicit wait
+    timeout, which is how the blocking finders report a missing element.
+    """
+
+    def decorate(func):
+        call = func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            timed_out = False
+            try:
+                result = func(*args, **kwargs)
+                timed_out = empty_is_timeout and not result
+                return result
+            finally:
+                tracer.record(
+                    tracer.current_phase(),
+                    call,
+                    start,
+                    time.perf_counter() - start,
+                    timed_out,
+                )
+
+        return wrapper
+
+    if func is not None:
+        return decorate(func)
+    return decorate
+
+
+def phase(name):
+    return tracer.phase(name)
+
+
+def write_trace_outputs(args):
+    """Logs the timing summary and writes any requested exports."""
+    tracer.log_summary()
+    if args.trace_output:
+        tracer.write_chrome_trace(args.trace_output)
+        logger.info("Wrote Chrome trace to {}".format(args.trace_output))
+    if args.metrics_output:
+        tracer.write_prometheus(args.metrics_output)
+        logger.info("Wrote Prometheus metrics to {}".format(args.metrics_output))
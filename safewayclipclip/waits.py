@@ -0,0 +1,277 @@
+from contextlib import nullcontext
+import logging
+import random
+import time
+
+from selenium.common.exceptions import (
+    NoSuchElementException,
+    StaleElementReferenceException,
+    TimeoutException,
+)
+
+from safewayclipclip.webdriver import no_implicit_wait, probe_elements
+
+logger = logging.getLogger(__name__)
+
+LOAD_MORE_SPINNER_XPATH = (
+    '//*[contains(@class, "spinner") or contains(@class, "loading")]'
+)
+POLL_FREQUENCY_S = 0.1
+
+
+class WaitStats:
+    """Splits a run's wall time into time spent waiting and working."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.monotonic()
+        self.waiting_s = 0.0
+
+    def add_wait(self, seconds):
+        self.waiting_s += seconds
+
+    def log_summary(self):
+        wall_s = time.monotonic() - self.start_time
+        logger.info(
+            "Wall time {:.1f}s: {:.1f}s waiting, {:.1f}s working".format(
+                wall_s, self.waiting_s, wall_s - self.waiting_s
+            )
+        )
+
+
+wait_stats = WaitStats()
+
+
+# Conditions, usable with WebDriverWait.until. They run with the implicit
+# wait disabled so each poll is a single quick round trip.
+
+
+def coupon_button_count_changed(xpath, previous_count):
+    def condition(driver):
+        return len(probe_elements(driver, xpath)) != previous_count
+
+    return condition
+
+
+def element_gone(xpath):
+    def condition(driver):
+        return not any(e.is_displayed() for e in probe_elements(driver, xpath))
+
+    return condition
+
+
+def script_only(condition):
+    """Marks a condition which finds no elements, only runs scripts.
+
+    Waits on these leave the implicit wait alone, saving the two round trips
+    it takes to drop and restore it.
+    """
+    condition.script_only = True
+    return condition
+
+
+# Outcomes of a clip, as returned by button_clipped.
+CLIP_CONFIRMED = "clipped"
+CLIP_REJECTED = "rejected"
+
+BUTTON_CLIPPED_SCRIPT = """
+const button = arguments[0];
+const confirmed = arguments[1];
+const rejected = arguments[2];
+if (!button.isConnected || button.getClientRects().length === 0) {
+    return confirmed;
+}
+const text = button.textContent;
+if (!(text.includes('Activate') || text.includes('Clip Coupon'))) {
+    return confirmed;
+}
+const modal = document.getElementById('errorModal');
+return modal && modal.getClientRects().length > 0 ? rejected : null;
+"""
+
+
+def button_clipped(element):
+    """CLIP_CONFIRMED once the button no longer offers to clip, or has been
+    removed; CLIP_REJECTED once the site shows its error modal instead.
+    """
+
+    @script_only
+    def condition(driver):
+        try:
+            return driver.execute_script(
+                BUTTON_CLIPPED_SCRIPT, element, CLIP_CONFIRMED, CLIP_REJECTED
+            )
+        except StaleElementReferenceException:
+            return CLIP_CONFIRMED
+
+    return condition
+
+
+def page_settled():
+    """True once the document is loaded and the URL stopped redirecting."""
+    last_url = []
+
+    @script_only
+    def condition(driver):
+        url = driver.current_url
+        ready = driver.execute_script("return document.readyState") == "complete"
+        settled = ready and last_url == [url]
+        last_url[:] = [url]
+        return settled
+
+    return condition
+
+
+def all_of(*conditions):
+    def condition(driver):
+        return all(c(driver) for c in conditions)
+
+    return condition
+
+
+def cancellable(condition):
+    """Wraps a wait condition to raise RunCancelled once the run is cancelled."""
+
+    def cancellable_condition(driver):
+        check_cancelled()
+        return condition(driver)
+
+    cancellable_condition.script_only = getattr(condition, "script_only", False)
+    return cancellable_condition
+
+
+class AdaptiveWaiter:
+    """Waits for page conditions, bounded by a floor and a ceiling.
+
+    The floor is always waited (useful to stay polite to the site); beyond
+    that, the wait returns as soon as the condition holds, or gives up at the
+    ceiling.
+    """
+
+    def __init__(self, floor_s=0.0, ceiling_s=10.0):
+        self.floor_s = floor_s
+        self.ceiling_s = max(ceiling_s, floor_s)
+
+    def wait(self, driver, condition, ceiling_s=None):
+        """Returns the condition's value once truthy, or False at the ceiling."""
+        from selenium.webdriver.support.ui import WebDriverWait
+
+        ceiling_s = self.ceiling_s if ceiling_s is None else ceiling_s
+        start_time = time.monotonic()
+        if self.floor_s:
+            interruptible_sleep(self.floor_s)
+        remaining_s = ceiling_s - (time.monotonic() - start_time)
+        if getattr(condition, "script_only", False):
+            implicit_wait = nullcontext()
+        else:
+            implicit_wait = no_implicit_wait(driver)
+        try:
+            with implicit_wait:
+                return WebDriverWait(
+                    driver,
+                    max(remaining_s, 0),
+                    poll_frequency=_poll_frequency_s,
+                    ignored_exceptions=(
+                        NoSuchElementException,
+                        StaleElementReferenceException,
+                    ),
+                ).until(cancellable(condition))
+        except TimeoutException:
+            return False
+        finally:
+            wait_stats.add_wait(time.monotonic() - start_time)
+
+
+class RandomPacing:
+    """Human-like delay drawn uniformly between min_ms and max_ms."""
+
+    def __init__(self, min_ms, max_ms):
+        self.min_ms = min_ms
+        self.max_ms = max(max_ms, min_ms)
+
+    def delay_s(self):
+        return random.randint(self.min_ms, self.max_ms) / 1000.0
+
+
+class FixedPacing:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def delay_s(self):
+        return self.ms / 1000.0
+
+
+class NoPacing:
+    def delay_s(self):
+        return 0.0
+
+
+PACING_POLICIES = ("human", "fixed", "none")
+
+
+def get_pacing_policy(name, min_ms, max_ms):
+    if name == "human":
+        return RandomPacing(min_ms, max_ms)
+    if name == "fixed":
+        return FixedPacing(min_ms)
+    if name == "none":
+        return NoPacing()
+    raise ValueError("Unknown pacing policy: {}".format(name))
+
+
+_pacing_policy = RandomPacing(250, 1250)
+_poll_frequency_s = POLL_FREQUENCY_S
+_cancel_event = None
+
+
+def set_pacing_policy(policy):
+    global _pacing_policy
+    _pacing_policy = policy
+
+
+def set_poll_frequency(poll_frequency_s):
+    """Sets how often waits poll; replays, whose answers are instant, lower it."""
+    global _poll_frequency_s
+    _poll_frequency_s = poll_frequency_s
+
+
+def get_poll_frequency():
+    return _poll_frequency_s
+
+
+def next_delay_s():
+    """Draws the next pacing delay, for callers which schedule it, not sleep."""
+    return _pacing_policy.delay_s()
+
+
+class RunCancelled(Exception):
+    """Raised from pacing and waits once the run has been cancelled."""
+
+
+def set_cancel_event(event):
+    """Cancels the run once event, a threading.Event, is set. None to clear."""
+    global _cancel_event
+    _cancel_event = event
+
+
+def check_cancelled():
+    if _cancel_event is not None and _cancel_event.is_set():
+        raise RunCancelled()
+
+
+def interruptible_sleep(seconds):
+    """Sleeps, but raises RunCancelled as soon as the run is cancelled."""
+    if _cancel_event is None:
+        time.sleep(seconds)
+    elif _cancel_event.wait(seconds):
+        raise RunCancelled()
+
+
+def pace():
+    """Sleeps for the delay given by the current pacing policy."""
+    delay_s = _pacing_policy.delay_s()
+    if delay_s:
+        interruptible_sleep(delay_s)
+        wait_stats.add_wait(delay_s)
@@ -0,0 +1,105 @@
+import logging
+import threading
+
+from safewayclipclip.webdriver import get_browser_processes
+
+logger = logging.getLogger(__name__)
+
+
+class BrowserRecycleNeeded(Exception):
+    """Raised by the clip loop at a safe point when the browser must restart.
+
+    Carries the run's throughput so far, so it continues after the restart.
+    """
+
+    def __init__(self, throughput):
+        super().__init__("Browser exceeded its memory ceiling")
+        self.throughput = throughput
+
+
+class BrowserWatchdog:
+    """Samples RSS and CPU of the browser's process tree in the background.
+
+    The watchdog never touches the driver itself, since WebDriver isn't
+    thread safe; the clip loop polls over_limit() between steps instead.
+    """
+
+    def __init__(self, driver, max_rss_mb=None, interval_s=1.0):
+        self.driver = driver
+        self.max_rss_bytes = max_rss_mb * 2**20 if max_rss_mb else None
+        self.interval_s = interval_s
+        self.samples = 0
+        self.peak_rss_bytes = 0
+        self.total_rss_bytes = 0
+        self.peak_cpu_percent = 0.0
+        self.total_cpu_percent = 0.0
+        self._processes = {}
+        self._over_limit = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+    def over_limit(self):
+        return self._over_limit.is_set()
+
+    def run(self):
+        while not self._stopped.is_set():
+            # Keep enforcing the ceiling through failed samples, e.g. while
+            # the driver relaunches and has no browser process.
+            try:
+                self.sample()
+            except Exception:
+                logger.exception("Failed to sample the browser's processes")
+            self._stopped.wait(self.interval_s)
+
+    def sample(self):
+        import psutil
+
+        rss = 0
+        cpu = 0.0
+        current = {}
+        for p in get_browser_processes(self.driver):
+            # Reuse Process objects so cpu_percent measures since last sample.
+            p = self._processes.get(p.pid, p)
+            current[p.pid] = p
+            try:
+                rss += p.memory_info().rss
+                cpu += p.cpu_percent(None)
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                pass
+        self._processes = current
+
+        self.samples += 1
+        self.total_rss_bytes += rss
+        self.total_cpu_percent += cpu
+        self.peak_rss_bytes = max(self.peak_rss_bytes, rss)
+        self.peak_cpu_percent = max(self.peak_cpu_percent, cpu)
+        if self.max_rss_bytes and rss > self.max_rss_bytes:
+            if not self._over_limit.is_set():
+                logger.warning(
+                    "Browser RSS {:.0f}MB is over the {:.0f}MB ceiling".format(
+                        rss / 2**20, self.max_rss_bytes / 2**20
+                    )
+                )
+            self._over_limit.set()
+
+    def log_summary(self):
+        if not self.samples:
+            return
+        logger.info(
+            "Browser RSS peak {:.0f}MB, avg {:.0f}MB; CPU peak {:.0f}%, "
+            "avg {:.0f}%".format(
+                self.peak_rss_bytes / 2**20,
+                self.total_rss_bytes / self.samples / 2**20,
+                self.peak_cpu_percent,
+                self.total_cpu_percent / self.samples,
+            )
+        )
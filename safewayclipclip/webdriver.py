@@ -1,24 +1,158 @@
+from contextlib import contextmanager, suppress
+import json
 import logging
-import psutil
+import os
+import shutil
+import sys
+import tempfile
+import time
+import weakref
 
-from selenium.common.exceptions import InvalidArgumentException, NoSuchElementException
+from selenium.common.exceptions import NoSuchElementException
 
-# from selenium.webdriver import Chrome
-from selenium.webdriver import ChromeOptions
-from selenium.webdriver.common.by import By
+from safewayclipclip.args import BASE_PATH
+from safewayclipclip.tracing import traced
 
-from selenium_stealth import stealth
-from undetected_chromedriver import Chrome
+# selenium.webdriver, undetected_chromedriver and psutil take a noticeable
+# fraction of a second to import, so they're imported where used; that keeps
+# --version, argument errors and the daemon client fast.
 
 logger = logging.getLogger(__name__)
 
+# Locator strategies, the same as selenium's By without importing
+# selenium.webdriver.
+BY_ID = "id"
+BY_NAME = "name"
+BY_XPATH = "xpath"
+BY_LINK_TEXT = "link text"
+BY_CLASS_NAME = "class name"
+
+# undetected_chromedriver downloads and patches chromedriver on every launch
+# unless it's handed an already patched binary, so keep one around.
+CHROMEDRIVER_CACHE_PATH = os.path.join(
+    BASE_PATH,
+    "chromedriver",
+    "chromedriver.exe" if sys.platform == "win32" else "chromedriver",
+)
+
+
+# Resources not needed to clip coupons, blocked in the lean profile.
+LEAN_BLOCKED_URLS = [
+    "*.png",
+    "*.jpg",
+    "*.jpeg",
+    "*.gif",
+    "*.webp",
+    "*.svg",
+    "*.ico",
+    "*.woff",
+    "*.woff2",
+    "*.ttf",
+    "*.otf",
+    "*.mp4",
+    "*.webm",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*facebook.net*",
+    "*adobedtm.com*",
+    "*omtrdc.net*",
+    "*demdex.net*",
+    "*quantummetric.com*",
+    "*hotjar.com*",
+]
+
+LEAN_CHROME_ARGUMENTS = [
+    "--disable-extensions",
+    "--disable-background-networking",
+    "--disable-component-update",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--renderer-process-limit=2",
+    "--blink-settings=imagesEnabled=false",
+]
+
+
+def use_lean_profile(args):
+    """The lean profile is the default for headless (unattended) runs."""
+    if args.browser_profile is None:
+        return args.headless
+    return args.browser_profile == "lean"
+
+
+def _get_chrome_options(session_path, lean, log_network):
+    from selenium.webdriver import ChromeOptions
 
-def get_webdriver(headless=False, session_path=None):
     chrome_options = ChromeOptions()
     if session_path is not None:
         chrome_options.add_argument(f"--user-data-dir={session_path}")
+    if lean:
+        for argument in LEAN_CHROME_ARGUMENTS:
+            chrome_options.add_argument(argument)
+    if log_network:
+        chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    return chrome_options
+
 
-    webdriver = Chrome(options=chrome_options)
+def _cache_chromedriver(webdriver, cache_path):
+    """Keeps a copy of the driver's freshly patched chromedriver binary."""
+    patched_path = getattr(getattr(webdriver, "patcher", None), "executable_path", None)
+    if not patched_path or not os.path.isfile(patched_path):
+        return
+    cache_dir = os.path.dirname(cache_path)
+    os.makedirs(cache_dir, exist_ok=True)
+    # Copy then rename, so concurrent launches never see a partial binary.
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+    os.close(fd)
+    try:
+        shutil.copy2(patched_path, temp_path)
+        os.replace(temp_path, cache_path)
+        logger.info("Cached patched chromedriver")
+    except OSError:
+        logger.exception("Cannot cache patched chromedriver")
+        with suppress(FileNotFoundError):
+            os.remove(temp_path)
+
+
+def get_webdriver(
+    headless=False,
+    session_path=None,
+    lean=False,
+    log_network=False,
+    chromedriver_cache_path=CHROMEDRIVER_CACHE_PATH,
+):
+    from selenium.common.exceptions import SessionNotCreatedException
+    from undetected_chromedriver import Chrome
+
+    # Chrome options can't be reused between launch attempts.
+    def launch(driver_executable_path=None):
+        return Chrome(
+            options=_get_chrome_options(session_path, lean, log_network),
+            headless=headless,
+            driver_executable_path=driver_executable_path,
+        )
+
+    webdriver = None
+    if chromedriver_cache_path and os.path.isfile(chromedriver_cache_path):
+        try:
+            webdriver = launch(chromedriver_cache_path)
+        except SessionNotCreatedException:
+            # Most likely Chrome updated past the cached driver's version.
+            logger.info("Cached chromedriver is out of date; replacing it")
+            # Other launches may have found it out of date and removed it.
+            with suppress(FileNotFoundError):
+                os.remove(chromedriver_cache_path)
+    if webdriver is None:
+        webdriver = launch()
+        if chromedriver_cache_path:
+            _cache_chromedriver(webdriver, chromedriver_cache_path)
+    if lean:
+        add_tab_setup(webdriver, "Network.enable", {})
+        add_tab_setup(webdriver, "Network.setBlockedURLs", {"urls": LEAN_BLOCKED_URLS})
+    # from selenium_stealth import stealth
     # stealth(
     #     webdriver,
     #     languages=["en-US", "en"],
@@ -31,53 +165,191 @@ def get_webdriver(headless=False, session_path=None):
     return webdriver
 
 
+# CDP commands which only apply to the tab they're sent to, per driver, to
+# send again to each tab opened with open_tab.
+_tab_setups = weakref.WeakKeyDictionary()
+
+
+def add_tab_setup(driver, command, params):
+    """Sends a per-tab CDP command now, and to every tab open_tab opens."""
+    driver.execute_cdp_cmd(command, params)
+    _tab_setups.setdefault(driver, []).append((command, params))
+
+
+def open_tab(driver):
+    """Opens a new tab, switches to it, and repeats the driver's tab setup.
+
+    Call before the tab's first navigation, so the setup applies to it.
+    """
+    driver.switch_to.new_window("tab")
+    for command, params in _tab_setups.get(driver, ()):
+        driver.execute_cdp_cmd(command, params)
+
+
+def get_transferred_bytes(driver):
+    """Sums network bytes received since the last call.
+
+    Requires a driver created with log_network=True.
+    """
+    total = 0
+    for entry in driver.get_log("performance"):
+        message = json.loads(entry["message"])["message"]
+        if message["method"] == "Network.loadingFinished":
+            total += message["params"].get("encodedDataLength", 0)
+    return total
+
+
+def get_browser_processes(driver):
+    """Returns the chromedriver and Chrome processes backing the driver."""
+    import psutil
+
+    pids = []
+    # Replayed drivers have no processes behind them.
+    service = getattr(driver, "service", None)
+    if service:
+        pids.append(service.process.pid)
+    # undetected_chromedriver launches Chrome separately from chromedriver.
+    browser_pid = getattr(driver, "browser_pid", None)
+    if browser_pid:
+        pids.append(browser_pid)
+    processes = {}
+    for pid in pids:
+        try:
+            root = psutil.Process(pid)
+            for p in [root] + root.children(recursive=True):
+                processes[p.pid] = p
+        except psutil.NoSuchProcess:
+            pass
+    return list(processes.values())
+
+
+def click_element(driver, element):
+    """Moves the mouse to the element and clicks it, without any pacing."""
+    from selenium.webdriver import ActionChains
+
+    ActionChains(driver).move_to_element(element).click().perform()
+
+
+@traced
 def is_visible(element):
     return element and element.is_displayed()
 
 
-def get_element_by_id(driver, id):
+class ImplicitWaitStats:
+    """Counts time the blocking finders spent waiting on missing elements."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.seconds = 0.0
+        self.timeouts = 0
+
+    def add_timeout(self, seconds):
+        self.seconds += seconds
+        self.timeouts += 1
+
+    def log_summary(self):
+        logger.info(
+            "Spent {:.1f}s in {} implicit wait timeouts".format(
+                self.seconds, self.timeouts
+            )
+        )
+
+
+implicit_wait_stats = ImplicitWaitStats()
+
+# The implicit wait last set per driver, so probes can restore it without an
+# extra round trip to chromedriver.
+_implicit_waits = weakref.WeakKeyDictionary()
+
+
+def set_implicit_wait(driver, seconds):
+    driver.implicitly_wait(seconds)
+    _implicit_waits[driver] = seconds
+
+
+def get_implicit_wait(driver):
+    if driver not in _implicit_waits:
+        _implicit_waits[driver] = driver.timeouts.implicit_wait
+    return _implicit_waits[driver]
+
+
+@contextmanager
+def no_implicit_wait(driver):
+    """Drops the implicit wait to zero for the duration of the block.
+
+    Use for existence checks of elements which are usually absent, so that
+    a miss returns immediately instead of blocking for the implicit wait.
+    """
+    previous = get_implicit_wait(driver)
+    if not previous:
+        yield
+        return
+    set_implicit_wait(driver, 0)
     try:
-        return driver.find_element(By.ID, id)
-    except NoSuchElementException:
-        pass
-    return None
+        yield
+    finally:
+        set_implicit_wait(driver, previous)
 
 
-def get_element_by_name(driver, name):
+def probe_element(driver, value, by=BY_XPATH):
+    """Returns the element if it is present right now, otherwise None."""
+    with no_implicit_wait(driver):
+        try:
+            return driver.find_element(by, value)
+        except NoSuchElementException:
+            return None
+
+
+def probe_elements(driver, value, by=BY_XPATH):
+    """Returns the elements present right now, without waiting."""
+    with no_implicit_wait(driver):
+        return driver.find_elements(by, value)
+
+
+def _find_element(driver, by, value):
+    start_time = time.monotonic()
     try:
-        return driver.find_element(By.NAME, name)
+        return driver.find_element(by, value)
     except NoSuchElementException:
-        pass
+        implicit_wait_stats.add_timeout(time.monotonic() - start_time)
     return None
 
 
+def _find_elements(driver, by, value):
+    start_time = time.monotonic()
+    elements = driver.find_elements(by, value)
+    if not elements:
+        implicit_wait_stats.add_timeout(time.monotonic() - start_time)
+    return elements
+
+
+@traced(empty_is_timeout=True)
+def get_element_by_id(driver, id):
+    return _find_element(driver, BY_ID, id)
+
+
+@traced(empty_is_timeout=True)
+def get_element_by_name(driver, name):
+    return _find_element(driver, BY_NAME, name)
+
+
+@traced(empty_is_timeout=True)
 def get_element_by_xpath(driver, xpath):
-    try:
-        return driver.find_element(By.XPATH, xpath)
-    except NoSuchElementException:
-        pass
-    return None
+    return _find_element(driver, BY_XPATH, xpath)
 
 
+@traced(empty_is_timeout=True)
 def get_element_by_link_text(driver, link_text):
-    try:
-        return driver.find_element(By.LINK_TEXT, link_text)
-    except NoSuchElementException:
-        pass
-    return None
+    return _find_element(driver, BY_LINK_TEXT, link_text)
 
 
+@traced(empty_is_timeout=True)
 def get_elements_by_class_name(driver, class_name):
-    try:
-        return driver.find_elements(By.CLASS_NAME, class_name)
-    except NoSuchElementException:
-        pass
-    return None
+    return _find_elements(driver, BY_CLASS_NAME, class_name)
 
 
+@traced(empty_is_timeout=True)
 def get_elements_by_xpath(driver, xpath):
-    try:
-        return driver.find_elements(By.XPATH, xpath)
-    except NoSuchElementException:
-        pass
-    return None
+    return _find_elements(driver, BY_XPATH, xpath)
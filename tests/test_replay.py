@@ -0,0 +1,69 @@
+import argparse
+import os
+import tempfile
+import unittest
+
+from safewayclipclip.replay import (
+    read_trace,
+    CommandRecorder,
+    REDACTED,
+    REPLAYED_ARGS,
+)
+
+ELEMENT = {"element-6066-11e4-a52e-4f735466cecf": "profile-name"}
+
+
+class FakeExecutor:
+    """Answers commands from canned responses, as chromedriver would."""
+
+    def __init__(self, responses):
+        self.responses = responses
+
+    def execute(self, command, params):
+        return self.responses[command]
+
+
+class FakeDriver:
+    def __init__(self, responses):
+        self.command_executor = FakeExecutor(responses)
+
+
+def record_is_logged_in(profile_name):
+    """Records the commands cli.is_logged_in sends, and returns the trace."""
+    args = argparse.Namespace(**{name: None for name in REPLAYED_ARGS})
+    recorder = CommandRecorder(args)
+    driver = FakeDriver(
+        {
+            "findElement": {"value": ELEMENT},
+            "executeScript": {"value": True},
+            "getElementText": {"value": profile_name},
+        }
+    )
+    recorder.attach(driver)
+    execute = driver.command_executor.execute
+    execute("findElement", {"using": "xpath", "value": "//a/span[1]"})
+    execute("executeScript", {"script": "/* isDisplayed */", "args": [ELEMENT]})
+    execute("getElementText", {"id": "profile-name"})
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        filename = os.path.join(trace_dir, "trace.jsonl")
+        recorder.write(filename)
+        with open(filename) as f:
+            text = f.read()
+        _, entries = read_trace(filename)
+    return text, entries
+
+
+class RedactionTest(unittest.TestCase):
+    def test_profile_name_is_not_recorded(self):
+        text, entries = record_is_logged_in("Kevin Prouty")
+        self.assertNotIn("Kevin", text)
+        self.assertEqual(entries[-1]["response"]["value"], REDACTED)
+
+    def test_sign_in_text_is_kept_for_replays(self):
+        _, entries = record_is_logged_in("Sign in")
+        self.assertEqual(entries[-1]["response"]["value"], "Sign in")
+
+
+if __name__ == "__main__":
+    unittest.main()
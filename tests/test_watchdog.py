@@ -0,0 +1,35 @@
+import importlib.util
+import threading
+import unittest
+from unittest import mock
+
+from safewayclipclip.watchdog import BrowserWatchdog
+
+
+@unittest.skipUnless(importlib.util.find_spec("psutil"), "needs psutil")
+class BrowserWatchdogTest(unittest.TestCase):
+    def test_keeps_sampling_after_a_failed_sample(self):
+        sampled_again = threading.Event()
+        calls = []
+
+        def get_browser_processes(driver):
+            calls.append(driver)
+            if len(calls) == 1:
+                raise AttributeError("'NoneType' object has no attribute 'pid'")
+            sampled_again.set()
+            return []
+
+        with mock.patch(
+            "safewayclipclip.watchdog.get_browser_processes", get_browser_processes
+        ):
+            watchdog = BrowserWatchdog(object(), interval_s=0.01)
+            with self.assertLogs("safewayclipclip.watchdog", "ERROR"):
+                watchdog.start()
+                self.assertTrue(sampled_again.wait(5))
+            watchdog.stop()
+
+        self.assertGreaterEqual(watchdog.samples, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()